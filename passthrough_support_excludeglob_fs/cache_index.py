@@ -0,0 +1,125 @@
+import os
+from threading import Lock
+from typing import Dict, Set
+
+
+def _key(path: str) -> str:
+    # The cache tier may be case insensitive (Windows)
+    return os.path.normcase(path)
+
+
+def _join(directory: str, name: str) -> str:
+    return directory.rstrip('/') + '/' + name
+
+
+class CacheTierIndex:
+    """
+    In-memory index of the files and directories stored in the cache tier.
+
+    The index is built by a scan of cache_dir at mount time and kept current by the filesystem's own
+    operations through `refresh`. It answers "does this path exist in the cache tier?" and "what does
+    this directory contain in the cache tier?" without any syscall. Entries created directly in cache_dir
+    while the filesystem is mounted are not seen until the next mount.
+    """
+
+    def __init__(self, cache_dir: str, enable: bool = True) -> None:
+        self.cache_dir: str = cache_dir
+        self.enable: bool = enable
+        # Normalized FUSE paths of every entry, '/' included
+        self.entries: Set[str] = set()
+        # Normalized FUSE path of every directory -> names of its children as stored on disk
+        self.children: Dict[str, Set[str]] = {}
+        self.lock = Lock()
+        self.lookups: int = 0
+        if enable:
+            self.scan()
+
+    def get_cache_path(self, path: str) -> str:
+        return os.path.join(self.cache_dir, path.lstrip('/'))
+
+    def scan(self) -> None:
+        """
+        Rebuild the whole index from the content of cache_dir.
+        """
+        with self.lock:
+            self.entries = {_key('/')}
+            self.children = {_key('/'): set()}
+            self._scan_directory('/')
+
+    def _scan_directory(self, directory: str) -> None:
+        """Register the content of directory recursively, the lock must be held."""
+        for dirpath, dirnames, filenames in os.walk(self.get_cache_path(directory)):
+            relative = os.path.relpath(dirpath, self.get_cache_path(directory))
+            current = directory if relative == '.' else _join(directory, relative.replace(os.sep, '/'))
+            names = set(dirnames) | set(filenames)
+            self.children[_key(current)] = names
+            for name in names:
+                self.entries.add(_key(_join(current, name)))
+
+    def contains(self, path: str) -> bool:
+        self.lookups += 1
+        return _key(path) in self.entries
+
+    def children_of(self, path: str) -> Set[str] | None:
+        """
+        Return a copy of the names stored below the directory path in the cache tier, or None if the directory does not exist there.
+        """
+        with self.lock:
+            names = self.children.get(_key(path))
+            return set(names) if names is not None else None
+
+    def add(self, path: str, is_dir: bool = False) -> None:
+        with self.lock:
+            self._add(path, is_dir)
+
+    def _add(self, path: str, is_dir: bool) -> None:
+        if is_dir:
+            self.children.setdefault(_key(path), set())
+        # An entry implies all its ancestors directories
+        while path.rstrip('/'):
+            parent, _, name = path.rstrip('/').rpartition('/')
+            parent = parent or '/'
+            self.entries.add(_key(path))
+            self.children.setdefault(_key(parent), set()).add(name)
+            path = parent
+
+    def remove(self, path: str) -> None:
+        with self.lock:
+            self._remove(path)
+
+    def _remove(self, path: str) -> None:
+        parent, _, name = path.rstrip('/').rpartition('/')
+        siblings = self.children.get(_key(parent or '/'))
+        if siblings is not None:
+            siblings.discard(name)
+        # Forget the whole subtree, walking it through the index itself
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            self.entries.discard(_key(current))
+            names = self.children.pop(_key(current), None)
+            if names:
+                stack.extend(_join(current, child) for child in names)
+
+    def refresh(self, path: str) -> None:
+        """
+        Probe the cache tier for path and update the index accordingly, including everything below it if it is a directory.
+        Must be called after every operation that may have created, removed or moved path in the cache tier.
+        """
+        if not self.enable:
+            return
+        if not path.rstrip('/'):
+            self.scan()
+            return
+        cache_path = self.get_cache_path(path)
+        with self.lock:
+            self._remove(path)
+            if os.path.lexists(cache_path):
+                is_dir = os.path.isdir(cache_path) and not os.path.islink(cache_path)
+                self._add(path, is_dir)
+                if is_dir:
+                    self._scan_directory(path)
+
+    def stats(self) -> Dict[str, int | bool]:
+        with self.lock:
+            return {'enable': self.enable, 'entries': len(self.entries), 'directories': len(self.children), 'lookups': self.lookups}
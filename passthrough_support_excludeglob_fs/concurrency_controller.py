@@ -1,28 +1,316 @@
-from multiprocessing.managers import SyncManager
-from multiprocessing.managers import DictProxy
-from threading import Lock
-from typing import Any, Dict
+import time
+from threading import Condition, Event, Lock
+from typing import Any, Callable, ContextManager, Dict, Hashable, List, Tuple
 from contextlib import nullcontext
-class ConcurrencyControllerMixIn:
-    """Mixin for controlling concurrency in file system operations."""
+
+# Operations that only read a path and can run concurrently on it
+SHARED_OPERATIONS = frozenset(['getattr','access','readlink'])
+# Operations that modify a path and run alone on it
+EXCLUSIVE_OPERATIONS = frozenset(['rename','write','truncate','utimens','unlink','fsync','open','create','chmod','chown','release','rmdir','mkdir','symlink'])
+# read is positional (pread) and needs no lock
+LOCKED_OPERATIONS = SHARED_OPERATIONS | EXCLUSIVE_OPERATIONS
+# Idempotent operations whose identical concurrent calls share one execution
+# readdir is not: each open directory streams its own entries
+COALESCED_OPERATIONS = frozenset(['getattr','access','readlink','statfs'])
+# Operations adding or removing an entry of a directory, they also hold the parent directory in shared mode
+PARENT_OPERATIONS = frozenset(['mkdir','create','unlink','rmdir','symlink','rename'])
+
+
+class RWLock:
+    """
+    Reader/writer lock with writer preference: new readers wait while a writer is waiting, so writers never starve.
+    """
+    __slots__ = ('condition', 'readers', 'writer', 'waiting_writers')
 
     def __init__(self) -> None:
-        #Check if SyncManager is already running
-        self.manager = SyncManager()
-        self.manager.start()  # Start the manager's server
-        print("Started new manager.", flush=True)
-        self.dict_of_locks: DictProxy[str, Lock] = self.manager.dict()
-    def get_filelock_for_path(self, path: str) -> Lock:
-        #Check if path is already in dict
-        #print content of dict
-        if path in self.dict_of_locks:
-            return self.dict_of_locks[path]
-        #Create a lock for the path
+        self.condition = Condition(Lock())
+        self.readers: int = 0
+        self.writer: bool = False
+        self.waiting_writers: int = 0
+
+    def acquire_shared(self) -> bool:
+        """Returns True if the lock was not immediately available."""
+        with self.condition:
+            contended = self.writer or bool(self.waiting_writers)
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+            return contended
+
+    def release_shared(self) -> None:
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_exclusive(self) -> bool:
+        """Returns True if the lock was not immediately available."""
+        with self.condition:
+            contended = self.writer or bool(self.readers)
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+            return contended
+
+    def release_exclusive(self) -> None:
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+
+class _PathLock:
+    __slots__ = ('lock', 'users')
+
+    def __init__(self) -> None:
+        self.lock = RWLock()
+        # Threads holding or waiting for the lock
+        self.users: int = 0
+
+
+class PathLockTable:
+    """
+    In-process table of per-path reader/writer locks.
+
+    Entries are reference counted: a path has an entry only while a thread holds or waits for its lock,
+    so the table size is bounded by the number of concurrent operations, not by the number of paths ever touched.
+    """
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, _PathLock] = {}
+        self.mutex = Lock()
+
+    def acquire(self, path: str, exclusive: bool = True) -> bool:
+        """Returns True if the lock was not immediately available."""
+        with self.mutex:
+            entry = self.entries.get(path)
+            if entry is None:
+                entry = self.entries[path] = _PathLock()
+            entry.users += 1
+        if exclusive:
+            return entry.lock.acquire_exclusive()
+        return entry.lock.acquire_shared()
+
+    def release(self, path: str, exclusive: bool = True) -> None:
+        with self.mutex:
+            entry = self.entries[path]
+            entry.users -= 1
+            if not entry.users:
+                # Nobody waits for it, a later acquire creates a new entry
+                del self.entries[path]
+        if exclusive:
+            entry.lock.release_exclusive()
         else:
-            lock = self.manager.Lock()
-            #Add lock to dict
-            self.dict_of_locks[path] = lock
-            return lock
+            entry.lock.release_shared()
+
+    def acquire_all(self, requests: List[Tuple[str, bool]]) -> List[str]:
+        """
+        Acquire several locks, given as (path, exclusive) pairs sorted by `lock_order`. Returns the paths whose lock was not immediately available.
+        """
+        contended = []
+        for index, (path, exclusive) in enumerate(requests):
+            try:
+                if self.acquire(path, exclusive):
+                    contended.append(path)
+            except BaseException:
+                self.release_all(requests[:index])
+                raise
+        return contended
+
+    def release_all(self, requests: List[Tuple[str, bool]]) -> None:
+        for path, exclusive in reversed(requests):
+            self.release(path, exclusive)
+
+    def locked(self, path: str, exclusive: bool = True) -> '_PathLockGuard':
+        return _PathLockGuard(self, path, exclusive)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class _PathLockGuard:
+    __slots__ = ('table', 'path', 'exclusive')
+
+    def __init__(self, table: PathLockTable, path: str, exclusive: bool) -> None:
+        self.table = table
+        self.path = path
+        self.exclusive = exclusive
+
+    def __enter__(self) -> None:
+        self.table.acquire(self.path, self.exclusive)
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.table.release(self.path, self.exclusive)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller executes the function, the callers arriving while it runs wait for it
+    and share its result or its exception.
+
+    A call stops accepting new callers when it returns, or earlier when `retire` is called: the dispatcher retires it before
+    releasing the path lock, so that a call arriving after a write to the path never shares a result computed before the write.
+    """
+
+    def __init__(self) -> None:
+        self.calls: Dict[Hashable, _Call] = {}
+        self.lock = Lock()
+        self.executed: int = 0
+        self.coalesced: int = 0
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            call.done.set()
+
+    def retire(self, key: Hashable) -> None:
+        """Stop coalescing new callers into the call running for key, called by its leader."""
+        with self.lock:
+            self.calls.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced, 'in_flight': len(self.calls)}
+
+
+class _OperationLockStats:
+    __slots__ = ('count', 'contended', 'wait_total', 'wait_max', 'hold_total', 'hold_max')
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.contended: int = 0
+        self.wait_total: float = 0.0
+        self.wait_max: float = 0.0
+        self.hold_total: float = 0.0
+        self.hold_max: float = 0.0
+
+
+class LockContentionStats:
+    """
+    Lock wait and hold times per operation type, and the paths on which operations waited the longest.
+
+    The contended paths are tracked in a table of at most `max_paths` entries. When it is full, the entry with the smallest wait
+    time is replaced and its counters are inherited (space-saving algorithm), so the paths reported as the hottest are the right ones
+    even with a bounded table.
+    """
+
+    def __init__(self, max_paths: int = 256) -> None:
+        self.max_paths: int = max_paths
+        self.operations: Dict[str, _OperationLockStats] = {}
+        # path -> [total wait, contended calls]
+        self.paths: Dict[str, List[float]] = {}
+        self.lock = Lock()
+
+    def record(self, op: str, contended_paths: List[str], wait: float, hold: float) -> None:
+        with self.lock:
+            stats = self.operations.get(op)
+            if stats is None:
+                stats = self.operations[op] = _OperationLockStats()
+            stats.count += 1
+            stats.wait_total += wait
+            stats.hold_total += hold
+            if wait > stats.wait_max:
+                stats.wait_max = wait
+            if hold > stats.hold_max:
+                stats.hold_max = hold
+            if not contended_paths:
+                return
+            stats.contended += 1
+            for path in contended_paths:
+                entry = self.paths.get(path)
+                if entry is None:
+                    if len(self.paths) >= self.max_paths:
+                        coldest = min(self.paths, key=lambda key: self.paths[key][0])
+                        entry = self.paths.pop(coldest)
+                    else:
+                        entry = [0.0, 0]
+                    self.paths[path] = entry
+                entry[0] += wait
+                entry[1] += 1
+
+    def stats(self, top: int = 20) -> Dict[str, Any]:
+        with self.lock:
+            operations = {op: {'count': stats.count, 'contended': stats.contended, 'wait_total': stats.wait_total, 'wait_max': stats.wait_max,
+                               'hold_total': stats.hold_total, 'hold_max': stats.hold_max} for op, stats in self.operations.items()}
+            hottest = sorted(self.paths.items(), key=lambda item: item[1][0], reverse=True)[:top]
+            return {'operations': operations, 'hottest_paths': [{'path': path, 'wait_total': wait, 'contended': count} for path, (wait, count) in hottest]}
+
+
+def _parent(path: str) -> str:
+    return path.rstrip('/').rpartition('/')[0] or '/'
+
+
+def lock_order(requests: Dict[str, bool]) -> List[Tuple[str, bool]]:
+    """
+    Sort the (path, exclusive) lock requests of an operation touching several paths in the global lock order:
+    parents before children (depth first), then by path. Every operation acquiring its locks in this order cannot deadlock.
+    """
+    return sorted(requests.items(), key=lambda request: (request[0].rstrip('/').count('/'), request[0]))
+
+
+class ConcurrencyControllerMixIn:
+    """Mixin for controlling concurrency in file system operations."""
+
+    def __init__(self, enable: bool = True, coalesce: bool = True, lock_stats: bool = False) -> None:
+        # Locking is useless when FUSE runs single threaded and nothing else touches the tiers
+        self.locking_enabled: bool = enable
+        self.path_locks = PathLockTable()
+        self.lock_stats: LockContentionStats | None = LockContentionStats() if enable and lock_stats else None
+        # Coalescing needs concurrent callers
+        self.single_flight: SingleFlight | None = SingleFlight() if enable and coalesce else None
+
+    def get_filelock_for_path(self, path: str, exclusive: bool = True) -> ContextManager[None]:
+        if not self.locking_enabled:
+            return nullcontext()
+        return self.path_locks.locked(path, exclusive)
+
+    @staticmethod
+    def lock_requests(op: str, path: str, *args: Any) -> List[Tuple[str, bool]]:
+        """
+        Returns the sorted (path, exclusive) locks needed by an operation adding or removing directory entries.
+        """
+        paths = [path, args[0]] if op == 'rename' else [path]
+        requests: Dict[str, bool] = {}
+        for changed in paths:
+            parent = _parent(changed)
+            if parent != changed:
+                requests.setdefault(parent, False)
+        for changed in paths:
+            requests[changed] = True
+        return lock_order(requests)
+
     def __call__(self, op: str, path: str, *args: Any) -> Any:
         """
         Call the given operation with concurrency control.
@@ -32,14 +320,50 @@ class ConcurrencyControllerMixIn:
             path (str): Path to the file/directory.
             *args: Additional arguments.
         """
-        #Check if operation is a write operation
-        if op in ['rename','write','truncate','utimens','read','getattr','unlink','fsync','open','create','access','chmod','chown','release','readlink','rmdir','mkdir']:
-            #Create a lock for the file
-            lock = self.get_filelock_for_path(path)
-        else:
-            #Create a dumy context manager
-            lock = nullcontext()
+        single_flight = self.single_flight
+        if single_flight is not None and op in COALESCED_OPERATIONS:
+            key = (op, path, *args)
+            return single_flight.do(key, self._call_locked, op, path, *args, retire=lambda: single_flight.retire(key))
+        return self._call_locked(op, path, *args)
+
+    def _call_locked(self, op: str, path: str, *args: Any, retire: Callable[[], None] | None = None) -> Any:
+        """
+        Call the operation holding its path locks. `retire` is called once the operation is done, before the locks are released.
+        """
+        if not self.locking_enabled or op not in LOCKED_OPERATIONS:
+            return getattr(self, op)(path, *args)
+
+        if self.lock_stats is not None:
+            return self._call_instrumented(op, path, *args, retire=retire)
+
+        path_locks = self.path_locks
+        if op in PARENT_OPERATIONS:
+            requests = self.lock_requests(op, path, *args)
+            path_locks.acquire_all(requests)
+            try:
+                return getattr(self, op)(path, *args)
+            finally:
+                path_locks.release_all(requests)
+
+        exclusive = op not in SHARED_OPERATIONS
+        path_locks.acquire(path, exclusive)
+        try:
+            return getattr(self, op)(path, *args)
+        finally:
+            if retire is not None:
+                retire()
+            path_locks.release(path, exclusive)
 
-        with lock:
-            # Perform the operation here
-            return getattr(self, op)(path, *args)
\ No newline at end of file
+    def _call_instrumented(self, op: str, path: str, *args: Any, retire: Callable[[], None] | None = None) -> Any:
+        """Same as the end of `_call_locked`, measuring the time spent waiting for and holding the locks."""
+        requests = self.lock_requests(op, path, *args) if op in PARENT_OPERATIONS else [(path, op not in SHARED_OPERATIONS)]
+        start = time.perf_counter()
+        contended = self.path_locks.acquire_all(requests)
+        acquired = time.perf_counter()
+        try:
+            return getattr(self, op)(path, *args)
+        finally:
+            if retire is not None:
+                retire()
+            self.path_locks.release_all(requests)
+            self.lock_stats.record(op, contended, acquired - start, time.perf_counter() - acquired)
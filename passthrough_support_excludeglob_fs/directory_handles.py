@@ -0,0 +1,94 @@
+from itertools import count, islice
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+# (name, attributes or None) of an entry
+entry_type = Tuple[str, Dict[str, Any] | None]
+# (name, attributes or None, offset of the next entry) as expected by the readdir filler
+dirent_type = Tuple[str, Dict[str, Any] | None, int]
+
+
+class DirectoryHandle:
+    """
+    Position of a directory opened through the filesystem in the stream of its entries.
+
+    The entries are produced lazily by `factory` and numbered from 1, the number of an entry being the offset the kernel passes back
+    to continue after it. Sequential readdir calls resume the stream where the previous one stopped, a seek (rewinddir, seekdir)
+    restarts it and skips the entries before the offset. The kernel serializes the readdir calls of an open directory.
+    """
+    __slots__ = ('path', 'factory', 'iterator', 'offset', 'last')
+
+    def __init__(self, path: str, factory: Callable[[], Iterator[entry_type]]) -> None:
+        self.path: str = path
+        self.factory: Callable[[], Iterator[entry_type]] = factory
+        self.iterator: Iterator[entry_type] | None = None
+        # Number of entries taken from the iterator, and the last one
+        self.offset: int = 0
+        self.last: dirent_type | None = None
+
+    def entries_from(self, offset: int) -> Iterator[dirent_type]:
+        """
+        Yield the entries following offset. The last entry yielded may not fit in the kernel buffer, it is yielded again
+        when the next call asks for it.
+        """
+        if offset == self.offset - 1 and self.last is not None:
+            yield self.last
+        elif self.iterator is None or offset != self.offset:
+            self.restart(offset)
+        for name, attrs in self.iterator:
+            self.offset += 1
+            self.last = (name, attrs, self.offset)
+            yield self.last
+
+    def restart(self, offset: int) -> None:
+        self.close()
+        self.iterator = self.factory()
+        self.offset = sum(1 for _ in islice(self.iterator, offset))
+        self.last = None
+
+    def close(self) -> None:
+        # Closes the scandir iterators of the tiers
+        close = getattr(self.iterator, 'close', None)
+        if close is not None:
+            close()
+        self.iterator = None
+
+
+class DirectoryHandleTable:
+    """
+    Table of the open directories, indexed by the number handed to FUSE as fh by opendir.
+    """
+
+    def __init__(self) -> None:
+        self.handles: Dict[int, DirectoryHandle] = {}
+        self.lock = Lock()
+        # 0 is the fh returned by the default opendir of refuse, it never designates a handle
+        self.numbers = count(1)
+        self.opened: int = 0
+
+    def add(self, path: str, factory: Callable[[], Iterator[entry_type]]) -> int:
+        handle = DirectoryHandle(path, factory)
+        with self.lock:
+            fh = next(self.numbers)
+            self.handles[fh] = handle
+            self.opened += 1
+        return fh
+
+    def get(self, fh: int) -> DirectoryHandle | None:
+        return self.handles.get(fh)
+
+    def remove(self, fh: int) -> None:
+        with self.lock:
+            handle = self.handles.pop(fh, None)
+        if handle is not None:
+            handle.close()
+
+    def close_all(self) -> None:
+        with self.lock:
+            handles, self.handles = self.handles, {}
+        for handle in handles.values():
+            handle.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'open': len(self.handles), 'opened': self.opened}
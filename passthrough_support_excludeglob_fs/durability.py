@@ -0,0 +1,144 @@
+import os
+import time
+import logging
+from threading import Event, Lock, Thread
+from typing import Dict, Literal, Mapping, Tuple
+
+from .file_handles import FileHandle
+from .pattern_matcher import PatternPolicy
+
+durability_type = Literal['none', 'on-fsync-only', 'close', 'periodic']
+
+log = logging.getLogger('passthrough_support_excludeglob_fs')
+
+
+class DurabilityManager:
+    """
+    Decides when the data written through the filesystem is flushed to disk, per mount and per pattern.
+
+    - 'none': never fsync, not even on an explicit fsync() call.
+    - 'on-fsync-only': fsync only on an explicit fsync() call.
+    - 'close': also fsync when a file that was written to is closed.
+    - 'periodic': explicit fsync() calls are honoured, and files written to are fsynced in batches by a background thread every `interval` seconds
+      after they are closed.
+
+    Handles that were never written to are never fsynced on close.
+    """
+
+    def __init__(self, default: durability_type = 'close', patterns: Mapping[str, durability_type] | None = None, interval: float = 5.0) -> None:
+        self.policy: PatternPolicy[durability_type] = PatternPolicy(patterns, default)
+        self.interval: float = interval
+        # Duplicated descriptors of the files written to since the last periodic commit, by (st_dev, st_ino). They are kept open
+        # until the commit, which fsyncs the files even if they were renamed or removed after their close
+        self.pending: Dict[Tuple[int, int], int] = {}
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.fsyncs: int = 0
+        self.skipped_clean: int = 0
+        self.skipped_policy: int = 0
+        self.periodic_commits: int = 0
+        self.fsync_seconds_total: float = 0.0
+        self.fsync_seconds_max: float = 0.0
+        self.periodic: bool = 'periodic' in self.policy.values()
+        self.thread: Thread | None = None
+        self.thread_pid: int | None = None
+
+    def start(self) -> None:
+        """
+        Start the periodic commits. Called in the process serving the mount, a thread started before FUSE forks into the background is lost.
+        """
+        if self.periodic and self.thread is None:
+            self.thread = Thread(target=self._commit_periodically, name='durability', daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+
+    def mode_of(self, path: str) -> durability_type:
+        return self.policy.lookup(path)
+
+    def fsync(self, fd: int, datasync: bool = False) -> None:
+        start = time.perf_counter()
+        if datasync and hasattr(os, 'fdatasync'):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.fsyncs += 1
+            self.fsync_seconds_total += elapsed
+            self.fsync_seconds_max = max(self.fsync_seconds_max, elapsed)
+
+    def on_fsync(self, handle: FileHandle | None, fd: int, datasync: bool = False) -> None:
+        """Explicit fsync() or fdatasync() call."""
+        if handle is not None and handle.durability == 'none':
+            with self.lock:
+                self.skipped_policy += 1
+            return
+        self.fsync(fd, datasync)
+        if handle is not None:
+            handle.dirty = False
+
+    def on_close(self, handle: FileHandle | None, fd: int) -> None:
+        """Called by flush (every close() of the file) and release (last close)."""
+        if handle is None:
+            # Opened before the handle table knew about it, keep the safe behaviour
+            self.fsync(fd)
+            return
+        if not handle.dirty:
+            with self.lock:
+                self.skipped_clean += 1
+            return
+        if handle.durability == 'close':
+            self.fsync(fd)
+            handle.dirty = False
+        elif handle.durability == 'periodic':
+            self._add_pending(fd)
+            handle.dirty = False
+        else:
+            with self.lock:
+                self.skipped_policy += 1
+
+    def _add_pending(self, fd: int) -> None:
+        stat_result = os.fstat(fd)
+        key = (stat_result.st_dev, stat_result.st_ino)
+        with self.lock:
+            if key in self.pending:
+                return
+            try:
+                self.pending[key] = os.dup(fd)
+                return
+            except OSError:
+                # Out of descriptors, sync now rather than never
+                pass
+        self.fsync(fd)
+
+    def commit(self) -> None:
+        """
+        fsync every file written to since the last commit, through the descriptors duplicated when they were closed.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.periodic_commits += 1
+        for fd in pending.values():
+            try:
+                self.fsync(fd)
+            except OSError:
+                log.exception("Periodic fsync of descriptor %d failed", fd)
+            finally:
+                os.close(fd)
+
+    def _commit_periodically(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.commit()
+
+    def shutdown(self) -> None:
+        # Only a thread started by this process can be joined
+        if self.thread is not None and self.thread_pid == os.getpid():
+            self.stop_event.set()
+            self.thread.join()
+        if self.periodic:
+            self.commit()
+
+    def stats(self) -> Dict[str, int | float]:
+        with self.lock:
+            return {'fsyncs': self.fsyncs, 'skipped_clean': self.skipped_clean, 'skipped_policy': self.skipped_policy, 'pending': len(self.pending),
+                    'periodic_commits': self.periodic_commits, 'fsync_seconds_total': self.fsync_seconds_total, 'fsync_seconds_max': self.fsync_seconds_max}
@@ -0,0 +1,128 @@
+import os
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Dict, Literal
+
+from .resolution_cache import tier_type
+if TYPE_CHECKING:
+    from .durability import durability_type
+
+# Caching of an open file by the kernel:
+# - 'direct_io': bypass the page cache, every read and write reaches the filesystem.
+# - 'keep_cache': keep the page cache of the file across opens.
+# - 'noflush': close() does not flush the file, only the last close (release) does.
+open_policy_type = Literal['default', 'direct_io', 'keep_cache', 'noflush']
+
+# os.pread and os.pwrite are not available on Windows
+POSITIONAL_IO = hasattr(os, 'pread')
+# Serializes the seek and read/write pairs of file descriptors without handle
+_fallback_lock = Lock()
+
+
+class FileHandle:
+    """
+    State of a file opened through the filesystem. `path`, `right_path` and `tier` are the ones resolved at open time.
+    """
+    __slots__ = ('fd', 'path', 'right_path', 'tier', 'flags', 'durability', 'dirty', 'open_policy', 'lock')
+
+    def __init__(self, fd: int, path: str, right_path: str, tier: tier_type, flags: int, durability: 'durability_type' = 'close', dirty: bool = False,
+                 open_policy: open_policy_type = 'default') -> None:
+        self.fd: int = fd
+        self.path: str = path
+        self.right_path: str = right_path
+        self.tier: tier_type = tier
+        self.flags: int = flags
+        self.durability: 'durability_type' = durability
+        # Written to since the last fsync
+        self.dirty: bool = dirty
+        self.open_policy: open_policy_type = open_policy
+        # Only needed to emulate positional I/O with lseek
+        self.lock: Lock | None = None if POSITIONAL_IO else Lock()
+
+    def __repr__(self) -> str:
+        return f'FileHandle(fd={self.fd}, path={self.path!r}, tier={self.tier!r}, flags={self.flags:#o})'
+
+
+class FileHandleTable:
+    """
+    Table of the open files, indexed by the file descriptor handed to FUSE as fh.
+
+    Path resolution and permission checks are done once at open time, read and write go straight to the file descriptor.
+    This also keeps files readable and writable after they are unlinked, as on a regular filesystem.
+    """
+
+    def __init__(self) -> None:
+        self.handles: Dict[int, FileHandle] = {}
+        # Number of handles per real path opened
+        self.open_paths: Dict[str, int] = {}
+        self.lock = Lock()
+        self.opened: int = 0
+        self.opened_per_policy: Dict[str, int] = {}
+
+    def add(self, fd: int, path: str, right_path: str, tier: tier_type, flags: int, durability: 'durability_type' = 'close', dirty: bool = False,
+            open_policy: open_policy_type = 'default') -> FileHandle:
+        handle = FileHandle(fd, path, right_path, tier, flags, durability, dirty, open_policy)
+        with self.lock:
+            replaced = self.handles.get(fd)
+            if replaced is not None:
+                self._forget_path(replaced.right_path)
+            self.handles[fd] = handle
+            self.open_paths[right_path] = self.open_paths.get(right_path, 0) + 1
+            self.opened += 1
+            if open_policy != 'default':
+                self.opened_per_policy[open_policy] = self.opened_per_policy.get(open_policy, 0) + 1
+        return handle
+
+    def get(self, fd: int) -> FileHandle | None:
+        return self.handles.get(fd)
+
+    def remove(self, fd: int) -> FileHandle | None:
+        with self.lock:
+            handle = self.handles.pop(fd, None)
+            if handle is not None:
+                self._forget_path(handle.right_path)
+            return handle
+
+    def _forget_path(self, right_path: str) -> None:
+        count = self.open_paths[right_path] - 1
+        if count:
+            self.open_paths[right_path] = count
+        else:
+            del self.open_paths[right_path]
+
+    def is_open(self, right_path: str, recursive: bool = False) -> bool:
+        """
+        Returns True if the real path, or with recursive anything below it, is open through the filesystem.
+        """
+        with self.lock:
+            if right_path in self.open_paths:
+                return True
+            if not recursive:
+                return False
+            prefix = right_path.rstrip(os.sep) + os.sep
+            return any(path.startswith(prefix) for path in self.open_paths)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'open': len(self.handles), 'opened': self.opened, **{f'opened_{policy}': opened for policy, opened in self.opened_per_policy.items()}}
+
+
+def pread(handle: FileHandle | None, fd: int, length: int, offset: int) -> bytes:
+    """
+    Read at offset without moving the file offset, so that concurrent requests on the same file descriptor do not need a lock.
+    """
+    if POSITIONAL_IO:
+        return os.pread(fd, length, offset)
+    with handle.lock if handle is not None else _fallback_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+
+
+def pwrite(handle: FileHandle | None, fd: int, buf: bytes, offset: int) -> int:
+    """
+    Write at offset without moving the file offset, see `pread`.
+    """
+    if POSITIONAL_IO:
+        return os.pwrite(fd, buf, offset)
+    with handle.lock if handle is not None else _fallback_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, buf)
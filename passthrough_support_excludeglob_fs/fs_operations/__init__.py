@@ -14,8 +14,10 @@ from .statfs_operation import statfs_operation
 from .rmdir_operation import rmdir_operation
 from .chown_operation import chown_operation
 from .chmod_operation import chmod_operation
-from .getattr_operation import getattr_operation
+from .getattr_operation import getattr_operation, stat_to_attrs
 from .readdir_operation import readdir_operation
+from .opendir_operation import opendir_operation
+from .releasedir_operation import releasedir_operation
 from .readlink_operation import readlink_operation
 from .mkdir_operation import mkdir_operation
 from .symlink_operation import symlink_operation
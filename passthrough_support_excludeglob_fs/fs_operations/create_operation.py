@@ -1,11 +1,13 @@
 import os
 from .mkdir_operation import makedirs
+from .open_operation import register_handle
 
-def create_operation(self, path, mode):
+def create_operation(self, path, mode, fi=None):
     right_path = self.get_right_path(path)
     makedirs(self, os.path.dirname(right_path), exist_ok=True)
     flags = os.O_RDWR | os.O_CREAT
     if os.name == 'nt':
         flags |= os.O_BINARY
     fd = os.open(right_path, flags, mode)
+    register_handle(self, fd, path, right_path, flags, fi)
     return fd
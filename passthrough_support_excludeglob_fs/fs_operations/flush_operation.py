@@ -1,5 +1,7 @@
-import os
-
-
 def flush_operation(self, path, fh):
-    os.fsync(fh)
+    handle = self.file_handles.get(fh)
+    #libfuse 2 cannot ask the kernel not to send flush, answer it without doing anything
+    if handle is not None and handle.open_policy == 'noflush':
+        return
+    #Whether the file is fsynced depends on the durability policy and on whether it was written to
+    self.durability.on_close(handle, fh)
@@ -1,2 +1,3 @@
 def fsync_operation(self, path, fdatasync, fh):
-    return self.flush(path, fh)
+    self.durability.on_fsync(self.file_handles.get(fh), fh, bool(fdatasync))
+    return 0
@@ -2,21 +2,35 @@ import os
 import errno
 from refuse.high import FuseOSError
 
-def getattr_operation(self, path, fh=None):
-    right_path = self.get_right_path(path)
+def getattr_operation(self, path, fh=None, migrate=True):
+    #Path recently found in neither tier
+    if self.negative_cache.contains(path):
+        raise FuseOSError(errno.ENOENT)
+    #Filled by a previous getattr or the listing of its directory
+    attrs = self.attr_cache.get(path)
+    if attrs is not None:
+        return attrs
+    generation = self.attr_cache.generation
+    right_path = self.get_right_path(path, migrate)
     if not os.path.lexists(right_path):
         #Support symlink backed by lnk file
         if self.symlink_creation_windows == 'create_lnkfile' and os.name == 'nt':
             if not path.endswith('.lnk'):
-                return getattr_operation(self, path + '.lnk', fh)
+                return getattr_operation(self, path + '.lnk', fh, migrate)
+        self.forget_resolution(path)
+        self.negative_cache.add(path)
         raise FuseOSError(errno.ENOENT)
-    st = os.lstat(right_path)
-   
+    attrs = stat_to_attrs(self, path, os.lstat(right_path))
+    #A misplaced path must still be resolved, and migrated, by the next getattr
+    if migrate:
+        self.attr_cache.set(path, attrs, generation)
+    return attrs
+
+def stat_to_attrs(self, path, st):
+    st_dict = {'st_atime': st.st_atime, 'st_ctime': st.st_ctime, 'st_gid': st.st_gid, 'st_mtime': st.st_mtime, 'st_nlink': st.st_nlink,
+               'st_size': st.st_size, 'st_uid': st.st_uid, 'st_mode': st.st_mode, 'st_birthtime': getattr(st, 'st_birthtime', 0),
+               'st_ino': st.st_ino, 'st_dev': st.st_dev}
     #Edit st to make user RWX perm
-    st_dict = dict((key, getattr(st, key,0)) for key in (
-        'st_atime', 'st_ctime', 'st_gid', 'st_mtime',
-        'st_nlink', 'st_size', 'st_uid','st_mode','st_birthtime','st_ino','st_dev'))
-    #add st_birthtime to st_dict
     if os.name == 'nt':
         st_dict['st_mode'] = st_dict['st_mode'] | 0o777
         #Support symlink backed by lnk file
@@ -11,7 +11,8 @@ def mkdir_operation(self, path, mode) -> None:
     parent_dir_right_path = os.path.dirname(right_path)
     #If access to parent directory is not allowed, raise an error
     #We intentionallty check against os.R_OK instead of os.W_OK because we want to create the directory even if the parent directory is not writable to prevent bug in the translation of Unix permissions to Windows permissions
-    if not _access(self,parent_dir, os.R_OK):
+    #With default_permissions, the kernel already checked the parent directory
+    if not self.default_permissions and not _access(self,parent_dir, os.R_OK):
         raise FuseOSError(errno.ENOENT)
     makedirs(self,parent_dir_right_path, exist_ok=True)
     os.mkdir(right_path, mode)
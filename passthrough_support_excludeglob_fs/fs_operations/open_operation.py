@@ -7,23 +7,56 @@ if os.name == 'nt':
     # Define INVALID_HANDLE_VALUE
     INVALID_HANDLE_VALUE = c_void_p(-1).value
 
-def open_operation(self, path, flags) -> int:
-    right_path = self.get_right_path(path)
+ACCESS_MODE = os.O_RDONLY | os.O_WRONLY | os.O_RDWR
+
+def open_operation(self, path, flags, fi=None) -> int:
+    if self.writeback_cache:
+        #The kernel appends itself, sending the offsets of the end of file it knows
+        flags &= ~os.O_APPEND
+        #It also reads the pages it only partially writes
+        if flags & ACCESS_MODE == os.O_WRONLY:
+            try:
+                return _open(self, path, flags & ~ACCESS_MODE | os.O_RDWR, fi)
+            except PermissionError:
+                #Write-only file, the pages are then written whole
+                pass
+    return _open(self, path, flags, fi)
+
+def _open(self, path, flags, fi=None) -> int:
+    #O_TRUNC discards the content, no need to move it to the right tier first
+    right_path = self.get_right_path(path, migrate=not flags & os.O_TRUNC)
     
     # Check if it's a symbolic link
     if stat.S_ISLNK(os.lstat(right_path).st_mode):
-        return self.open(self.readlink(path), flags)
+        return self.open(self.readlink(path), flags, fi)
     
     # Handle file existence and opening
     if os.path.lexists(right_path):
-        # flags |= os.O_DIRECT
-        return _open_windows(right_path, flags) if os.name == 'nt' else os.open(right_path, flags)
-    
+        fd = _open_windows(right_path, flags) if os.name == 'nt' else os.open(right_path, flags)
     # Handle file creation if it does not exist
-    if flags & os.O_CREAT:
-        return os.open(right_path, flags, mode=0o777)
-    
-    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+    elif flags & os.O_CREAT:
+        fd = os.open(right_path, flags, mode=0o777)
+    else:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+    register_handle(self, fd, path, right_path, flags, fi)
+    return fd
+
+def register_handle(self, fd, path, right_path, flags, fi=None):
+    """
+    Remember the resolved path of an open file, so that read and write use the file descriptor directly,
+    and set the caching flags of its open policy in the FUSE file info structure, when given.
+    """
+    tier = 'cache' if right_path == self.get_cache_path(path) else 'full'
+    #Creating or truncating the file changes it even if it is never written to
+    dirty = bool(flags & (os.O_CREAT | os.O_TRUNC))
+    open_policy = self.open_policy.lookup(path)
+    #Only set the flags, the mount-wide direct_io, kernel_cache and auto_cache options are applied by libfuse afterwards
+    if fi is not None:
+        if open_policy == 'direct_io':
+            fi.direct_io = 1
+        elif open_policy == 'keep_cache':
+            fi.keep_cache = 1
+    return self.file_handles.add(fd, path, right_path, tier, flags, self.durability.mode_of(path), dirty, open_policy)
 
 def _open_windows(path, flags):
     FILE_ATTRIBUTE_NORMAL = 0x80 | 0x20  # Normal filew with backup semantics
@@ -0,0 +1,4 @@
+from .readdir_operation import iter_dirents
+
+def opendir_operation(self, path):
+    return self.directory_handles.add(path, lambda: iter_dirents(self, path))
@@ -2,15 +2,15 @@ import os
 import errno
 from refuse.high import FuseOSError
 from .access_operation import _access
+from ..file_handles import pread
 
 def read_operation(self, path, length, offset, fh):
-    if not _access(self, path, os.R_OK):
-        raise FuseOSError(errno.EACCES)
-    
-    right_path = self.get_right_path(path)
+    #Permissions were checked and the path resolved when the file was opened
+    handle = self.file_handles.get(fh)
+    if handle is None:
+        if not self.default_permissions and not _access(self, path, os.R_OK):
+            raise FuseOSError(errno.EACCES)
+        if not os.path.lexists(self.get_right_path(path)):
+            raise FuseOSError(errno.ENOENT)
 
-    if os.path.lexists(right_path):
-        os.lseek(fh, offset, os.SEEK_SET)
-        return os.read(fh, length)
-    else:
-        raise FuseOSError(errno.ENOENT)
+    return pread(handle, fh, length, offset)
@@ -1,14 +1,91 @@
 import os
+from ..directory_handles import DirectoryHandle
+from ..listing_cache import directory_validator
+from .getattr_operation import stat_to_attrs
 
-def readdir_operation(self, path, fh):
-    full_path = self.get_full_path(path)
-    cache_path = self.get_cache_path(path)
-    dirents = [".", ".."]
-    if os.path.isdir(full_path):
-        dirents.extend(os.listdir(full_path))
-    if os.path.isdir(cache_path):
-        dirents.extend(os.listdir(cache_path))
+def readdir_operation(self, path, fh, offset=None):
+    if offset is None:
+        # Called without offset support, libfuse buffers the whole listing
+        return ((name, attrs, 0) for name, attrs in iter_dirents(self, path))
+    handle = self.directory_handles.get(fh)
+    if handle is None:
+        # Not opened through opendir, stream the listing from offset without keeping the position
+        handle = DirectoryHandle(path, lambda: iter_dirents(self, path))
+    return handle.entries_from(offset)
+
+def iter_dirents(self, path):
+    """
+    Yield the (name, attributes) of the entries of both tiers, streamed with os.scandir. Only the names of the cache tier are held in memory
+    to deduplicate the entries present in both tiers, the root tier (usually the largest) is only materialized to be stored in the
+    directory listing cache, if it fits. A cached listing whose directories did not change is served without scanning them.
+
+    With readdir_attrs, the attributes of the entries stored in the tier they belong to are read during the scan and put in the attribute
+    cache, so that the getattr calls following a listing (ls -l, find, rsync) are answered from memory.
+    """
     #Support symlink backed by lnk file
-    if self.symlink_creation_windows == 'create_lnkfile' and os.name == 'nt':
-        dirents = [entry[:-4] if entry.endswith('.lnk') else entry for entry in dirents]
-    return set(dirents)
+    strip_lnk = self.symlink_creation_windows == 'create_lnkfile' and os.name == 'nt'
+    def display_name(name):
+        return name[:-4] if strip_lnk and name.endswith('.lnk') else name
+    with_attrs = self.readdir_attrs and self.attr_cache.enable and not strip_lnk
+    prefix = path.rstrip('/') + '/'
+
+    yield ".", None
+    yield "..", None
+    listed = None
+    if self.listing_cache.enable:
+        #Read before listing, a change during the listing invalidates it
+        validators = (directory_validator(self.get_full_path(path)), directory_validator(self.get_cache_path(path)))
+        names = self.listing_cache.get(path, validators)
+        if names is not None:
+            for name in names:
+                yield name, None
+            return
+        listed = []
+    if self.cache_index.enable:
+        #The cache tier content is known without listing it
+        cache_names = {display_name(name) for name in self.cache_index.children_of(path) or ()}
+    else:
+        cache_names = {display_name(entry.name) for entry in scandir_entries(self.get_cache_path(path))}
+    #Present in both tiers, resolved by get_right_path
+    ambiguous = set()
+    for entry in scandir_entries(self.get_full_path(path)):
+        name = display_name(entry.name)
+        if name in cache_names:
+            ambiguous.add(name)
+            continue
+        if listed is not None:
+            listed.append(name)
+            #Too large to be cached, keep streaming
+            if len(listed) > self.listing_cache.max_entries:
+                listed = None
+        attrs = None
+        if with_attrs and not self.is_excluded(prefix + name):
+            generation = self.attr_cache.generation
+            try:
+                attrs = stat_to_attrs(self, prefix + name, entry.stat(follow_symlinks=False))
+            except FileNotFoundError:
+                continue
+            self.attr_cache.set(prefix + name, attrs, generation)
+        yield name, attrs
+    #Sorted so that a restarted stream lists them in the same order
+    cache_path = self.get_cache_path(path)
+    for name in sorted(cache_names):
+        attrs = None
+        if with_attrs and name not in ambiguous and self.is_excluded(prefix + name):
+            generation = self.attr_cache.generation
+            try:
+                attrs = stat_to_attrs(self, prefix + name, os.lstat(os.path.join(cache_path, name)))
+            except FileNotFoundError:
+                continue
+            self.attr_cache.set(prefix + name, attrs, generation)
+        yield name, attrs
+    if listed is not None:
+        listed.extend(sorted(cache_names))
+        self.listing_cache.set(path, validators, listed)
+
+def scandir_entries(directory):
+    try:
+        with os.scandir(directory) as entries:
+            yield from entries
+    except (FileNotFoundError, NotADirectoryError):
+        return
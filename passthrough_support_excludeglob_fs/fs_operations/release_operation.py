@@ -2,9 +2,16 @@ import os
 import errno
 
 def release_operation(self, path, fh):
+    handle = self.file_handles.remove(fh)
     try:
-        os.fsync(fh)
-        os.close(fh)
+        try:
+            self.durability.on_close(handle, fh)
+        finally:
+            #The kernel forgets the handle whatever the result, the descriptor would leak otherwise
+            os.close(fh)
     except OSError as e:
         if e.errno != errno.EBADF:
             raise
+    finally:
+        if handle is not None and self.migration_queue is not None:
+            self.migration_queue.resume(handle.right_path)
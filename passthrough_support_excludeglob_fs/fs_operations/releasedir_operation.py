@@ -0,0 +1,3 @@
+def releasedir_operation(self, path, fh):
+    self.directory_handles.remove(fh)
+    return 0
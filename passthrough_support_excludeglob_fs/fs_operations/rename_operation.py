@@ -6,7 +6,34 @@ import traceback
 from refuse.high import FuseOSError
 from .access_operation import _access
 from .mkdir_operation import makedirs
-from .unlink_operation import unlink_operation
+from .getattr_operation import getattr_operation
+from .readdir_operation import iter_dirents
+from ..migration import is_real_directory, replace_across_tiers
+
+def _overwritten_destination(self, path):
+    """
+    Returns the real path a rename must write path to, in the tier path belongs to, and the misplaced copy of path in the other tier if any.
+    An existing destination is replaced anyway, so a misplaced one is not moved to the right tier first. It must only be removed once
+    the rename has succeeded, see _remove_misplaced_destination.
+    """
+    full_path = self.get_full_path(path)
+    cache_path = self.get_cache_path(path)
+    right_path, misplaced_path = (cache_path, full_path) if self.is_excluded(path) else (full_path, cache_path)
+    if os.path.lexists(misplaced_path) and not os.path.isdir(misplaced_path):
+        return right_path, misplaced_path
+    return right_path, None
+
+def _remove_misplaced_destination(misplaced_path):
+    """
+    Remove the misplaced copy of a destination replaced by a rename, which would otherwise shadow or duplicate the new file.
+    """
+    if misplaced_path is None:
+        return
+    try:
+        os.unlink(misplaced_path)
+    except FileNotFoundError:
+        pass
+
 def rename_operation(self, old, new):
     if old in self.renameExcludedSourceFiles:
         self.renameExcludedSourceFiles.remove(old)
@@ -22,11 +49,12 @@ def rename_operation(self, old, new):
         new = new + '.lnk'
 
     try:
-        if not _access(self, old, os.R_OK):
+        #The source is moved and the destination replaced, neither has to be migrated to its right tier first
+        if not _access(self, old, os.R_OK, migrate=False):
             raise FuseOSError(errno.ENOENT)
 
         try:
-            if _access(self, new, os.R_OK):
+            if _access(self, new, os.R_OK, migrate=False):
                 if not self.overwrite_rename_dest and 'fuse_hidden' not in old:
                     raise FuseOSError(errno.EEXIST)
         except FuseOSError as e:
@@ -35,22 +63,30 @@ def rename_operation(self, old, new):
             else:
                 pass
 
+        right_old = self.get_right_path(old, migrate=False)
+        if not self.tiers_share_device and is_real_directory(right_old) and self.file_handles.is_open(right_old, recursive=True):
+            #Its files may be copied to the other tier one by one, failing midway would leave it split between old and new
+            raise FuseOSError(errno.EXDEV)
+
         def recursive_copy(old_path, new_path):
-            right_old_path = self.get_right_path(old_path)
-            right_new_path = self.get_right_path(new_path)
-            if stat.S_ISDIR(self.getattr(old_path)['st_mode']):  # Directory
-                self.mkdir(new_path, self.getattr(old_path)['st_mode'])
-                for item in self.readdir(old_path, None):
+            right_old_path = self.get_right_path(old_path, migrate=False)
+            old_mode = getattr_operation(self, old_path, migrate=False)['st_mode']
+            if stat.S_ISDIR(old_mode):  # Directory
+                self.mkdir(new_path, old_mode)
+                #Listed before the entries are moved away
+                for item in [name for name, _ in iter_dirents(self, old_path)]:
                     if item not in ['.', '..']:
                         recursive_copy(os.path.join(old_path, item), os.path.join(new_path, item))
                 self.rmdir(old_path)
-            elif stat.S_ISLNK(self.getattr(old_path)['st_mode']):  # Symlink
-                source_path = self.get_right_path(old_path)
-                destination_path = self.get_right_path(new_path)
+            elif stat.S_ISLNK(old_mode):  # Symlink
+                destination_path, misplaced_path = _overwritten_destination(self, new_path)
                 if os.path.lexists(destination_path):
-                    unlink_operation(self,new_path)
-                shutil.copy2(source_path, destination_path, follow_symlinks=False)
+                    os.unlink(destination_path)
+                makedirs(self,os.path.dirname(destination_path), exist_ok=True)
+                shutil.copy2(right_old_path, destination_path, follow_symlinks=False)
+                _remove_misplaced_destination(misplaced_path)
             else:  # File
+                right_new_path, misplaced_path = _overwritten_destination(self, new_path)
                 #Call makedirs to create the parent directory if it doesn't exist (when parent is excluded but child is not or vice versa)
                 makedirs(self,os.path.dirname(right_new_path), exist_ok=True)
                 if os.name == 'nt':
@@ -63,7 +99,10 @@ def rename_operation(self, old, new):
                         # raise FuseOSError(errno.ENOENT)
 
                 else:
-                    os.replace(right_old_path, right_new_path)
+                    #The old and new paths may be in different tiers, on different devices
+                    replace_across_tiers(right_old_path, right_new_path, source_open=self.file_handles.is_open(right_old_path))
+                #Only once the destination has been replaced, a failed move leaves it in place
+                _remove_misplaced_destination(misplaced_path)
 
         recursive_copy(old, new)
 
@@ -3,7 +3,14 @@ import errno
 from refuse.high import FuseOSError
 
 def truncate_operation(self, path, length, fh=None):
-    right_path = self.get_right_path(path)
+    #ftruncate on an open file, which may have been unlinked since
+    handle = self.file_handles.get(fh) if fh is not None else None
+    if handle is not None:
+        os.ftruncate(fh, length)
+        handle.dirty = True
+        return
+    #Truncating to 0 discards the content, no need to move it to the right tier first
+    right_path = self.get_right_path(path, migrate=length != 0)
     if os.path.lexists(right_path):
         with open(right_path, "r+") as f:
             f.truncate(length)
@@ -4,7 +4,8 @@ from refuse.high import FuseOSError
 if os.name == 'nt':
     from ctypes import windll
 def unlink_operation(self, path):
-    right_path = self.get_right_path(path)
+    #No need to move the file to the right tier to delete it
+    right_path = self.get_right_path(path, migrate=False)
 
     if os.path.lexists(right_path):
         if os.name == 'nt':
@@ -1,11 +1,15 @@
 import os
 from refuse.high import FuseOSError
 import errno
+from ..file_handles import pwrite
 
 def write_operation(self, path, buf, offset, fh):
-    if not os.path.lexists(self.get_right_path(path)):
-        raise FuseOSError(errno.ENOENT)
+    #The path was resolved when the file was opened
+    handle = self.file_handles.get(fh)
+    if handle is None:
+        if not os.path.lexists(self.get_right_path(path)):
+            raise FuseOSError(errno.ENOENT)
+    else:
+        handle.dirty = True
 
-    os.lseek(fh, offset, os.SEEK_SET)
-    total_written = os.write(fh, buf)
-    return total_written
+    return pwrite(handle, fh, buf, offset)
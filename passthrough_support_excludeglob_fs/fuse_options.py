@@ -0,0 +1,78 @@
+from typing import Any, Callable, Dict, Literal, Mapping, Tuple, get_args
+
+fuse_preset_type = Literal['throughput', 'metadata-heavy', 'low-latency']
+
+
+def _positive_integer(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _seconds(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def _flag(value: Any) -> bool:
+    return isinstance(value, bool)
+
+
+# FUSE session options passed to FUSE(), with their validity check and the expected value for the error message
+FUSE_OPTIONS: Dict[str, Tuple[Callable[[Any], bool], str]] = {
+    'max_read': (_positive_integer, 'a strictly positive number of bytes'),
+    'max_write': (_positive_integer, 'a strictly positive number of bytes'),
+    'big_writes': (_flag, 'True or False'),
+    'max_background': (_positive_integer, 'a strictly positive number of requests'),
+    'congestion_threshold': (_positive_integer, 'a strictly positive number of requests'),
+    'kernel_cache': (_flag, 'True or False'),
+    'auto_cache': (_flag, 'True or False'),
+    'attr_timeout': (_seconds, 'a positive number of seconds'),
+    'entry_timeout': (_seconds, 'a positive number of seconds'),
+    'negative_timeout': (_seconds, 'a positive number of seconds'),
+    'writeback_cache': (_flag, 'True or False'),
+    'default_permissions': (_flag, 'True or False'),
+}
+
+FUSE_PRESETS: Dict[str, Dict[str, Any]] = {
+    # Large sequential reads and writes: big requests and many of them in flight, page cache kept while files are unchanged
+    'throughput': {'big_writes': True, 'max_read': 131072, 'max_write': 131072, 'max_background': 64, 'congestion_threshold': 48,
+                   'auto_cache': True},
+    # Many stat, lookups and listings (builds, indexers): the kernel caches attributes and names, more background requests in flight
+    'metadata-heavy': {'attr_timeout': 5.0, 'entry_timeout': 5.0, 'negative_timeout': 5.0, 'max_background': 32, 'congestion_threshold': 24},
+    # Interactive use: few background requests queued ahead of the foreground ones, short kernel caches
+    'low-latency': {'big_writes': True, 'max_background': 8, 'congestion_threshold': 6, 'attr_timeout': 0.5, 'entry_timeout': 0.5},
+}
+
+
+def libfuse_version() -> int:
+    """
+    Returns the version of the libfuse loaded by the FUSE bindings: major * 10 + minor for libfuse 2, major * 100 + minor for libfuse 3.
+    """
+    from refuse.high import _libfuse
+    return _libfuse.fuse_version()
+
+
+def supports_writeback_cache() -> bool:
+    # Added in libfuse 3.0, libfuse 2 fails to mount with the option
+    return libfuse_version() >= 30
+
+
+def fuse_session_options(preset: fuse_preset_type | None = None, options: Mapping[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Returns the validated FUSE session options: the options of the preset overridden by the options given explicitly (None values are ignored).
+
+    Raises:
+        ValueError: Unknown preset or option, or invalid value.
+    """
+    if preset is not None and preset not in FUSE_PRESETS:
+        raise ValueError(f"fuse_preset must be one of {get_args(fuse_preset_type)}")
+    session_options = dict(FUSE_PRESETS[preset]) if preset is not None else {}
+    session_options.update({name: value for name, value in (options or {}).items() if value is not None})
+    for name, value in session_options.items():
+        if name not in FUSE_OPTIONS:
+            raise ValueError(f"Unknown FUSE option {name}")
+        check, expected = FUSE_OPTIONS[name]
+        if not check(value):
+            raise ValueError(f"{name} must be {expected}")
+    if session_options.get('congestion_threshold', 0) > session_options.get('max_background', float('inf')):
+        raise ValueError("congestion_threshold must not be greater than max_background")
+    # False flags are left out, the FUSE defaults
+    return {name: value for name, value in session_options.items() if value is not False}
@@ -0,0 +1,157 @@
+from itertools import count
+from threading import Lock
+from typing import Dict, Set, Tuple
+
+from .resolution_cache import SubtreeIndex
+
+ROOT_INODE = 1
+
+
+class Inode:
+    __slots__ = ('ino', 'path', 'right_path', 'nlookup', 'validator', 'handles')
+
+    def __init__(self, ino: int, path: str) -> None:
+        self.ino: int = ino
+        # FUSE path, kept up to date by renames. None once the inode is detached by an unlink or replaced by a rename: its path
+        # designates another file or nothing, the inode is only reachable through its open files until the kernel forgets it
+        self.path: str | None = path
+        # Real path in the root or cache tier the path was resolved to, None until it is resolved again after a change
+        self.right_path: str | None = None
+        # Number of lookups not forgotten yet by the kernel
+        self.nlookup: int = 0
+        # File handles (fh) opened on the inode and not released yet
+        self.handles: Set[int] = set()
+        # (st_mtime, st_size) at the last open, for the emulation of auto_cache
+        self.validator: Tuple[float, int] | None = None
+
+
+class InodeTable:
+    """
+    Table of the inodes known to the kernel, for the low-level FUSE API.
+
+    Inode numbers are allocated by the table when a path is first looked up, instead of being taken from the underlying files:
+    a file keeps its inode number when it moves between the root and the cache tier. An inode stays in the table until the kernel
+    forgets every lookup of it, which outlives an unlink or a rename of its path.
+
+    An inode also keeps the real path its path was resolved to, so that the operations on it do not resolve it again. It is forgotten
+    with the other cached resolutions of the path, when it is migrated, renamed or removed. A detached inode has no path anymore
+    and is served from its open files.
+    """
+
+    def __init__(self) -> None:
+        root = Inode(ROOT_INODE, '/')
+        # The root is never forgotten
+        root.nlookup = 1
+        self.inodes: Dict[int, Inode] = {ROOT_INODE: root}
+        self.paths: Dict[str, int] = {'/': ROOT_INODE}
+        # Paths below each directory, renaming a directory moves them without scanning every path
+        self.index: SubtreeIndex = SubtreeIndex()
+        self.numbers = count(ROOT_INODE + 1)
+        self.lock = Lock()
+        self.lookups: int = 0
+        self.forgotten: int = 0
+
+    def get(self, ino: int) -> Inode | None:
+        return self.inodes.get(ino)
+
+    def path_of(self, ino: int) -> str | None:
+        """Returns the path of the inode, None if it is unknown or detached."""
+        inode = self.inodes.get(ino)
+        return inode.path if inode is not None else None
+
+    def ino_of(self, path: str) -> int | None:
+        return self.paths.get(path)
+
+    def resolved(self, path: str) -> str | None:
+        """Returns the real path the inode of path was resolved to, None if path has no inode or is not resolved."""
+        inode = self.inodes.get(self.paths.get(path, 0))
+        return inode.right_path if inode is not None else None
+
+    def set_resolved(self, path: str, right_path: str) -> None:
+        inode = self.inodes.get(self.paths.get(path, 0))
+        if inode is not None:
+            inode.right_path = right_path
+
+    def invalidate(self, path: str, recursive: bool = False) -> None:
+        """
+        Forget the real path of the inode of path, and with recursive of the inodes below it.
+        """
+        with self.lock:
+            for below in [path, *(self.index.subtree(path) if recursive else ())]:
+                inode = self.inodes.get(self.paths.get(below, 0))
+                if inode is not None:
+                    inode.right_path = None
+
+    def lookup(self, path: str) -> int:
+        """
+        Count a lookup of path replied to the kernel, allocating its inode on the first one.
+        """
+        with self.lock:
+            ino = self.paths.get(path)
+            if ino is None:
+                ino = next(self.numbers)
+                self.inodes[ino] = Inode(ino, path)
+                self.paths[path] = ino
+                self.index.add(path)
+            self.inodes[ino].nlookup += 1
+            self.lookups += 1
+            return ino
+
+    def forget(self, ino: int, nlookup: int) -> None:
+        with self.lock:
+            inode = self.inodes.get(ino)
+            if inode is None or ino == ROOT_INODE:
+                return
+            inode.nlookup -= nlookup
+            if inode.nlookup <= 0:
+                del self.inodes[ino]
+                if inode.path is not None and self.paths.get(inode.path) == ino:
+                    del self.paths[inode.path]
+                    self.index.discard(inode.path, self.paths)
+                self.forgotten += 1
+
+    def _detach(self, path: str) -> None:
+        ino = self.paths.pop(path, None)
+        if ino is not None:
+            self.inodes[ino].path = None
+            self.inodes[ino].right_path = None
+            self.index.discard(path, self.paths)
+
+    def unlink(self, path: str) -> None:
+        """
+        Detach path from its inode, which stays known to the kernel until it is forgotten.
+        """
+        with self.lock:
+            self._detach(path)
+
+    def rename(self, old: str, new: str) -> None:
+        """
+        Move the inodes of old and of everything below it under new. The inode new designated, if any, is detached.
+        """
+        with self.lock:
+            if self.paths.get(new) != self.paths.get(old):
+                self._detach(new)
+            moved = [(path, self.paths.pop(path)) for path in [old, *self.index.pop_subtree(old)] if path in self.paths]
+            self.index.discard(old, self.paths)
+            for path, ino in moved:
+                new_path = new + path[len(old):]
+                self.paths[new_path] = ino
+                self.index.add(new_path)
+                self.inodes[ino].path = new_path
+                self.inodes[ino].right_path = None
+
+    def opened(self, ino: int, fh: int) -> None:
+        with self.lock:
+            inode = self.inodes.get(ino)
+            if inode is not None:
+                inode.handles.add(fh)
+
+    def released(self, ino: int, fh: int) -> None:
+        with self.lock:
+            inode = self.inodes.get(ino)
+            if inode is not None:
+                inode.handles.discard(fh)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'inodes': len(self.inodes), 'lookups': self.lookups, 'forgotten': self.forgotten}
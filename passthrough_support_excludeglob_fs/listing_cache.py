@@ -0,0 +1,142 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, Tuple
+
+from .resolution_cache import SubtreeIndex
+
+# (st_mtime_ns, st_ino) of the directory in the root tier and in the cache tier, None where it does not exist
+validators_type = Tuple[Tuple[int, int] | None, Tuple[int, int] | None]
+
+# Directories modified less than this many nanoseconds before being listed are not cached: a change made later within
+# the timestamp granularity of the underlying filesystem would not change their mtime
+RACY_WINDOW_NS = 1_000_000_000
+
+
+def directory_validator(directory: str) -> Tuple[int, int] | None:
+    try:
+        st = os.stat(directory)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return (st.st_mtime_ns, st.st_ino)
+
+
+class _Listing:
+    __slots__ = ('validators', 'names')
+
+    def __init__(self, validators: validators_type, names: Dict[str, None]) -> None:
+        self.validators: validators_type = validators
+        # Ordered set of the merged entry names
+        self.names: Dict[str, None] = names
+
+
+class DirectoryListingCache:
+    """
+    Cache of the merged listings of directories, validated by the mtime and inode number of the directory in both tiers.
+
+    A listing is served as long as neither directory changed since it was taken, at the cost of two stat calls instead of two scans.
+    The filesystem's own operations update the cached listing of the parent directory in place and take its new validators, so a change made
+    behind the back of the filesystem within the timestamp granularity of one of these operations is missed until the directory changes again.
+    Memory is bounded by the total number of names cached, the least recently used listings are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 262144) -> None:
+        self.max_entries: int = max_entries
+        self.listings: OrderedDict[str, _Listing] = OrderedDict()
+        self.total: int = 0
+        self.lock = Lock()
+        self.index: SubtreeIndex = SubtreeIndex()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.updates: int = 0
+
+    @property
+    def enable(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, path: str, validators: validators_type) -> Tuple[str, ...] | None:
+        """
+        Return a snapshot of the names listed in path, or None if the listing is unknown or one of the directories changed.
+        """
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is None:
+                self.misses += 1
+                return None
+            if listing.validators != validators:
+                self._pop(path)
+                self.index.discard(path, self.listings)
+                self.misses += 1
+                return None
+            self.listings.move_to_end(path)
+            self.hits += 1
+            return tuple(listing.names)
+
+    def set(self, path: str, validators: validators_type, names: Iterable[str]) -> None:
+        """
+        Cache the names listed in path, validators being read before listing the directories.
+        """
+        if not self.enable or self._racy(validators):
+            return
+        listing = _Listing(validators, dict.fromkeys(names))
+        if len(listing.names) > self.max_entries:
+            return
+        with self.lock:
+            self._pop(path)
+            self.listings[path] = listing
+            self.index.add(path)
+            self.total += len(listing.names)
+            while self.total > self.max_entries:
+                evicted_path, evicted = self.listings.popitem(last=False)
+                self.index.discard(evicted_path, self.listings)
+                self.total -= len(evicted.names)
+
+    def update(self, path: str, name: str, present: bool, validators: validators_type) -> None:
+        """
+        Apply a change made by the filesystem itself to the cached listing of path, if any, and take the new validators of its directories.
+        """
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is None:
+                return
+            if present and name not in listing.names:
+                listing.names[name] = None
+                self.total += 1
+            elif not present and name in listing.names:
+                del listing.names[name]
+                self.total -= 1
+            listing.validators = validators
+            self.updates += 1
+
+    def contains(self, path: str) -> bool:
+        return path in self.listings
+
+    def invalidate(self, path: str, recursive: bool = False) -> None:
+        with self.lock:
+            self._pop(path)
+            if recursive:
+                for key in self.index.pop_subtree(path):
+                    self._pop(key)
+            self.index.discard(path, self.listings)
+
+    def _pop(self, path: str) -> None:
+        # The caller updates the index
+        listing = self.listings.pop(path, None)
+        if listing is not None:
+            self.total -= len(listing.names)
+
+    @staticmethod
+    def _racy(validators: validators_type) -> bool:
+        now = time.time_ns()
+        return any(validator is not None and now - validator[0] < RACY_WINDOW_NS for validator in validators)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.listings.clear()
+            self.index.clear()
+            self.total = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'listings': len(self.listings), 'entries': self.total, 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses, 'updates': self.updates}
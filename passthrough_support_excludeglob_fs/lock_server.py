@@ -0,0 +1,459 @@
+import os
+import json
+import time
+import uuid
+import errno
+import socket
+import logging
+import threading
+import socketserver
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+try:
+    import fcntl
+except ImportError:
+    # Windows, Unix sockets are not supported
+    fcntl = None
+
+log = logging.getLogger('passthrough_support_excludeglob_fs')
+
+# Connections to the server kept open by a client between requests
+MAX_IDLE_CONNECTIONS = 8
+# Time the server may take to answer a request on top of the lock wait timeout, before its host is considered dead
+RESPONSE_MARGIN = 5.0
+
+
+def _parent(path: str) -> str:
+    return path.rpartition('/')[0] or '/'
+
+
+def _ancestors(path: str) -> Iterator[str]:
+    """Strict ancestors of a lock name, closest first."""
+    while path != '/':
+        path = _parent(path)
+        yield path
+
+
+class _Lease:
+    __slots__ = ('mount', 'thread', 'count', 'expiry')
+
+    def __init__(self, mount: str, thread: int, expiry: float) -> None:
+        self.mount: str = mount
+        self.thread: int = thread
+        # The lock is reentrant for its owner
+        self.count: int = 1
+        self.expiry: float = expiry
+
+
+class LockServer:
+    """
+    Lock service shared by several mounts over a Unix socket, one JSON request and one JSON response per line.
+
+    A lock is owned by a thread of a mount for `lease` seconds. The lease is renewed by the heartbeats of the mount,
+    so the locks of a mount that crashed are released at most `lease` seconds later.
+
+    Locks are hierarchical: the lock of a directory also covers everything below it, so it conflicts with the locks of its
+    descendants and ancestors held by other owners.
+
+    A server taking over from a host that went away starts with an empty table. During the `grace` seconds after its start
+    it only accepts the leases the mounts still hold (reclaim) and new locks wait.
+    """
+
+    def __init__(self, socket_path: str, lease: float = 10.0, grace: float = 0.0) -> None:
+        self.socket_path: str = socket_path
+        self.lease: float = lease
+        self.grace_until: float = time.monotonic() + grace
+        self.leases: Dict[str, _Lease] = {}
+        # Lock name -> number of leases held strictly below it per (mount, thread) owner
+        self.below: Dict[str, Dict[Tuple[str, int], int]] = {}
+        self.condition = threading.Condition()
+        self.granted: int = 0
+        self.expired: int = 0
+        self.reclaimed: int = 0
+        # Client connections, closed at shutdown so that the clients notice it
+        self.connections: set[socket.socket] = set()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self) -> None:
+                super().setup()
+                with server.condition:
+                    server.connections.add(self.connection)
+
+            def handle(self) -> None:
+                for line in self.rfile:
+                    response = server.handle(json.loads(line))
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+            def finish(self) -> None:
+                with server.condition:
+                    server.connections.discard(self.connection)
+                try:
+                    super().finish()
+                except OSError:
+                    pass
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        self.server = Server(socket_path, Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='lock-server', daemon=True)
+
+    def start(self) -> 'LockServer':
+        self.thread.start()
+        return self
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        with self.condition:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request['op']
+        if op == 'acquire':
+            return {'ok': self.acquire(request['path'], request['mount'], request['thread'], request['timeout'])}
+        if op == 'release':
+            self.release(request['path'], request['mount'], request['thread'])
+            return {'ok': True}
+        if op == 'renew':
+            self.renew(request['mount'])
+            return {'ok': True}
+        if op == 'reclaim':
+            return {'ok': True, 'lost': self.reclaim(request['mount'], request['leases'])}
+        if op == 'stats':
+            return {'ok': True, 'stats': self.stats()}
+        return {'ok': False, 'error': f'Unknown operation {op}'}
+
+    def _add(self, path: str, lease: _Lease) -> None:
+        self.leases[path] = lease
+        owner = (lease.mount, lease.thread)
+        for ancestor in _ancestors(path):
+            holders = self.below.setdefault(ancestor, {})
+            holders[owner] = holders.get(owner, 0) + 1
+
+    def _remove(self, path: str) -> None:
+        lease = self.leases.pop(path)
+        owner = (lease.mount, lease.thread)
+        for ancestor in _ancestors(path):
+            holders = self.below[ancestor]
+            holders[owner] -= 1
+            if not holders[owner]:
+                del holders[owner]
+                if not holders:
+                    del self.below[ancestor]
+        self.condition.notify_all()
+
+    def _expire(self, now: float) -> None:
+        # The owners stopped renewing their leases, they crashed
+        for path in [path for path, lease in self.leases.items() if lease.expiry < now]:
+            self._remove(path)
+            self.expired += 1
+
+    def _conflicts(self, path: str, owner: Tuple[str, int]) -> bool:
+        """Returns True if another owner holds path, one of its ancestors or something below it."""
+        for name in (path, *_ancestors(path)):
+            lease = self.leases.get(name)
+            if lease is not None and (lease.mount, lease.thread) != owner:
+                return True
+        return any(holder != owner for holder in self.below.get(path, ()))
+
+    def acquire(self, path: str, mount: str, thread: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        owner = (mount, thread)
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                lease = self.leases.get(path)
+                if lease is not None and (lease.mount, lease.thread) == owner:
+                    lease.count += 1
+                    return True
+                if now >= self.grace_until and not self._conflicts(path, owner):
+                    self._add(path, _Lease(mount, thread, now + self.lease))
+                    self.granted += 1
+                    return True
+                if now >= deadline:
+                    return False
+                wake_up = min([deadline, *(lease.expiry for lease in self.leases.values())])
+                if now < self.grace_until:
+                    wake_up = min(wake_up, self.grace_until)
+                self.condition.wait(max(wake_up - now, 0.001))
+
+    def release(self, path: str, mount: str, thread: int) -> None:
+        with self.condition:
+            lease = self.leases.get(path)
+            # A lease that expired may belong to another owner now
+            if lease is None or lease.mount != mount or lease.thread != thread:
+                return
+            lease.count -= 1
+            if not lease.count:
+                self._remove(path)
+
+    def reclaim(self, mount: str, leases: List[Tuple[str, int, int]]) -> int:
+        """
+        Restore the leases a mount held on the previous server. Returns the number of leases granted to another owner meanwhile.
+        """
+        lost = 0
+        with self.condition:
+            now = time.monotonic()
+            self._expire(now)
+            for path, thread, count in leases:
+                lease = self.leases.get(path)
+                if lease is not None and (lease.mount, lease.thread) == (mount, thread):
+                    lease.count = count
+                    lease.expiry = now + self.lease
+                    continue
+                if self._conflicts(path, (mount, thread)):
+                    lost += 1
+                    continue
+                lease = _Lease(mount, thread, now + self.lease)
+                lease.count = count
+                self._add(path, lease)
+                self.reclaimed += 1
+        return lost
+
+    def renew(self, mount: str) -> None:
+        with self.condition:
+            expiry = time.monotonic() + self.lease
+            for lease in self.leases.values():
+                if lease.mount == mount:
+                    lease.expiry = expiry
+
+    def stats(self) -> Dict[str, int]:
+        with self.condition:
+            return {'held': len(self.leases), 'granted': self.granted, 'expired': self.expired, 'reclaimed': self.reclaimed}
+
+
+class LockClient:
+    """
+    Connection of a mount to the shared lock server.
+
+    The first mount to connect hosts the server in-process. The host is elected with an exclusive flock on `<socket_path>.lock`,
+    which the kernel releases when the host process dies, so that another mount can take over. The leases held by the mount are
+    then reclaimed on the new server, which holds new locks back for one lease period after a takeover.
+    Lock names are prefixed with `namespace` (the real path of root) so that mounts of different roots never conflict.
+
+    Requests are sent over a small pool of connections shared by the threads of the mount. The client starts threads and may host
+    the server, it must be created in the process serving the mount (after FUSE forked into the background).
+    """
+
+    def __init__(self, socket_path: str, namespace: str = '', lease: float = 10.0, timeout: float = 30.0) -> None:
+        if fcntl is None:
+            raise ValueError("lock_server is not supported on this platform")
+        self.socket_path: str = socket_path
+        self.namespace: str = namespace.rstrip('/')
+        self.lease: float = lease
+        self.timeout: float = timeout
+        self.mount_id: str = uuid.uuid4().hex
+        self.hosted_server: LockServer | None = None
+        self.host_lock_fd: int | None = None
+        # Every open connection with its stream, and the ones not used by a request right now
+        self.connections: Dict[socket.socket, BinaryIO] = {}
+        self.idle: List[Tuple[socket.socket, BinaryIO]] = []
+        self.connections_lock = threading.Lock()
+        # (lock name, thread) -> reentrant count of the leases granted to this mount, reclaimed after a takeover
+        self.held: Dict[Tuple[str, int], int] = {}
+        self.connected: bool = False
+        self.server_lost: bool = False
+        self.stop_event = threading.Event()
+        # Connects, or hosts the server if there is none yet
+        self.idle.append(self._open())
+        self.heartbeat = threading.Thread(target=self._renew_periodically, name='lock-heartbeat', daemon=True)
+        self.heartbeat.start()
+
+    def _host(self) -> bool:
+        """Try to become the host of the server, returns False if another mount is the host."""
+        fd = os.open(self.socket_path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # The socket file of a dead host may remain. Taking over from a host, the other mounts may still hold leases
+        takeover = self.connected or os.path.exists(self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.hosted_server = LockServer(self.socket_path, self.lease, self.lease if takeover else 0.0).start()
+        self.host_lock_fd = fd
+        return True
+
+    def _connect(self) -> socket.socket:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                if self.hosted_server is None and self._host():
+                    continue
+                if time.monotonic() >= deadline:
+                    raise OSError(errno.ETIMEDOUT, "Cannot connect to the lock server", self.socket_path)
+                # Another mount is starting the server
+                time.sleep(0.05)
+                continue
+            # A host that stopped answering is given up on like one that closed its connections
+            connection.settimeout(self.timeout + RESPONSE_MARGIN)
+            return connection
+
+    def _open(self) -> Tuple[socket.socket, BinaryIO]:
+        """Open a new connection. The first one after the server went away reclaims the leases of the mount."""
+        connection = self._connect()
+        item = (connection, connection.makefile('rwb'))
+        with self.connections_lock:
+            self.connections[connection] = item[1]
+            self.connected = True
+            reclaim = self.server_lost
+            self.server_lost = False
+            leases = [[name, thread, count] for (name, thread), count in self.held.items()]
+        if reclaim and leases:
+            response = self._send(item, {'op': 'reclaim', 'mount': self.mount_id, 'leases': leases})
+            if response is None:
+                self._discard(item)
+                raise OSError(errno.ECONNRESET, "Lost the connection to the lock server", self.socket_path)
+            if response['lost']:
+                log.warning("%d shared locks held by this mount were granted to another mount while the lock server was taken over", response['lost'])
+        return item
+
+    @staticmethod
+    def _send(item: Tuple[socket.socket, BinaryIO], request: Dict[str, Any]) -> Dict[str, Any] | None:
+        stream = item[1]
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        line = stream.readline()
+        return json.loads(line) if line else None
+
+    def _discard(self, item: Tuple[socket.socket, BinaryIO]) -> None:
+        connection, stream = item
+        with self.connections_lock:
+            self.connections.pop(connection, None)
+        for closeable in (stream, connection):
+            try:
+                closeable.close()
+            except OSError:
+                pass
+
+    def _lost_server(self) -> None:
+        """The host went away: the idle connections are dead too, the next connection goes to a new server (maybe hosted here)."""
+        with self.connections_lock:
+            self.server_lost = True
+            idle, self.idle = self.idle, []
+        for item in idle:
+            self._discard(item)
+
+    def _request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(2):
+            with self.connections_lock:
+                item = self.idle.pop() if self.idle else None
+            if item is None:
+                item = self._open()
+            try:
+                response = self._send(item, request)
+            except OSError:
+                self._discard(item)
+                if attempt:
+                    raise
+                self._lost_server()
+                continue
+            if response is not None:
+                with self.connections_lock:
+                    if len(self.idle) < MAX_IDLE_CONNECTIONS:
+                        self.idle.append(item)
+                        item = None
+                if item is not None:
+                    self._discard(item)
+                return response
+            # The host went away, reconnect (and maybe take over)
+            self._discard(item)
+            self._lost_server()
+        raise OSError(errno.ECONNRESET, "Lost the connection to the lock server", self.socket_path)
+
+    def _name(self, path: str) -> str:
+        return (self.namespace + path).rstrip('/') or '/'
+
+    def _acquire(self, name: str, thread: int) -> None:
+        response = self._request({'op': 'acquire', 'path': name, 'mount': self.mount_id, 'thread': thread, 'timeout': self.timeout})
+        if not response['ok']:
+            raise OSError(errno.ETIMEDOUT, "Timed out waiting for the shared lock", name)
+        with self.connections_lock:
+            self.held[(name, thread)] = self.held.get((name, thread), 0) + 1
+
+    def _release(self, name: str, thread: int) -> None:
+        with self.connections_lock:
+            count = self.held.get((name, thread), 0) - 1
+            if count > 0:
+                self.held[(name, thread)] = count
+            else:
+                self.held.pop((name, thread), None)
+        self._request({'op': 'release', 'path': name, 'mount': self.mount_id, 'thread': thread})
+
+    def _covered(self, name: str, thread: int) -> bool:
+        """Returns True if the thread already holds the lock of name or of one of its ancestors."""
+        with self.connections_lock:
+            return any((held, thread) in self.held for held in (name, *_ancestors(name)))
+
+    def acquire(self, path: str) -> None:
+        self._acquire(self._name(path), threading.get_ident())
+
+    def release(self, path: str) -> None:
+        self._release(self._name(path), threading.get_ident())
+
+    @contextmanager
+    def locked(self, *paths: str) -> Iterator[None]:
+        """
+        Hold the shared locks of paths, acquired in a fixed order (parents first) so that mounts locking the same paths cannot deadlock.
+
+        Paths already covered by a lock the thread holds are not locked again: the operations nested in one holding the locks
+        of all its paths never acquire a lock out of order.
+        """
+        thread = threading.get_ident()
+        ordered: Tuple[str, ...] = tuple(sorted({self._name(path) for path in paths}, key=lambda name: (name.count('/'), name)))
+        acquired = []
+        try:
+            for name in ordered:
+                if self._covered(name, thread):
+                    continue
+                self._acquire(name, thread)
+                acquired.append(name)
+            yield
+        finally:
+            for name in reversed(acquired):
+                self._release(name, thread)
+
+    def _renew_periodically(self) -> None:
+        while not self.stop_event.wait(self.lease / 3):
+            try:
+                self._request({'op': 'renew', 'mount': self.mount_id})
+            except OSError:
+                log.exception("Cannot renew the leases of the shared locks")
+
+    def stats(self) -> Dict[str, Any]:
+        # Requested first, it may reconnect to a new server
+        server = self._request({'op': 'stats'})['stats']
+        return {'mount_id': self.mount_id, 'host': self.hosted_server is not None, 'connections': len(self.connections), 'server': server}
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.heartbeat.join()
+        with self.connections_lock:
+            for connection, stream in self.connections.items():
+                for closeable in (stream, connection):
+                    try:
+                        closeable.close()
+                    except OSError:
+                        pass
+            self.connections.clear()
+            self.idle.clear()
+        if self.hosted_server is not None:
+            self.hosted_server.shutdown()
+            self.hosted_server = None
+        if self.host_lock_fd is not None:
+            os.close(self.host_lock_fd)
+            self.host_lock_fd = None
@@ -0,0 +1,444 @@
+import ctypes
+import errno
+import logging
+import os
+import stat
+import time
+from functools import wraps
+from signal import signal, SIGINT, SIG_DFL
+from typing import Any, Callable, Dict, List, Tuple
+
+from refuse.high import FuseOSError, set_st_attrs
+from refuse.low import FUSELL, LibFUSE, c_stat, c_statvfs, fuse_args, fuse_entry_param, fuse_lowlevel_ops, fuse_req_t
+
+from .inode_table import InodeTable
+from .fs_operations.getattr_operation import stat_to_attrs
+
+log = logging.getLogger('passthrough_support_excludeglob_fs')
+
+# Inode number of the listed entries that were not looked up yet, as the high-level API does
+UNKNOWN_INO = 0xffffffff
+
+# Bits of the to_set mask of setattr
+SET_ATTR_MODE = 1 << 0
+SET_ATTR_UID = 1 << 1
+SET_ATTR_GID = 1 << 2
+SET_ATTR_SIZE = 1 << 3
+SET_ATTR_ATIME = 1 << 4
+SET_ATTR_MTIME = 1 << 5
+SET_ATTR_ATIME_NOW = 1 << 7
+SET_ATTR_MTIME_NOW = 1 << 8
+
+
+def replies_errors(method: Callable[..., None]) -> Callable[..., None]:
+    """
+    Reply to the request with the errno of the OSError raised by the operation, EIO for any other exception.
+    """
+    @wraps(method)
+    def wrapper(self: 'LowLevelFUSE', req: Any, *args: Any) -> None:
+        try:
+            method(self, req, *args)
+        except OSError as e:
+            self.reply_err(req, e.errno or errno.EIO)
+        except Exception:
+            log.exception('Unhandled exception in %s', method.__name__)
+            self.reply_err(req, errno.EIO)
+    return wrapper
+
+
+class LowLevelFUSE(FUSELL):
+    """
+    Mount of the filesystem on the low-level FUSE API, which identifies files by inode numbers instead of paths.
+
+    The inode table maps the inode numbers handed to the kernel to FUSE paths, the operations of PassthroughFS are then called
+    with these paths. A path is resolved to its tier when the kernel looks it up, the real path is kept in the inode and the following
+    operations on the inode use it without resolving the path again. Inode numbers are allocated by the table, so they do not change
+    when a file moves between the tiers.
+
+    An inode detached by an unlink or a rename over it has no path anymore: its attributes are read and changed through one of
+    its open files, and the operations on its open files are called with the path they were opened with.
+    """
+    use_ns = False
+
+    def __init__(self, operations: Any, mountpoint: str, foreground: bool = True, nothreads: bool = False, debug: bool = False,
+                 uid: int = -1, gid: int = -1, encoding: str = 'utf-8', **kwargs: Any) -> None:
+        self.operations = operations
+        self.encoding: str = encoding
+        self.inodes: InodeTable = InodeTable()
+        operations.inode_table = self.inodes
+        # The high-level API overrides the owner of every file with the uid and gid options
+        self.uid: int = uid
+        self.gid: int = gid
+        # Options of the high-level API, implemented here
+        self.attr_timeout: float = kwargs.pop('attr_timeout', 1.0)
+        self.entry_timeout: float = kwargs.pop('entry_timeout', 1.0)
+        self.negative_timeout: float = kwargs.pop('negative_timeout', 0.0)
+        self.kernel_cache: bool = kwargs.pop('kernel_cache', False)
+        self.auto_cache: bool = kwargs.pop('auto_cache', False)
+        kwargs.setdefault('fsname', operations.__class__.__name__)
+
+        self.libfuse = LibFUSE()
+        self.libfuse.fuse_reply_create.argtypes = (fuse_req_t, ctypes.c_void_p, ctypes.c_void_p)
+        self.libfuse.fuse_reply_statfs.argtypes = (fuse_req_t, ctypes.c_void_p)
+        self.libfuse.fuse_session_loop_mt.argtypes = (ctypes.c_void_p,)
+        self.libfuse.fuse_daemonize.argtypes = (ctypes.c_int,)
+
+        args = ['fuse', '-o', ','.join(f'{key}={value}' if value is not True else key for key, value in kwargs.items() if value is not False)]
+        if debug:
+            args.append('-d')
+        self.main(mountpoint, args, foreground, nothreads)
+
+    def main(self, mountpoint: str, args: List[str], foreground: bool, nothreads: bool) -> None:
+        fuse_ops = fuse_lowlevel_ops()
+        for name, prototype in fuse_lowlevel_ops._fields_:
+            method = getattr(self, 'fuse_' + name, None) or getattr(self, name, None)
+            if method:
+                setattr(fuse_ops, name, prototype(method))
+        argv = fuse_args(len(args), (ctypes.c_char_p * len(args))(*[arg.encode(self.encoding) for arg in args]), 0)
+
+        # fuse_mount takes the mount options out of argv, fuse_lowlevel_new parses the remaining ones
+        chan = self.libfuse.fuse_mount(mountpoint.encode(self.encoding), argv)
+        if not chan:
+            raise RuntimeError(f"Unable to mount {mountpoint}")
+        session = self.libfuse.fuse_lowlevel_new(argv, ctypes.byref(fuse_ops), ctypes.sizeof(fuse_ops), None)
+        if not session:
+            self.libfuse.fuse_unmount(mountpoint.encode(self.encoding), chan)
+            raise RuntimeError("Invalid FUSE options")
+        self.libfuse.fuse_session_add_chan(session, chan)
+        self.libfuse.fuse_daemonize(int(foreground))
+        try:
+            old_handler = signal(SIGINT, SIG_DFL)
+        except ValueError:
+            old_handler = SIG_DFL
+        self.libfuse.fuse_set_signal_handlers(session)
+        try:
+            if nothreads:
+                self.libfuse.fuse_session_loop(session)
+            else:
+                self.libfuse.fuse_session_loop_mt(session)
+        finally:
+            self.libfuse.fuse_remove_signal_handlers(session)
+            try:
+                signal(SIGINT, old_handler)
+            except ValueError:
+                pass
+            self.libfuse.fuse_session_remove_chan(chan)
+            self.libfuse.fuse_session_destroy(session)
+            self.libfuse.fuse_unmount(mountpoint.encode(self.encoding), chan)
+
+    # Helpers
+    def path_of(self, ino: int) -> str:
+        path = self.inodes.path_of(ino)
+        if path is None:
+            raise FuseOSError(errno.ESTALE)
+        return path
+
+    def handle_path(self, ino: int, fh: int) -> str:
+        """
+        Path the operations on an open file are called with. Once the inode is detached, it is the path the file was opened with:
+        these operations go to the file descriptor, the path is only used for locking.
+        """
+        path = self.inodes.path_of(ino)
+        if path is not None:
+            return path
+        handle = self.operations.file_handles.get(fh)
+        if handle is None:
+            raise FuseOSError(errno.ESTALE)
+        return handle.path
+
+    def directory_path(self, ino: int, fh: int) -> str:
+        """
+        Path the operations on an open directory are called with. Once the inode is detached, it is the path the directory was opened with.
+        """
+        path = self.inodes.path_of(ino)
+        if path is not None:
+            return path
+        handle = self.operations.directory_handles.get(fh)
+        if handle is None:
+            raise FuseOSError(errno.ESTALE)
+        return handle.path
+
+    def detached_fd(self, ino: int, fh: int | None) -> int | None:
+        """
+        Returns the file descriptor serving a detached inode, the given one or any open file of the inode. None if the inode has a path.
+        """
+        inode = self.inodes.get(ino)
+        if inode is None:
+            raise FuseOSError(errno.ESTALE)
+        if inode.path is not None:
+            return None
+        if fh is not None:
+            return fh
+        for fd in list(inode.handles):
+            return fd
+        raise FuseOSError(errno.ESTALE)
+
+    def child_path(self, parent: int, name: str) -> str:
+        return self.path_of(parent).rstrip('/') + '/' + name
+
+    def to_stat(self, attrs: Dict[str, Any], ino: int) -> c_stat:
+        st = c_stat()
+        set_st_attrs(st, attrs, use_ns=self.use_ns)
+        st.st_ino = ino
+        if self.uid >= 0:
+            st.st_uid = self.uid
+        if self.gid >= 0:
+            st.st_gid = self.gid
+        return st
+
+    def entry(self, path: str, fh: int | None = None) -> fuse_entry_param:
+        """
+        Entry of path for the kernel, which counts as a lookup of its inode.
+        """
+        attrs = self.operations('getattr', path, fh)
+        ino = self.inodes.lookup(path)
+        return fuse_entry_param(ino=ino, generation=0, attr=self.to_stat(attrs, ino), attr_timeout=self.attr_timeout, entry_timeout=self.entry_timeout)
+
+    def reply_entry_of(self, req: Any, path: str) -> None:
+        self.libfuse.fuse_reply_entry(req, ctypes.byref(self.entry(path)))
+
+    def apply_cache_options(self, ino: int, path: str, fi: Any) -> None:
+        """
+        Keep the page cache of the file always (kernel_cache) or if it did not change since it was last opened (auto_cache),
+        unless its open policy bypasses the page cache.
+        """
+        if fi.direct_io:
+            return
+        if self.kernel_cache:
+            fi.keep_cache = 1
+            return
+        inode = self.inodes.get(ino)
+        if not self.auto_cache or inode is None:
+            return
+        attrs = self.operations('getattr', path, fi.fh)
+        validator = (attrs['st_mtime'], attrs['st_size'])
+        if inode.validator == validator:
+            fi.keep_cache = 1
+        inode.validator = validator
+
+    # Lifecycle
+    def init(self, userdata: Any, conn: Any) -> None:
+        self.operations('init', '/')
+
+    def destroy(self, userdata: Any) -> None:
+        self.operations('destroy', '/')
+
+    # Inodes
+    @replies_errors
+    def lookup(self, req: Any, parent: int, name: str) -> None:
+        path = self.child_path(parent, name)
+        try:
+            entry = self.entry(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT or self.negative_timeout <= 0:
+                raise
+            # An entry with inode 0 lets the kernel cache the absence of the name
+            entry = fuse_entry_param(ino=0, entry_timeout=self.negative_timeout)
+        self.libfuse.fuse_reply_entry(req, ctypes.byref(entry))
+
+    def forget(self, req: Any, ino: int, nlookup: int) -> None:
+        self.inodes.forget(ino, nlookup)
+        self.reply_none(req)
+
+    def forget_multi(self, req: Any, count: int, forgets: Any) -> None:
+        for i in range(count):
+            self.inodes.forget(forgets[i].ino, forgets[i].nlookup)
+        self.reply_none(req)
+
+    # Attributes
+    @replies_errors
+    def getattr(self, req: Any, ino: int, fi: Dict[str, Any]) -> None:
+        fh = fi.get('fh') if fi else None
+        fd = self.detached_fd(ino, fh)
+        if fd is not None:
+            attrs = stat_to_attrs(self.operations, '', os.fstat(fd))
+        else:
+            attrs = self.operations('getattr', self.path_of(ino), fh)
+        self.libfuse.fuse_reply_attr(req, ctypes.byref(self.to_stat(attrs, ino)), ctypes.c_double(self.attr_timeout))
+
+    @staticmethod
+    def times_to_set(st: Any, to_set: int, attrs: Dict[str, Any]) -> Tuple[float, float]:
+        """(atime, mtime) of a setattr, utimens sets both times and the one not given is kept."""
+        now = time.time()
+        def time_to_set(set_bit, now_bit, timespec, current):
+            if to_set & now_bit:
+                return now
+            if to_set & set_bit:
+                return timespec.tv_sec + timespec.tv_nsec / 1e9
+            return current
+        return (time_to_set(SET_ATTR_ATIME, SET_ATTR_ATIME_NOW, st.st_atimespec, attrs['st_atime']),
+                time_to_set(SET_ATTR_MTIME, SET_ATTR_MTIME_NOW, st.st_mtimespec, attrs['st_mtime']))
+
+    def setattr_detached(self, fd: int, st: Any, to_set: int) -> Dict[str, Any]:
+        """setattr of a detached inode, through its open file. Returns the new attributes."""
+        if to_set & SET_ATTR_MODE:
+            os.fchmod(fd, stat.S_IMODE(st.st_mode))
+        if to_set & (SET_ATTR_UID | SET_ATTR_GID):
+            os.fchown(fd, st.st_uid if to_set & SET_ATTR_UID else -1, st.st_gid if to_set & SET_ATTR_GID else -1)
+        if to_set & SET_ATTR_SIZE:
+            os.ftruncate(fd, st.st_size)
+            handle = self.operations.file_handles.get(fd)
+            if handle is not None:
+                handle.dirty = True
+        if to_set & (SET_ATTR_ATIME | SET_ATTR_MTIME | SET_ATTR_ATIME_NOW | SET_ATTR_MTIME_NOW):
+            os.utime(fd, self.times_to_set(st, to_set, stat_to_attrs(self.operations, '', os.fstat(fd))))
+        return stat_to_attrs(self.operations, '', os.fstat(fd))
+
+    @replies_errors
+    def fuse_setattr(self, req: Any, ino: int, attr: Any, to_set: int, fip: Any) -> None:
+        st = attr.contents
+        fh = fip.contents.fh if fip else None
+        fd = self.detached_fd(ino, fh)
+        if fd is not None:
+            attrs = self.setattr_detached(fd, st, to_set)
+            self.libfuse.fuse_reply_attr(req, ctypes.byref(self.to_stat(attrs, ino)), ctypes.c_double(self.attr_timeout))
+            return
+        path = self.path_of(ino)
+        if to_set & SET_ATTR_MODE:
+            self.operations('chmod', path, st.st_mode)
+        if to_set & (SET_ATTR_UID | SET_ATTR_GID):
+            self.operations('chown', path, st.st_uid if to_set & SET_ATTR_UID else -1, st.st_gid if to_set & SET_ATTR_GID else -1)
+        if to_set & SET_ATTR_SIZE:
+            self.operations('truncate', path, st.st_size, fh)
+        if to_set & (SET_ATTR_ATIME | SET_ATTR_MTIME | SET_ATTR_ATIME_NOW | SET_ATTR_MTIME_NOW):
+            self.operations('utimens', path, self.times_to_set(st, to_set, self.operations('getattr', path, fh)))
+        attrs = self.operations('getattr', path, fh)
+        self.libfuse.fuse_reply_attr(req, ctypes.byref(self.to_stat(attrs, ino)), ctypes.c_double(self.attr_timeout))
+
+    @replies_errors
+    def readlink(self, req: Any, ino: int) -> None:
+        self.reply_readlink(req, self.operations('readlink', self.path_of(ino)))
+
+    @replies_errors
+    def access(self, req: Any, ino: int, mask: int) -> None:
+        self.operations('access', self.path_of(ino), mask)
+        self.reply_err(req, 0)
+
+    @replies_errors
+    def statfs(self, req: Any, ino: int) -> None:
+        stv = c_statvfs()
+        for key, value in self.operations('statfs', self.path_of(ino)).items():
+            if hasattr(stv, key):
+                setattr(stv, key, value)
+        self.libfuse.fuse_reply_statfs(req, ctypes.byref(stv))
+
+    # Namespace
+    @replies_errors
+    def mkdir(self, req: Any, parent: int, name: str, mode: int) -> None:
+        path = self.child_path(parent, name)
+        self.operations('mkdir', path, mode)
+        self.reply_entry_of(req, path)
+
+    @replies_errors
+    def symlink(self, req: Any, link: str, parent: int, name: str) -> None:
+        path = self.child_path(parent, name)
+        self.operations('symlink', path, link)
+        self.reply_entry_of(req, path)
+
+    @replies_errors
+    def unlink(self, req: Any, parent: int, name: str) -> None:
+        path = self.child_path(parent, name)
+        self.operations('unlink', path)
+        self.inodes.unlink(path)
+        self.reply_err(req, 0)
+
+    @replies_errors
+    def rmdir(self, req: Any, parent: int, name: str) -> None:
+        path = self.child_path(parent, name)
+        self.operations('rmdir', path)
+        self.inodes.unlink(path)
+        self.reply_err(req, 0)
+
+    @replies_errors
+    def rename(self, req: Any, parent: int, name: str, newparent: int, newname: str) -> None:
+        old, new = self.child_path(parent, name), self.child_path(newparent, newname)
+        self.operations('rename', old, new)
+        self.inodes.rename(old, new)
+        self.reply_err(req, 0)
+
+    # Files, the file info structure is passed as is so that open and create can set its caching flags
+    @replies_errors
+    def fuse_open(self, req: Any, ino: int, fip: Any) -> None:
+        path = self.path_of(ino)
+        fi = fip.contents
+        fi.fh = self.operations('open', path, fi.flags, fi)
+        self.inodes.opened(ino, fi.fh)
+        self.apply_cache_options(ino, path, fi)
+        self.libfuse.fuse_reply_open(req, fip)
+
+    @replies_errors
+    def fuse_create(self, req: Any, parent: int, name: bytes, mode: int, fip: Any) -> None:
+        path = self.child_path(parent, name.decode(self.encoding))
+        fi = fip.contents
+        fi.fh = self.operations('create', path, mode, fi)
+        try:
+            entry = self.entry(path, fi.fh)
+        except Exception:
+            self.operations('release', path, fi.fh)
+            raise
+        self.inodes.opened(entry.ino, fi.fh)
+        self.libfuse.fuse_reply_create(req, ctypes.byref(entry), fip)
+
+    @replies_errors
+    def fuse_read(self, req: Any, ino: int, size: int, off: int, fip: Any) -> None:
+        data = self.operations('read', self.handle_path(ino, fip.contents.fh), size, off, fip.contents.fh)
+        self.libfuse.fuse_reply_buf(req, data, len(data))
+
+    @replies_errors
+    def fuse_write(self, req: Any, ino: int, buf: Any, size: int, off: int, fip: Any) -> None:
+        written = self.operations('write', self.handle_path(ino, fip.contents.fh), ctypes.string_at(buf, size), off, fip.contents.fh)
+        self.reply_write(req, written)
+
+    @replies_errors
+    def fuse_flush(self, req: Any, ino: int, fip: Any) -> None:
+        self.operations('flush', self.handle_path(ino, fip.contents.fh), fip.contents.fh)
+        self.reply_err(req, 0)
+
+    @replies_errors
+    def fuse_release(self, req: Any, ino: int, fip: Any) -> None:
+        fh = fip.contents.fh
+        try:
+            self.operations('release', self.handle_path(ino, fh), fh)
+        finally:
+            self.inodes.released(ino, fh)
+        self.reply_err(req, 0)
+
+    @replies_errors
+    def fuse_fsync(self, req: Any, ino: int, datasync: int, fip: Any) -> None:
+        self.operations('fsync', self.handle_path(ino, fip.contents.fh), datasync, fip.contents.fh)
+        self.reply_err(req, 0)
+
+    # Directories
+    @replies_errors
+    def fuse_opendir(self, req: Any, ino: int, fip: Any) -> None:
+        fip.contents.fh = self.operations('opendir', self.path_of(ino))
+        self.libfuse.fuse_reply_open(req, fip)
+
+    @replies_errors
+    def fuse_readdir(self, req: Any, ino: int, size: int, off: int, fip: Any) -> None:
+        path = self.directory_path(ino, fip.contents.fh)
+        buf = ctypes.create_string_buffer(size)
+        used = 0
+        if self.inodes.path_of(ino) is None:
+            # Removed or replaced by a rename, which both require the directory to be empty. Its path may designate another one now
+            entries = [('.', None, 1), ('..', None, 2)][off:]
+        else:
+            entries = self.operations('readdir', path, fip.contents.fh, off)
+        for name, attrs, next_offset in entries:
+            st = c_stat()
+            if attrs:
+                set_st_attrs(st, attrs, use_ns=self.use_ns)
+            child = self.inodes.ino_of(path.rstrip('/') + '/' + name) if name not in ('.', '..') else None
+            st.st_ino = ino if name == '.' else child or UNKNOWN_INO
+            entry_size = self.libfuse.fuse_add_direntry(req, ctypes.cast(ctypes.addressof(buf) + used, ctypes.c_char_p), size - used,
+                                                        name.encode(self.encoding), ctypes.byref(st), next_offset)
+            if entry_size > size - used:
+                # The directory handle yields this entry again on the next call
+                break
+            used += entry_size
+        self.libfuse.fuse_reply_buf(req, buf, used)
+
+    @replies_errors
+    def fuse_releasedir(self, req: Any, ino: int, fip: Any) -> None:
+        self.operations('releasedir', self.directory_path(ino, fip.contents.fh), fip.contents.fh)
+        self.reply_err(req, 0)
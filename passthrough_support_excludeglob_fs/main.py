@@ -3,13 +3,27 @@
 import os
 import re
 import sys
-from typing import Any, Dict, List, Literal, get_args
+import errno
+import json
+import signal
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Literal, get_args
 from refuse import _refactor
 _refactor.sys = sys # type: ignore
-from refuse.high import FUSE, Operations
+from refuse.high import FUSE, Operations, c_stat, set_st_attrs
 from .logginng_mixin import LoggingMixIn
-from .concurrency_controller import ConcurrencyControllerMixIn
-from globmatch import glob_match
+from .concurrency_controller import ConcurrencyControllerMixIn, PathLockTable
+from .resolution_cache import AttributeCache, ResolutionCache, NegativeLookupCache, tier_type
+from .pattern_matcher import PatternMatcher, PatternPolicy, parent_directory
+from .cache_index import CacheTierIndex
+from .listing_cache import DirectoryListingCache, directory_validator
+from .file_handles import FileHandleTable, open_policy_type
+from .directory_handles import DirectoryHandleTable
+from .inode_table import InodeTable
+from .durability import DurabilityManager, durability_type
+from .lock_server import LockClient
+from .fuse_options import fuse_preset_type, fuse_session_options, supports_writeback_cache
+from .migration import MigrationQueue, is_real_directory, migration_type, move_between_tiers, same_device
 import argparse
 from appdirs import user_cache_dir
 import base64
@@ -19,6 +33,7 @@ import warnings
 with warnings.catch_warnings(action="ignore"):
     from str2type import str2type
 import tempfile
+from threading import Thread
 
 from .fs_operations import (
     open_operation,
@@ -39,6 +54,8 @@ from .fs_operations import (
     chmod_operation,
     getattr_operation,
     readdir_operation,
+    opendir_operation,
+    releasedir_operation,
     readlink_operation,
     mkdir_operation,
     symlink_operation,
@@ -46,14 +63,21 @@ from .fs_operations import (
 )
 
 
+# Operations resolving their path to a tier, retried once with a fresh resolution when another mount moved the path since it was cached
+RESOLVED_OPERATIONS = frozenset(['getattr', 'access', 'readlink', 'open', 'opendir', 'truncate', 'chmod', 'chown', 'utimens', 'unlink', 'rmdir', 'rename'])
+
 symlink_creation_windows_type = Literal['skip', 'error', 'copy', 'create_lnkfile', 'real_symlink']
+fuse_api_type = Literal['high-level', 'low-level']
 
 class PassthroughFS(ConcurrencyControllerMixIn, LoggingMixIn, Operations):
-    def __init__(self, root, patterns, cache_dir, overwrite_rename_dest, debug, log_in_file, log_in_console, log_in_syslog, symlink_creation_windows: symlink_creation_windows_type, mountpoint):
-        ConcurrencyControllerMixIn.__init__(self)
+    def __init__(self, root, patterns, cache_dir, overwrite_rename_dest, debug, log_in_file, log_in_console, log_in_syslog, symlink_creation_windows: symlink_creation_windows_type, mountpoint, resolution_cache_size: int = 65536, negative_cache_ttl: float = 1.0, negative_cache_size: int = 65536, cache_index: bool = True, migration: migration_type = 'inline', migration_workers: int = 2, durability: durability_type = 'close', durability_patterns: Dict[str, durability_type] | None = None, durability_interval: float = 5.0, nothreads: bool = False, coalesce: bool = True, lock_server: str | None = None, lock_lease: float = 10.0, lock_stats: bool = False, attr_cache_ttl: float = 1.0, attr_cache_size: int = 65536, attr_ttl_patterns: Dict[str, float] | None = None, readdir_attrs: bool = True, listing_cache_size: int = 262144, writeback_cache: bool = False, default_permissions: bool = False, open_policy: open_policy_type = 'default', open_policy_patterns: Dict[str, open_policy_type] | None = None):
+        # Background migrations touch the tiers concurrently with FUSE even when it runs single threaded
+        ConcurrencyControllerMixIn.__init__(self, enable=not nothreads or migration == 'background', coalesce=coalesce, lock_stats=lock_stats)
         LoggingMixIn.__init__(self, enable=debug, log_in_file=log_in_file, log_in_console=log_in_console, log_in_syslog=log_in_syslog)
         self.root: str = root
         self.patterns: list[str] = patterns
+        # Compiled once at mount time, is_excluded is on the hot path of every operation
+        self.pattern_matcher: PatternMatcher = PatternMatcher(patterns)
         self.cache_dir:str = cache_dir
         self.overwrite_rename_dest:bool = overwrite_rename_dest
         self.symlink_creation_windows:symlink_creation_windows_type = symlink_creation_windows
@@ -62,61 +86,301 @@ class PassthroughFS(ConcurrencyControllerMixIn, LoggingMixIn, Operations):
 
         self.renameExcludedSourceFiles: list[str] = []
         self.renameAppendLnkToFilenameFiles: list[str] = []
-
-    def get_right_path(self, path) -> str:
+        self.resolution_cache: ResolutionCache = ResolutionCache(resolution_cache_size)
+        self.negative_cache: NegativeLookupCache = NegativeLookupCache(negative_cache_ttl, negative_cache_size)
+        # The other mounts of a shared cache directory change it behind the back of the index
+        self.cache_index: CacheTierIndex = CacheTierIndex(cache_dir, enable=cache_index and not lock_server)
+        self.attr_cache: AttributeCache = AttributeCache(attr_cache_ttl, attr_cache_size, attr_ttl_patterns)
+        # Fill the attribute cache while listing directories
+        self.readdir_attrs: bool = readdir_attrs
+        self.listing_cache: DirectoryListingCache = DirectoryListingCache(listing_cache_size)
+        # The kernel caches writes and sends them later in larger chunks, open needs to adapt the flags
+        self.writeback_cache: bool = writeback_cache
+        # The kernel enforces the permissions from the attributes, the os.access checks are skipped
+        self.default_permissions: bool = default_permissions
+        # Detected once, migrations are a plain rename when both tiers share a device
+        self.tiers_share_device: bool = same_device(root, cache_dir)
+        self.migration: migration_type = migration
+        self.lock_server: str | None = lock_server
+        self.lock_lease: float = lock_lease
+        # Serializes migrations and renames with the other mounts of the same root, connected by init
+        self.coordinator: LockClient | None = None
+        # getattr and access run concurrently on a path (shared lock), its inline migration must still happen once
+        self.migration_locks: PathLockTable = PathLockTable()
+        self.migration_queue: MigrationQueue | None = MigrationQueue(self, migration_workers) if migration == 'background' else None
+        self.file_handles: FileHandleTable = FileHandleTable()
+        self.directory_handles: DirectoryHandleTable = DirectoryHandleTable()
+        self.durability: DurabilityManager = DurabilityManager(durability, durability_patterns, durability_interval)
+        # Caching flags of the files opened, per pattern
+        self.open_policy: PatternPolicy[open_policy_type] = PatternPolicy(open_policy_patterns, open_policy)
+        # Set by the low-level FUSE backend
+        self.inode_table: InodeTable | None = None
+        # Whether directories exist in the cache tier, forgotten by invalidate_caches
+        self.cache_tier_directories: Dict[str, bool] = {}
+        self.cache_tier_directories_generation: int = 0
+
+    def __call__(self, op: str, path: str, *args: Any) -> Any:
+        # The other mounts of the root move paths between the tiers without invalidating the resolutions cached here
+        stale = self.coordinator is not None and op in RESOLVED_OPERATIONS and (path in self.resolution_cache or
+                                                                                  self.inode_table is not None and self.inode_table.resolved(path) is not None)
+        try:
+            return super().__call__(op, path, *args)
+        except OSError as e:
+            if not stale or e.errno != errno.ENOENT:
+                raise
+        self.invalidate_caches(path)
+        return super().__call__(op, path, *args)
+
+    def get_right_path(self, path, migrate: bool = True) -> str:
+        """
+        Returns the real path of a FUSE path, in the root or the cache directory, and moves it to the other one if it is misplaced.
+
+        Args:
+            path (str): The FUSE path.
+            migrate (bool, optional): Move a misplaced path to the tier it belongs to. Operations that destroy the content anyway
+                (unlink, truncate to 0, open with O_TRUNC, overwritten rename destination) pass False and act on the current tier. Defaults to True.
+        """
+        inode_table = self.inode_table
+        if inode_table is not None:
+            # Resolved when the kernel looked the inode up
+            right_path = inode_table.resolved(path)
+            if right_path is not None:
+                return right_path
+        cached = self.resolution_cache.get(path)
+        if cached is not None:
+            if inode_table is not None:
+                inode_table.set_resolved(path, cached[1])
+            return cached[1]
+        if self.negative_cache.contains(path):
+            # Known to exist in neither tier, skip the lexists probes
+            return self.get_cache_path(path) if self.is_excluded(path) else self.get_full_path(path)
         full_path = self.get_full_path(path)
         cache_path = self.get_cache_path(path)
         is_excluded = self.is_excluded(path)
 
         full_exists = os.path.lexists(full_path)
-        cache_exists = os.path.lexists(cache_path)
+        cache_exists = self.exists_in_cache_tier(path, cache_path)
 
         if full_exists and cache_exists:
             # Both exist, return the most recent one
             full_mtime = os.path.getmtime(full_path)
             cache_mtime = os.path.getmtime(cache_path)
-            return cache_path if cache_mtime > full_mtime else full_path
+            if cache_mtime > full_mtime:
+                self.remember_resolution(path, 'cache', cache_path)
+                return cache_path
+            self.remember_resolution(path, 'full', full_path)
+            return full_path
         elif full_exists:
             if is_excluded:
                 # Move to cache if it should be excluded
-                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-                shutil.move(full_path, cache_path)
-                return cache_path
+                return self.relocate(path, full_path, cache_path, 'cache') if migrate else full_path
             else:
+                self.remember_resolution(path, 'full', full_path)
                 return full_path
         elif cache_exists:
             if not is_excluded:
                 # Move to full if it should not be excluded
-                os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                shutil.move(cache_path, full_path)
-                return full_path
+                return self.relocate(path, cache_path, full_path, 'full') if migrate else cache_path
             else:
+                self.remember_resolution(path, 'cache', cache_path)
                 return cache_path
         else:
             # Neither exists, return the appropriate path based on exclusion
             return cache_path if is_excluded else full_path
+
+    def remember_resolution(self, path: str, tier: tier_type, right_path: str) -> None:
+        self.resolution_cache.set(path, tier, right_path)
+        if self.inode_table is not None and self.resolution_cache.max_entries > 0:
+            self.inode_table.set_resolved(path, right_path)
+
+    def forget_resolution(self, path: str, recursive: bool = False) -> None:
+        self.resolution_cache.invalidate(path, recursive)
+        if self.inode_table is not None:
+            self.inode_table.invalidate(path, recursive)
+
+    def relocate(self, path: str, source: str, destination: str, tier: tier_type) -> str:
+        """
+        Move a misplaced path to the tier its exclusion status requires and return the path the operation must use.
+
+        In background migration mode the move is queued and the path keeps being served from its current tier until it is done.
+        Across devices, a path open through the filesystem is served from its current tier until it is closed.
+        """
+        if self.migration_queue is not None:
+            self.migration_queue.submit(path, source, destination)
+            return source
+        with self.cross_mount_lock(path), self.migration_locks.locked(path):
+            # Another operation on the same path may have moved it meanwhile
+            if os.path.lexists(source) and not os.path.lexists(destination):
+                is_directory = is_real_directory(source)
+                if not self.tiers_share_device and self.file_handles.is_open(source, recursive=is_directory):
+                    # A copy would leave the open descriptors on the removed source, the first access after they are closed moves it
+                    return source
+                move_between_tiers(source, destination, self.tiers_share_device)
+                # Anything cached below a moved directory is now stale
+                self.invalidate_caches(path, recursive=is_directory)
+        self.remember_resolution(path, tier, destination)
+        return destination
+
+    def cross_mount_lock(self, *paths: str) -> ContextManager[Any]:
+        """
+        Returns a context manager holding the locks of paths shared with the other mounts of the same root, when a lock server is configured.
+        """
+        if self.coordinator is None:
+            return nullcontext()
+        return self.coordinator.locked(*paths)
+
+    def exists_in_cache_tier(self, path: str, cache_path: str) -> bool:
+        """
+        Returns True if path exists in the cache tier, avoiding the lexists probe whenever possible.
+
+        With the cache tier index enabled, the answer comes from memory. Otherwise, below a directory that no pattern
+        can ever match, the filesystem never stores anything in the cache tier. Only misplaced entries can be found
+        there, which requires the cache-side parent directory to exist. That directory is probed once and remembered.
+        """
+        if self.cache_index.enable:
+            return self.cache_index.contains(path)
+        parent = parent_directory(path)
+        if parent != path and self.pattern_matcher.subtree_verdict(parent) == 'never' and not self.cache_tier_has_directory(parent):
+            return False
+        return os.path.lexists(cache_path)
+
+    def cache_tier_has_directory(self, directory: str) -> bool:
+        known = self.cache_tier_directories.get(directory)
+        if known is not None:
+            return known
+        generation = self.cache_tier_directories_generation
+        known = os.path.isdir(self.get_cache_path(directory))
+        # An invalidation during the probe may have made it stale
+        if generation == self.cache_tier_directories_generation:
+            if len(self.cache_tier_directories) >= 4096:
+                self.cache_tier_directories.clear()
+            self.cache_tier_directories[directory] = known
+        return known
+
+    def invalidate_caches(self, path: str, recursive: bool = False) -> None:
+        """
+        Forget everything cached about path and refresh its cache tier index entry. Must be called by every operation that creates, removes or moves a path.
+
+        Args:
+            path (str): The FUSE path that changed.
+            recursive (bool, optional): Also forget every path below it (directory rename or removal). Defaults to False.
+        """
+        self.forget_resolution(path, recursive)
+        self.negative_cache.invalidate(path, recursive)
+        self.cache_index.refresh(path)
+        # Creating a path may have created its parent directories in the cache tier, removing a directory removes those below it
+        self.cache_tier_directories_generation += 1
+        if recursive:
+            self.cache_tier_directories.clear()
+        else:
+            directory = path
+            while True:
+                self.cache_tier_directories.pop(directory, None)
+                if directory == '/':
+                    break
+                directory = parent_directory(directory)
+        self.attr_cache.invalidate(path, recursive)
+        parent = parent_directory(path)
+        # Its mtime and link count changed, present in both tiers it may now resolve to the other one (the most recent)
+        self.attr_cache.invalidate(parent)
+        if parent != path:
+            self.forget_resolution(parent)
+        if self.listing_cache.contains(path) or recursive:
+            self.listing_cache.invalidate(path, recursive)
+        if parent != path and self.listing_cache.contains(parent):
+            self.update_listing(parent, path)
+
+    def update_listing(self, parent: str, path: str) -> None:
+        """
+        Add path to or remove it from the cached listing of its parent directory, after an operation of the filesystem created, removed or moved it.
+        """
+        name = path.rstrip('/').rpartition('/')[2]
+        if self.symlink_creation_windows == 'create_lnkfile' and os.name == 'nt':
+            # Listed under another name
+            self.listing_cache.invalidate(parent)
+            return
+        present = os.path.lexists(self.get_full_path(path)) or self.exists_in_cache_tier(path, self.get_cache_path(path))
+        validators = (directory_validator(self.get_full_path(parent)), directory_validator(self.get_cache_path(parent)))
+        self.listing_cache.update(parent, name, present, validators)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the counters of the internal caches, queues and locks.
+        """
+        return {'resolution_cache': self.resolution_cache.stats(), 'negative_cache': self.negative_cache.stats(), 'attr_cache': self.attr_cache.stats(), 'listing_cache': self.listing_cache.stats(), 'pattern_matcher': self.pattern_matcher.stats(), 'cache_index': self.cache_index.stats(), 'file_handles': self.file_handles.stats(), 'directory_handles': self.directory_handles.stats(), 'durability': self.durability.stats(),
+                'single_flight': self.single_flight.stats() if self.single_flight is not None else None,
+                'coordinator': self.coordinator.stats() if self.coordinator is not None else None,
+                'inode_table': self.inode_table.stats() if self.inode_table is not None else None,
+                'locks': self.lock_stats.stats() if self.lock_stats is not None else None,
+                'migration_queue': self.migration_queue.stats() if self.migration_queue is not None else None}
         
+    def dump_stats(self, *args) -> None:
+        """
+        Print the counters as JSON, done on SIGUSR1 (`kill -USR1 <pid>`).
+        """
+        print(json.dumps(self.stats(), indent=2, default=str), flush=True)
+
     # Filesystem methods
+    def init(self, path):
+        # Called in the mounted process, FUSE forks into the background after __init__ and the threads started before the fork are lost
+        if self.lock_server:
+            self.coordinator = LockClient(self.lock_server, os.path.realpath(self.root), self.lock_lease)
+        self.durability.start()
+        # start_passthrough_fs blocks SIGUSR1 in every thread before mounting when the lock statistics are requested
+        if self.lock_stats is not None and hasattr(signal, 'pthread_sigmask') and signal.SIGUSR1 in signal.pthread_sigmask(signal.SIG_BLOCK, []):
+            Thread(target=wait_for_stats_dump_signal, args=(self,), name='stats-dump', daemon=True).start()
+
+    def destroy(self, path):
+        # Finish the pending migrations before unmounting
+        if self.migration_queue is not None:
+            self.migration_queue.shutdown()
+        # Commit the files waiting for the next periodic fsync
+        self.durability.shutdown()
+        if self.coordinator is not None:
+            self.coordinator.close()
+        self.directory_handles.close_all()
+
     def getattr(self, path, fh=None):
         return getattr_operation(self, path, fh)
 
-    def readdir(self, path, fh):
-        return readdir_operation(self, path, fh)
+    def opendir(self, path) -> int:
+        return opendir_operation(self, path)
+
+    def readdir(self, path, fh, offset=None):
+        return readdir_operation(self, path, fh, offset)
+
+    def releasedir(self, path, fh):
+        return releasedir_operation(self, path, fh)
 
-    def open(self, path, flags) -> int:
-        return open_operation(self, path, flags)
+    def open(self, path, flags, fi=None) -> int:
+        try:
+            return open_operation(self, path, flags, fi)
+        finally:
+            if flags & os.O_CREAT:
+                self.invalidate_caches(path)
+            elif flags & os.O_TRUNC:
+                self.attr_cache.invalidate(path)
     
     def read(self, path, length, offset, fh):
         return read_operation(self, path, length, offset, fh)
 
     def write(self, path, buf, offset, fh):
-        return write_operation(self, path, buf, offset, fh)
+        try:
+            return write_operation(self, path, buf, offset, fh)
+        finally:
+            self.attr_cache.invalidate(path)
     
     def chmod(self, path, mode):
-        return chmod_operation(self, path, mode)
+        try:
+            return chmod_operation(self, path, mode)
+        finally:
+            self.attr_cache.invalidate(path)
 
     def chown(self, path, uid, gid):
-        return chown_operation(self, path, uid, gid)
+        try:
+            return chown_operation(self, path, uid, gid)
+        finally:
+            self.attr_cache.invalidate(path)
 
     def release(self, path, fh):
         return release_operation(self, path, fh)
@@ -134,13 +398,22 @@ class PassthroughFS(ConcurrencyControllerMixIn, LoggingMixIn, Operations):
         return lock_operation(self, path, fh, cmd, lock)
 
     def truncate(self, path, length, fh=None):
-        return truncate_operation(self, path, length, fh)
+        try:
+            return truncate_operation(self, path, length, fh)
+        finally:
+            self.attr_cache.invalidate(path)
 
     def utimens(self, path, times=None):
-        return utimens_operation(self, path, times)
+        try:
+            return utimens_operation(self, path, times)
+        finally:
+            self.attr_cache.invalidate(path)
 
     def unlink(self, path):
-        return unlink_operation(self, path)
+        try:
+            return unlink_operation(self, path)
+        finally:
+            self.invalidate_caches(path)
 
     def statfs(self, path):
         return statfs_operation(self, path)
@@ -149,19 +422,41 @@ class PassthroughFS(ConcurrencyControllerMixIn, LoggingMixIn, Operations):
         return readlink_operation(self, path)
 
     def rmdir(self, path):
-        return rmdir_operation(self, path)
+        try:
+            return rmdir_operation(self, path)
+        finally:
+            self.invalidate_caches(path, recursive=True)
 
     def mkdir(self, path, mode) -> None:
-        return mkdir_operation(self, path, mode)
+        try:
+            return mkdir_operation(self, path, mode)
+        finally:
+            self.invalidate_caches(path)
 
     def symlink(self, link_location: str, name: str) -> None:
-        return symlink_operation(self, link_location, name)
+        try:
+            return symlink_operation(self, link_location, name)
+        finally:
+            self.invalidate_caches(link_location)
 
     def rename(self, old, new):
-        return rename_operation(self, old, new)
-
-    def create(self, path, mode):
-        return create_operation(self, path, mode)
+        # Only a directory has cached entries below it, in either path
+        is_directory = is_real_directory(self.get_full_path(old)) or is_real_directory(self.get_cache_path(old))
+        # Every cross-mount lock of the rename is taken at once, in order: the relocations nested in it are covered by these.
+        # Moving a directory creates it with mkdir, which may relocate the destination parent
+        locked_paths = (old, new, parent_directory(new)) if is_directory else (old, new)
+        try:
+            with self.cross_mount_lock(*locked_paths):
+                return rename_operation(self, old, new)
+        finally:
+            self.invalidate_caches(old, recursive=is_directory)
+            self.invalidate_caches(new, recursive=is_directory)
+
+    def create(self, path, mode, fi=None):
+        try:
+            return create_operation(self, path, mode, fi)
+        finally:
+            self.invalidate_caches(path)
 
     def get_full_path(self, path):
         p = Path(self.root) / Path(path.lstrip("/"))
@@ -172,9 +467,35 @@ class PassthroughFS(ConcurrencyControllerMixIn, LoggingMixIn, Operations):
         return str(p)
 
     def is_excluded(self, path):
-        if not self.patterns:
-            return False
-        return glob_match(path, self.patterns)
+        return self.pattern_matcher.is_excluded(path)
+
+
+class StreamingFUSE(FUSE):
+    """
+    FUSE passing the readdir offset to the operations, refuse drops it. Entries are filled with their offset, so libfuse asks for
+    a directory one buffer at a time instead of buffering the whole listing.
+    open and create also get the file info structure to set the caching flags, the other operations still get the bare file handle.
+    """
+
+    def open(self, path, fip):
+        fi = fip.contents
+        fi.fh = self.operations('open', path.decode(self.encoding), fi.flags, fi)
+        return 0
+
+    def create(self, path, mode, fip):
+        fi = fip.contents
+        fi.fh = self.operations('create', path.decode(self.encoding), mode, fi)
+        return 0
+
+    def readdir(self, path, buf, filler, offset, fip):
+        for name, attrs, next_offset in self.operations('readdir', self._decode_optional_path(path), fip.contents.fh, offset):
+            st = None
+            if attrs:
+                st = c_stat()
+                set_st_attrs(st, attrs, use_ns=self.use_ns)
+            if filler(buf, name.encode(self.encoding), st, next_offset) != 0:
+                break
+        return 0
 
 
 def default_uid_and_gid():
@@ -235,7 +556,7 @@ def default_rellinks() -> bool:
     else:
         return False
     
-def start_passthrough_fs(mountpoint:str, root:str, patterns:None|list[str]=None, cache_dir:str|None=None,uid:int=default_uid_and_gid()[0],gid:int=default_uid_and_gid()[1],foreground:bool=True,nothreads:bool=False,fusedebug:bool=False, overwrite_rename_dest:bool=default_overwrite_rename_dest(),debug:bool=False,log_in_file:str|None=None,log_in_console:bool=True,log_in_syslog:bool=False,symlink_creation_windows:symlink_creation_windows_type=default_symlink_creation_windows(),rellinks:bool=default_rellinks()):
+def start_passthrough_fs(mountpoint:str, root:str, patterns:None|list[str]=None, cache_dir:str|None=None,uid:int=default_uid_and_gid()[0],gid:int=default_uid_and_gid()[1],foreground:bool=True,nothreads:bool=False,fusedebug:bool=False, overwrite_rename_dest:bool=default_overwrite_rename_dest(),debug:bool=False,log_in_file:str|None=None,log_in_console:bool=True,log_in_syslog:bool=False,symlink_creation_windows:symlink_creation_windows_type=default_symlink_creation_windows(),rellinks:bool=default_rellinks(),resolution_cache_size:int=65536,negative_cache_ttl:float=1.0,negative_cache_size:int=65536,negative_timeout:float|None=None,cache_index:bool=True,migration:migration_type='inline',migration_workers:int=2,durability:durability_type='close',durability_patterns:Dict[str,durability_type]|None=None,durability_interval:float=5.0,coalesce:bool=True,lock_server:str|None=None,lock_lease:float=10.0,lock_stats:bool=False,attr_cache_ttl:float=1.0,attr_cache_size:int=65536,attr_ttl_patterns:Dict[str,float]|None=None,readdir_attrs:bool=True,listing_cache_size:int=262144,attr_timeout:float|None=None,entry_timeout:float|None=None,writeback_cache:bool=False,fuse_preset:fuse_preset_type|None=None,max_read:int|None=None,max_write:int|None=None,big_writes:bool|None=None,max_background:int|None=None,congestion_threshold:int|None=None,kernel_cache:bool|None=None,auto_cache:bool|None=None,default_permissions:bool=False,open_policy:open_policy_type='default',open_policy_patterns:Dict[str,open_policy_type]|None=None,fuse_api:fuse_api_type='high-level'):
     if not root:
         raise ValueError("Root directory must be specified")
     if patterns:
@@ -252,8 +573,83 @@ def start_passthrough_fs(mountpoint:str, root:str, patterns:None|list[str]=None,
     #Check symlink_creation_windows
     if symlink_creation_windows not in get_args(symlink_creation_windows_type):
         raise ValueError(f"symlink_creation_windows must be one of {get_args(symlink_creation_windows_type)}")
+
+    if not isinstance(resolution_cache_size, int) or resolution_cache_size < 0:
+        raise ValueError("resolution_cache_size must be a positive integer or 0 to disable the cache")
+    if not isinstance(negative_cache_ttl, (int, float)) or negative_cache_ttl < 0:
+        raise ValueError("negative_cache_ttl must be a positive number of seconds or 0 to disable the cache")
+    if not isinstance(negative_cache_size, int) or negative_cache_size < 0:
+        raise ValueError("negative_cache_size must be a positive integer or 0 to disable the cache")
+    if not isinstance(attr_cache_ttl, (int, float)) or attr_cache_ttl < 0:
+        raise ValueError("attr_cache_ttl must be a positive number of seconds or 0 to disable the cache")
+    if not isinstance(attr_cache_size, int) or attr_cache_size < 0:
+        raise ValueError("attr_cache_size must be a positive integer or 0 to disable the cache")
+    for ttl in (attr_ttl_patterns or {}).values():
+        if not isinstance(ttl, (int, float)) or ttl < 0:
+            raise ValueError("attr_ttl_patterns values must be positive numbers of seconds or 0 to disable the cache")
+    if not isinstance(listing_cache_size, int) or listing_cache_size < 0:
+        raise ValueError("listing_cache_size must be a positive integer or 0 to disable the cache")
+
+    if migration not in get_args(migration_type):
+        raise ValueError(f"migration must be one of {get_args(migration_type)}")
+    if not isinstance(migration_workers, int) or migration_workers < 1:
+        raise ValueError("migration_workers must be a strictly positive integer")
+
+    for mode in [durability, *(durability_patterns or {}).values()]:
+        if mode not in get_args(durability_type):
+            raise ValueError(f"durability must be one of {get_args(durability_type)}")
+    for mode in [open_policy, *(open_policy_patterns or {}).values()]:
+        if mode not in get_args(open_policy_type):
+            raise ValueError(f"open_policy must be one of {get_args(open_policy_type)}")
+    if not isinstance(durability_interval, (int, float)) or durability_interval <= 0:
+        raise ValueError("durability_interval must be a strictly positive number of seconds")
+
+    if lock_server is not None and os.name == 'nt':
+        raise ValueError("lock_server is not supported on Windows")
+    if not isinstance(lock_lease, (int, float)) or lock_lease <= 0:
+        raise ValueError("lock_lease must be a strictly positive number of seconds")
+
+    if writeback_cache and os.name == 'nt':
+        raise ValueError("writeback_cache is not supported on Windows")
+    if writeback_cache and not supports_writeback_cache():
+        raise ValueError("writeback_cache requires libfuse 3, the libfuse found does not support it")
+    if default_permissions and os.name == 'nt':
+        raise ValueError("default_permissions is not supported on Windows")
+    if fuse_api not in get_args(fuse_api_type):
+        raise ValueError(f"fuse_api must be one of {get_args(fuse_api_type)}")
+    if fuse_api == 'low-level' and os.name == 'nt':
+        raise ValueError("The low-level FUSE API is not supported on Windows")
+    if fuse_api == 'low-level' and rellinks:
+        raise ValueError("rellinks is not supported with the low-level FUSE API")
+
+    fuse_kwargs: Dict[str, Any] = fuse_session_options(fuse_preset, {'negative_timeout': negative_timeout, 'attr_timeout': attr_timeout, 'entry_timeout': entry_timeout,
+                                                                     'writeback_cache': writeback_cache, 'max_read': max_read, 'max_write': max_write, 'big_writes': big_writes,
+                                                                     'max_background': max_background, 'congestion_threshold': congestion_threshold,
+                                                                     'kernel_cache': kernel_cache, 'auto_cache': auto_cache,
+                                                                     'default_permissions': default_permissions})
     
-    fuse = FUSE(PassthroughFS(root, patterns, cache_dir,overwrite_rename_dest=overwrite_rename_dest,debug=debug,log_in_file=log_in_file,log_in_console=log_in_console,log_in_syslog=log_in_syslog,symlink_creation_windows=symlink_creation_windows,mountpoint=mountpoint), mountpoint,foreground=foreground,nothreads=nothreads,debug=fusedebug,uid=uid,gid=gid,rellinks=rellinks)
+    # Must be done before FUSE starts its threads, they inherit the mask. Restored once unmounted
+    previous_signal_mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1}) if lock_stats and hasattr(signal, 'pthread_sigmask') else None
+    try:
+        operations = PassthroughFS(root, patterns, cache_dir,overwrite_rename_dest=overwrite_rename_dest,debug=debug,log_in_file=log_in_file,log_in_console=log_in_console,log_in_syslog=log_in_syslog,symlink_creation_windows=symlink_creation_windows,mountpoint=mountpoint,resolution_cache_size=resolution_cache_size,negative_cache_ttl=negative_cache_ttl,negative_cache_size=negative_cache_size,cache_index=cache_index,migration=migration,migration_workers=migration_workers,durability=durability,durability_patterns=durability_patterns,durability_interval=durability_interval,nothreads=nothreads,coalesce=coalesce,lock_server=lock_server,lock_lease=lock_lease,lock_stats=lock_stats,attr_cache_ttl=attr_cache_ttl,attr_cache_size=attr_cache_size,attr_ttl_patterns=attr_ttl_patterns,readdir_attrs=readdir_attrs,listing_cache_size=listing_cache_size,writeback_cache=writeback_cache,default_permissions=default_permissions,open_policy=open_policy,open_policy_patterns=open_policy_patterns)
+        if fuse_api == 'low-level':
+            # Imported here, refuse.low only finds libfuse on Linux and macOS
+            from .lowlevel import LowLevelFUSE
+            LowLevelFUSE(operations, mountpoint,foreground=foreground,nothreads=nothreads,debug=fusedebug,uid=uid,gid=gid,**fuse_kwargs)
+        else:
+            fuse = StreamingFUSE(operations, mountpoint,foreground=foreground,nothreads=nothreads,debug=fusedebug,uid=uid,gid=gid,rellinks=rellinks,**fuse_kwargs)
+    finally:
+        if previous_signal_mask is not None:
+            signal.pthread_sigmask(signal.SIG_SETMASK, previous_signal_mask)
+
+def wait_for_stats_dump_signal(operations: PassthroughFS) -> None:
+    """
+    Dump the counters on SIGUSR1. Python signal handlers only run in the main thread, which is blocked in the FUSE loop,
+    so the signal is blocked in every thread and received here with sigwait. Started by init, in the process serving the mount.
+    """
+    while True:
+        signal.sigwait({signal.SIGUSR1})
+        operations.dump_stats()
 
 def parse_options(options: str) -> Dict[str, str]:
     """Parse options string with escaping"""
@@ -267,6 +663,19 @@ def split_escaped(separator: str, value: str) -> List[str]:
     """Split a string on a separator, handling escaping"""
     return re.split(rf'(?<!\\){separator}', value)
 
+# Options mapping patterns to a value, given as pattern1=value1:pattern2=value2
+PATTERN_MAP_OPTIONS = ['durability_patterns', 'attr_ttl_patterns', 'open_policy_patterns']
+
+def parse_pattern_map(value: str) -> Dict[str, Any]:
+    """Parse a colon-separated list of pattern=value pairs, the value being after the last '='"""
+    pattern_map: Dict[str, Any] = {}
+    for item in split_escaped(':', value.replace('\\ ', ' ')):
+        pattern, separator, item_value = item.rpartition('=')
+        if not separator or not pattern:
+            raise ValueError(f"Invalid pattern=value pair: {item}")
+        pattern_map[pattern.replace('\\:', ':')] = str2type(item_value, decode_escape=False)
+    return pattern_map
+
 def cli() -> None:
     parser = argparse.ArgumentParser(description="PassthroughFS")
     parser.add_argument("mountpoint", help="Mount point for the filesystem")
@@ -279,7 +688,7 @@ def cli() -> None:
     options: Dict[str, Any] = parse_options(args.options)
     # Pass each options value to the right type using str2type () except for patterns
     for key in options:
-        if key != 'patterns':
+        if key != 'patterns' and key not in PATTERN_MAP_OPTIONS:
             options[key] = str2type(options[key].replace('\\:', ':').replace('\\,', ',').replace('\\=', '=').replace('\\ ', ' '), decode_escape=False)
 
     if 'patterns' in options:
@@ -287,6 +696,9 @@ def cli() -> None:
         options['patterns'] = split_escaped(':', options['patterns'].replace('\\ ', ' '))
 
     try:
+        for key in PATTERN_MAP_OPTIONS:
+            if key in options:
+                options[key] = parse_pattern_map(options[key])
         start_passthrough_fs(args.mountpoint, **options)
     except (TypeError, ValueError) as e:
         parser.error(str(e))
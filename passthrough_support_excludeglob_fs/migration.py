@@ -0,0 +1,210 @@
+import os
+import errno
+import shutil
+import logging
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Any, Dict, Literal, Tuple
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+migration_type = Literal['inline', 'background']
+
+log = logging.getLogger('passthrough_support_excludeglob_fs')
+
+
+# _IOW(0x94, 9, int): share the extents of a file with another one (btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+
+
+def same_device(first: str, second: str) -> bool:
+    """
+    Returns True if both directories are on the same device, i.e. a file can be renamed from one to the other.
+    """
+    try:
+        return os.stat(first).st_dev == os.stat(second).st_dev
+    except OSError:
+        return False
+
+
+def is_real_directory(path: str) -> bool:
+    """
+    Returns True if path is a directory, not a symbolic link to one.
+    """
+    return os.path.isdir(path) and not os.path.islink(path)
+
+
+def clone_or_copy(source: str, destination: str, *, follow_symlinks: bool = True) -> str:
+    """
+    Copy a file as a reflink when the filesystem supports it (no data is copied), with a regular copy as fallback.
+    Suitable as the copy_function of shutil.move and shutil.copytree.
+    """
+    if fcntl is not None and not os.path.islink(source):
+        try:
+            with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            pass
+        else:
+            shutil.copystat(source, destination)
+            return destination
+    return shutil.copy2(source, destination, follow_symlinks=follow_symlinks)
+
+
+def move_between_tiers(source: str, destination: str, same_device: bool = False) -> None:
+    """
+    Move a file or directory from one tier to the other, creating the missing parent directories.
+
+    When both tiers are on the same device the move is a single atomic rename. Otherwise the data is copied,
+    as reflinks when possible, and the source is removed.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if same_device:
+        try:
+            os.rename(source, destination)
+            return
+        except OSError as e:
+            # The tiers may contain mount points
+            if e.errno != errno.EXDEV:
+                raise
+    shutil.move(source, destination, copy_function=clone_or_copy)
+
+
+def replace_across_tiers(source: str, destination: str, source_open: bool = False) -> None:
+    """
+    os.replace that also works when source and destination are on different devices.
+    The file is copied next to the destination first, so that the destination is still replaced atomically.
+    A source open through the filesystem is not copied, the open descriptors would keep using the removed source: EXDEV is raised
+    instead, and the program renaming it falls back to copying it itself.
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV or source_open:
+            raise
+    fd, temporary = tempfile.mkstemp(prefix='.passthrough-', dir=os.path.dirname(destination))
+    os.close(fd)
+    try:
+        if os.path.islink(source):
+            os.unlink(temporary)
+            os.symlink(os.readlink(source), temporary)
+        else:
+            clone_or_copy(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.unlink(temporary)
+        raise
+    os.unlink(source)
+
+
+class MigrationQueue:
+    """
+    Background worker pool moving misplaced paths to the tier their exclusion status requires.
+
+    A path is migrated at most once at a time (single flight): submitting a path already queued or
+    being moved is a no-op. The move is done while holding the per-path lock of the filesystem, so it
+    never runs concurrently with an operation on the same path.
+
+    When the tiers are on different devices the data is copied: a path open through the filesystem is not moved, since the open
+    descriptors would keep using the removed source. Its migration is postponed and submitted again by `resume` once it is closed.
+    """
+
+    def __init__(self, fs: Any, max_workers: int = 2) -> None:
+        self.fs = fs
+        self.max_workers: int = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='migration')
+        self.pending: Dict[str, Future] = {}
+        # Real source path -> (path, destination) of the migrations waiting for the source to be closed
+        self.postponed: Dict[str, Tuple[str, str]] = {}
+        self.lock = Lock()
+        self.queued: int = 0
+        self.completed: int = 0
+        self.skipped: int = 0
+        self.postponements: int = 0
+        self.failed: int = 0
+        self.bytes_moved: int = 0
+
+    def submit(self, path: str, source: str, destination: str) -> None:
+        with self.lock:
+            if path in self.pending:
+                return
+            self.queued += 1
+            self.pending[path] = self.executor.submit(self._migrate, path, source, destination)
+
+    def _migrate(self, path: str, source: str, destination: str) -> None:
+        try:
+            with self.fs.get_filelock_for_path(path), self.fs.cross_mount_lock(path):
+                # The path may have been removed, renamed or migrated inline since it was queued
+                if not os.path.lexists(source) or os.path.lexists(destination):
+                    with self.lock:
+                        self.skipped += 1
+                    return
+                is_directory = is_real_directory(source)
+                if not self.fs.tiers_share_device and self.fs.file_handles.is_open(source, recursive=is_directory):
+                    with self.lock:
+                        self.postponed[source] = (path, destination)
+                        self.postponements += 1
+                    return
+                size = os.lstat(source).st_size if not is_directory else 0
+                move_between_tiers(source, destination, self.fs.tiers_share_device)
+                self.fs.invalidate_caches(path, recursive=is_directory)
+            with self.lock:
+                self.completed += 1
+                self.bytes_moved += size
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            log.exception("Background migration of %s from %s to %s failed", path, source, destination)
+        finally:
+            with self.lock:
+                self.pending.pop(path, None)
+
+    def resume(self, right_path: str) -> None:
+        """
+        Called when a file is closed: submit again the migrations postponed for it or for a directory above it, once nothing below is open.
+        """
+        if not self.postponed:
+            return
+        with self.lock:
+            sources = []
+            source = right_path
+            while True:
+                if source in self.postponed:
+                    sources.append(source)
+                parent = os.path.dirname(source)
+                if parent == source:
+                    break
+                source = parent
+        for source in sources:
+            if self.fs.file_handles.is_open(source, recursive=True):
+                continue
+            with self.lock:
+                postponed = self.postponed.pop(source, None)
+            if postponed is not None:
+                path, destination = postponed
+                self.submit(path, source, destination)
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """
+        Wait for every queued migration to finish. Returns False if the timeout expired first.
+        """
+        with self.lock:
+            futures = list(self.pending.values())
+        not_done = wait(futures, timeout=timeout).not_done
+        return not not_done
+
+    def shutdown(self) -> None:
+        self.drain()
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'workers': self.max_workers, 'pending': len(self.pending), 'queued': self.queued, 'completed': self.completed,
+                    'skipped': self.skipped, 'failed': self.failed, 'bytes_moved': self.bytes_moved, 'postponed': len(self.postponed),
+                    'postponements': self.postponements}
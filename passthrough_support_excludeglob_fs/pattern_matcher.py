@@ -0,0 +1,252 @@
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Generic, Iterable, List, Literal, Mapping, Set, Tuple, TypeVar
+from globmatch.pathutils import explode_path
+from globmatch.translation import translate_glob, translate_glob_part
+
+SEPARATORS = os.sep if os.altsep is None else os.sep + os.altsep
+_split_on_separators = re.compile('[%s]' % re.escape(SEPARATORS)).split
+_magic_characters = re.compile(r'[*?\[]')
+
+subtree_verdict_type = Literal['always', 'never', 'mixed']
+
+T = TypeVar('T')
+
+
+class _Node:
+    """A state of the segment automaton, reached after matching a prefix of the pattern parts."""
+    __slots__ = ('literal', 'suffixes', 'globs', 'double_star', 'loops', 'terminal', 'final_double_star')
+
+    def __init__(self, loops: bool = False) -> None:
+        # Edges consuming one path segment
+        self.literal: Dict[str, '_Node'] = {}
+        self.suffixes: Dict[int, Dict[str, '_Node']] = {}
+        self.globs: List[Tuple[Callable[[str], re.Match[str] | None], '_Node']] = []
+        # Edge consuming zero segment, the target loops on any segment
+        self.double_star: '_Node | None' = None
+        self.loops: bool = loops
+        # A pattern ends with a non-** part on this node
+        self.terminal: bool = False
+        # A pattern ends with a final ** on this node
+        self.final_double_star: bool = False
+
+
+class PatternMatcher:
+    """
+    Matches paths against a list of glob patterns with the exact semantics of `globmatch.glob_match`.
+
+    The patterns are compiled once into a segment automaton: a trie of pattern parts in which literal parts
+    are dict lookups, `*suffix` parts are suffix lookups and `**` is a looping state. A lookup therefore costs
+    one pass over the path segments whatever the number of patterns. The few patterns that cannot be matched
+    segment by segment (negated brackets or separators inside a part) are kept as translated regexes.
+    Results are memoized in a bounded LRU.
+
+    The automaton also decides, per directory, whether every path below it is excluded ('always'), none is
+    ('never') or it depends on the path ('mixed'). Verdicts are cached per directory and let lookups under a
+    decided subtree skip matching entirely.
+    """
+
+    def __init__(self, patterns: Iterable[str] | None, memo_size: int = 4096, verdict_memo_size: int = 4096) -> None:
+        self.patterns: list[str] = list(patterns) if patterns else []
+        self.root: _Node = _Node()
+        self.fallback_regexes: list[re.Pattern[str]] = []
+        part_matchers: Dict[str, Callable[[str], re.Match[str] | None]] = {}
+        for pattern in self.patterns:
+            parts = self._segment_parts(explode_path(os.path.normcase(pattern)))
+            if parts is None:
+                self.fallback_regexes.append(re.compile(translate_glob(os.path.normcase(pattern))))
+                continue
+            node = self.root
+            for index, part in enumerate(parts):
+                last = index == len(parts) - 1
+                if part == '**':
+                    if node.double_star is None:
+                        node.double_star = _Node(loops=True)
+                    node = node.double_star
+                    if last:
+                        node.final_double_star = True
+                    continue
+                if not _magic_characters.search(part):
+                    node = node.literal.setdefault(part, _Node())
+                elif part[0] == '*' and not _magic_characters.search(part, 1):
+                    node = node.suffixes.setdefault(len(part) - 1, {}).setdefault(part[1:], _Node())
+                else:
+                    matcher = part_matchers.get(part)
+                    if matcher is None:
+                        matcher = re.compile(r'(?s:%s)\Z' % translate_glob_part(part)).match
+                        part_matchers[part] = matcher
+                    for existing_matcher, child in node.globs:
+                        if existing_matcher is matcher:
+                            node = child
+                            break
+                    else:
+                        child = _Node()
+                        node.globs.append((matcher, child))
+                        node = child
+                if last:
+                    node.terminal = True
+        self.match = lru_cache(maxsize=memo_size)(self._match)
+        self.subtree_verdict = lru_cache(maxsize=verdict_memo_size)(self._subtree_verdict)
+        self.verdict_skips: int = 0
+
+    @staticmethod
+    def _segment_parts(parts: Tuple[str, ...]) -> List[str] | None:
+        """
+        Return the pattern parts as parts matching exactly one path segment, or None if the pattern cannot be matched segment by segment.
+
+        A literal part holding separators (the '/' head of an absolute pattern) is equivalent to one empty literal part per separator.
+        """
+        segment_parts: List[str] = []
+        for part in parts:
+            # A negated bracket can match a separator
+            if '[!' in part:
+                return None
+            pieces = _split_on_separators(part)
+            if len(pieces) > 1:
+                if _magic_characters.search(part):
+                    return None
+                segment_parts.extend(pieces)
+            else:
+                segment_parts.append(part)
+        return segment_parts
+
+    def is_excluded(self, path: str) -> bool:
+        """
+        Return True if the FUSE path matches one of the patterns, using the verdict of its parent directory when it is decided.
+        """
+        parent = parent_directory(path)
+        if parent != path:
+            verdict = self.subtree_verdict(parent)
+            if verdict != 'mixed':
+                self.verdict_skips += 1
+                return verdict == 'always'
+        return self.match(path)
+
+    @staticmethod
+    def _closure(nodes: Iterable[_Node]) -> Set[_Node]:
+        result: Set[_Node] = set()
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if node in result:
+                continue
+            result.add(node)
+            if node.double_star is not None:
+                stack.append(node.double_star)
+        return result
+
+    @staticmethod
+    def _edges(node: _Node, segment: str) -> List[_Node]:
+        """Return the nodes reached from node by consuming segment."""
+        reached = []
+        child = node.literal.get(segment)
+        if child is not None:
+            reached.append(child)
+        for length, suffixes in node.suffixes.items():
+            if len(segment) >= length:
+                child = suffixes.get(segment[len(segment) - length:])
+                if child is not None:
+                    reached.append(child)
+        for matcher, child in node.globs:
+            if matcher(segment):
+                reached.append(child)
+        if node.loops:
+            reached.append(node)
+        return reached
+
+    def _advance(self, states: Set[_Node], segment: str) -> Set[_Node]:
+        reached: List[_Node] = []
+        for node in states:
+            reached.extend(self._edges(node, segment))
+        return self._closure(reached)
+
+    def _match(self, path: str) -> bool:
+        path = os.path.normcase(path)
+        for regex in self.fallback_regexes:
+            if regex.match(path):
+                return True
+        if not self.patterns:
+            return False
+        segments = _split_on_separators(path)
+        last = len(segments) - 1
+        trailing_separator = last > 0 and segments[last] == ''
+        states = self._closure((self.root,))
+        for position, segment in enumerate(segments):
+            for node in states:
+                # A final ** matches any non empty remainder
+                if node.final_double_star and not (position == last and segment == ''):
+                    return True
+            if position == last or (position == last - 1 and trailing_separator):
+                # The last part may be followed by one trailing separator
+                for node in states:
+                    for child in self._edges(node, segment):
+                        if child.terminal:
+                            return True
+                if position == last:
+                    return False
+            states = self._advance(states, segment)
+            if not states:
+                return False
+        return False
+
+    def _subtree_verdict(self, directory: str) -> subtree_verdict_type:
+        parent = parent_directory(directory)
+        if parent != directory:
+            # A decided subtree stays decided for all its subdirectories
+            verdict = self.subtree_verdict(parent)
+            if verdict != 'mixed':
+                return verdict
+        if not self.patterns:
+            return 'never'
+        # Consume every segment of the directory, each one being followed by a separator in the paths below it
+        states = self._closure((self.root,))
+        # The root directory is a single empty segment ('/x' splits into '' and 'x')
+        for segment in _split_on_separators(os.path.normcase(directory.rstrip('/'))):
+            states = self._advance(states, segment)
+        if any(node.final_double_star for node in states):
+            return 'always'
+        if self.fallback_regexes:
+            # Translated regexes cannot be evaluated on a prefix
+            return 'mixed'
+        for node in states:
+            if node.literal or node.suffixes or node.globs or node.double_star is not None or node.loops:
+                return 'mixed'
+        return 'never'
+
+    def stats(self) -> dict[str, int]:
+        info = self.match.cache_info()
+        verdict_info = self.subtree_verdict.cache_info()
+        return {'patterns': len(self.patterns), 'memo_entries': info.currsize, 'memo_hits': info.hits, 'memo_misses': info.misses,
+                'verdict_entries': verdict_info.currsize, 'verdict_skips': self.verdict_skips}
+
+
+class PatternPolicy(Generic[T]):
+    """
+    Maps FUSE paths to a setting: the value of the first pattern matching the path, or the default value.
+    Lookups are memoized in a bounded LRU.
+    """
+
+    def __init__(self, mapping: Mapping[str, T] | None, default: T, memo_size: int = 4096) -> None:
+        self.mapping: Dict[str, T] = dict(mapping) if mapping else {}
+        self.default: T = default
+        self.rules: List[Tuple[PatternMatcher, T]] = [(PatternMatcher([pattern], memo_size=0, verdict_memo_size=0), value) for pattern, value in self.mapping.items()]
+        self.lookup = lru_cache(maxsize=memo_size)(self._lookup)
+
+    def _lookup(self, path: str) -> T:
+        for matcher, value in self.rules:
+            if matcher.match(path):
+                return value
+        return self.default
+
+    def values(self) -> Set[T]:
+        """Returns every value a path can be mapped to."""
+        return set(self.mapping.values()) | {self.default}
+
+
+def parent_directory(path: str) -> str:
+    """
+    Return the parent directory of a FUSE path ('/' is its own parent).
+    """
+    head = path.rstrip('/').rpartition('/')[0]
+    return head or '/'
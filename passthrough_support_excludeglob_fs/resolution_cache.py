@@ -0,0 +1,289 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Container, Dict, List, Literal, Mapping, Set, Tuple
+
+from .pattern_matcher import PatternPolicy, parent_directory
+
+tier_type = Literal['full', 'cache']
+
+
+class SubtreeIndex:
+    """
+    Index of the keys of a path-keyed cache by parent directory, so that the keys below a directory are found without scanning every key.
+
+    Every directory holding a key or an indexed directory lists them, up to the root. Must be updated under the lock of the cache.
+    """
+
+    def __init__(self) -> None:
+        self.children: Dict[str, Set[str]] = {}
+
+    def add(self, path: str) -> None:
+        while path != '/':
+            parent = parent_directory(path)
+            children = self.children.get(parent)
+            if children is None:
+                # The parent is not indexed yet, link it to its own parent too
+                self.children[parent] = {path}
+                path = parent
+                continue
+            children.add(path)
+            return
+
+    def discard(self, path: str, keys: Container[str]) -> None:
+        """
+        Unlink path, no longer a key, and the directories left without keys below them.
+        """
+        while path != '/' and path not in self.children and path not in keys:
+            parent = parent_directory(path)
+            children = self.children.get(parent)
+            if children is None:
+                return
+            children.discard(path)
+            if children:
+                return
+            del self.children[parent]
+            path = parent
+
+    def subtree(self, path: str) -> List[str]:
+        """
+        Returns the keys and directories below path.
+        """
+        below: List[str] = []
+        stack = [path]
+        while stack:
+            children = self.children.get(stack.pop())
+            if children:
+                below.extend(children)
+                stack.extend(children)
+        return below
+
+    def pop_subtree(self, path: str) -> List[str]:
+        """
+        Remove and return the keys and directories below path.
+        """
+        below: List[str] = []
+        stack = [path]
+        while stack:
+            children = self.children.pop(stack.pop(), None)
+            if children:
+                below.extend(children)
+                stack.extend(children)
+        return below
+
+    def clear(self) -> None:
+        self.children.clear()
+
+
+class ResolutionCache:
+    """
+    Bounded LRU cache remembering in which tier ('full' or 'cache') a FUSE path was resolved.
+
+    Only paths that exist in one of the tiers are stored. Entries must be invalidated by every
+    operation that creates, removes or moves a path.
+    """
+
+    def __init__(self, max_entries: int = 65536) -> None:
+        self.max_entries: int = max_entries
+        self.entries: OrderedDict[str, Tuple[tier_type, str]] = OrderedDict()
+        self.lock = Lock()
+        self.index: SubtreeIndex = SubtreeIndex()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, path: str) -> Tuple[tier_type, str] | None:
+        """
+        Return the cached (tier, right_path) tuple for path or None if unknown.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+    def __contains__(self, path: str) -> bool:
+        # Does not count as a hit or a miss
+        return path in self.entries
+
+    def set(self, path: str, tier: tier_type, right_path: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[path] = (tier, right_path)
+            self.entries.move_to_end(path)
+            self.index.add(path)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.index.discard(evicted, self.entries)
+
+    def invalidate(self, path: str, recursive: bool = False) -> None:
+        """
+        Drop the entry of path.
+
+        Args:
+            path (str): The FUSE path to forget.
+            recursive (bool, optional): Also drop every entry below path (used when a directory is renamed or removed). Defaults to False.
+        """
+        with self.lock:
+            self.entries.pop(path, None)
+            if recursive:
+                for key in self.index.pop_subtree(path):
+                    self.entries.pop(key, None)
+            self.index.discard(path, self.entries)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.index.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+
+class NegativeLookupCache:
+    """
+    Bounded cache of FUSE paths known to exist in neither tier.
+
+    Entries expire after ttl seconds so that files created behind the back of the filesystem
+    (directly in root or cache_dir) eventually become visible.
+    """
+
+    def __init__(self, ttl: float = 1.0, max_entries: int = 65536) -> None:
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self.entries: OrderedDict[str, float] = OrderedDict()
+        self.lock = Lock()
+        self.index: SubtreeIndex = SubtreeIndex()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def contains(self, path: str) -> bool:
+        """
+        Return True if path was recently found to exist in neither tier.
+        """
+        with self.lock:
+            expiry = self.entries.get(path)
+            if expiry is None:
+                self.misses += 1
+                return False
+            if expiry < time.monotonic():
+                del self.entries[path]
+                self.index.discard(path, self.entries)
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, path: str) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[path] = time.monotonic() + self.ttl
+            self.entries.move_to_end(path)
+            self.index.add(path)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.index.discard(evicted, self.entries)
+
+    def invalidate(self, path: str, recursive: bool = False) -> None:
+        with self.lock:
+            self.entries.pop(path, None)
+            if recursive:
+                for key in self.index.pop_subtree(path):
+                    self.entries.pop(key, None)
+            self.index.discard(path, self.entries)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.index.clear()
+
+    def stats(self) -> Dict[str, int | float]:
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+class AttributeCache:
+    """
+    Bounded cache of the attributes (getattr result) of FUSE paths, filled by getattr and directory listings.
+
+    Entries expire after ttl seconds, or the ttl of the first pattern of `patterns` matching the path, so that changes made behind the back
+    of the filesystem are eventually seen. A ttl of 0 disables the cache for the matching paths.
+    Entries must be invalidated by every operation that changes the attributes of a path or the content of a directory.
+    """
+
+    def __init__(self, ttl: float = 1.0, max_entries: int = 65536, patterns: Mapping[str, float] | None = None) -> None:
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self.policy: PatternPolicy[float] = PatternPolicy(patterns, ttl)
+        self.entries: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self.lock = Lock()
+        self.index: SubtreeIndex = SubtreeIndex()
+        # Incremented by every invalidation, see `set`
+        self.generation: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def enable(self) -> bool:
+        return self.max_entries > 0 and max(self.policy.values()) > 0
+
+    def get(self, path: str) -> Dict[str, Any] | None:
+        """
+        Return the attributes of path if they were cached less than their ttl ago.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[path]
+                self.index.discard(path, self.entries)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, path: str, attrs: Dict[str, Any], generation: int | None = None) -> None:
+        """
+        Cache the attributes of path. If generation (the value of `generation` read before the attributes) is given and an invalidation
+        happened since, the attributes may be stale and are not cached.
+        """
+        if not self.enable:
+            return
+        ttl = self.policy.lookup(path)
+        if ttl <= 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[path] = (time.monotonic() + ttl, attrs)
+            self.entries.move_to_end(path)
+            self.index.add(path)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.index.discard(evicted, self.entries)
+
+    def invalidate(self, path: str, recursive: bool = False) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(path, None)
+            if recursive:
+                for key in self.index.pop_subtree(path):
+                    self.entries.pop(key, None)
+            self.index.discard(path, self.entries)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.index.clear()
+
+    def stats(self) -> Dict[str, int | float]:
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+
+from passthrough_support_excludeglob_fs.cache_index import CacheTierIndex
+
+
+class TestCacheTierIndex(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def test_scan_at_mount(self):
+        os.makedirs(os.path.join(self.cache_dir, 'a', 'b'))
+        with open(os.path.join(self.cache_dir, 'a', 'b', 'file.txt'), 'w') as f:
+            f.write('test')
+        index = CacheTierIndex(self.cache_dir)
+        self.assertTrue(index.contains('/'))
+        self.assertTrue(index.contains('/a'))
+        self.assertTrue(index.contains('/a/b/file.txt'))
+        self.assertFalse(index.contains('/a/other'))
+        self.assertEqual(index.children_of('/a'), {'b'})
+        self.assertEqual(index.children_of('/a/b'), {'file.txt'})
+        self.assertIsNone(index.children_of('/a/b/file.txt'))
+        self.assertIsNone(index.children_of('/missing'))
+
+    def test_refresh_after_creation_registers_ancestors(self):
+        index = CacheTierIndex(self.cache_dir)
+        os.makedirs(os.path.join(self.cache_dir, 'x', 'y'))
+        with open(os.path.join(self.cache_dir, 'x', 'y', 'new.txt'), 'w') as f:
+            f.write('test')
+        #Not known until the filesystem refreshes the path it created
+        self.assertFalse(index.contains('/x/y/new.txt'))
+        index.refresh('/x/y/new.txt')
+        self.assertTrue(index.contains('/x'))
+        self.assertTrue(index.contains('/x/y/new.txt'))
+        self.assertEqual(index.children_of('/'), {'x'})
+
+    def test_refresh_after_removal_forgets_subtree(self):
+        os.makedirs(os.path.join(self.cache_dir, 'dir', 'sub'))
+        with open(os.path.join(self.cache_dir, 'dir', 'sub', 'file.txt'), 'w') as f:
+            f.write('test')
+        index = CacheTierIndex(self.cache_dir)
+        shutil.rmtree(os.path.join(self.cache_dir, 'dir'))
+        index.refresh('/dir')
+        self.assertFalse(index.contains('/dir'))
+        self.assertFalse(index.contains('/dir/sub/file.txt'))
+        self.assertEqual(index.children_of('/'), set())
+        self.assertEqual(index.stats()['entries'], 1)
+
+    def test_refresh_after_directory_move(self):
+        os.makedirs(os.path.join(self.cache_dir, 'old', 'sub'))
+        with open(os.path.join(self.cache_dir, 'old', 'sub', 'file.txt'), 'w') as f:
+            f.write('test')
+        index = CacheTierIndex(self.cache_dir)
+        os.rename(os.path.join(self.cache_dir, 'old'), os.path.join(self.cache_dir, 'new'))
+        index.refresh('/old')
+        index.refresh('/new')
+        self.assertFalse(index.contains('/old/sub/file.txt'))
+        self.assertTrue(index.contains('/new/sub/file.txt'))
+        self.assertEqual(index.children_of('/new/sub'), {'file.txt'})
+
+    def test_symlink_to_directory_is_a_leaf(self):
+        os.makedirs(os.path.join(self.cache_dir, 'target'))
+        with open(os.path.join(self.cache_dir, 'target', 'file.txt'), 'w') as f:
+            f.write('test')
+        if os.name == 'nt':
+            self.skipTest('Symlink creation requires privileges on Windows')
+        os.symlink(os.path.join(self.cache_dir, 'target'), os.path.join(self.cache_dir, 'link'))
+        index = CacheTierIndex(self.cache_dir)
+        self.assertTrue(index.contains('/link'))
+        self.assertFalse(index.contains('/link/file.txt'))
+
+    def test_disabled(self):
+        with open(os.path.join(self.cache_dir, 'file.txt'), 'w') as f:
+            f.write('test')
+        index = CacheTierIndex(self.cache_dir, enable=False)
+        index.refresh('/file.txt')
+        self.assertFalse(index.contains('/file.txt'))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+import threading
+import time
+import unittest
+from multiprocessing.managers import SyncManager
+
+from passthrough_support_excludeglob_fs.concurrency_controller import ConcurrencyControllerMixIn, LockContentionStats, PathLockTable, RWLock, SingleFlight
+
+
+class Recorder(ConcurrencyControllerMixIn):
+    def getattr(self, path, fh=None):
+        return path
+
+    def read(self, path, length, offset, fh):
+        return path
+
+    def rename(self, old, new):
+        time.sleep(0)
+        return 0
+
+    def mkdir(self, path, mode):
+        time.sleep(0)
+
+
+class TestPathLockTable(unittest.TestCase):
+    def test_mutual_exclusion_per_path(self):
+        table = PathLockTable()
+        inside = []
+        overlaps = []
+        def work(path):
+            for _ in range(200):
+                with table.locked(path):
+                    if path in inside:
+                        overlaps.append(path)
+                    inside.append(path)
+                    time.sleep(0)
+                    inside.remove(path)
+        threads = [threading.Thread(target=work, args=(path,)) for path in ['/a', '/a', '/b', '/b']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [])
+        #Idle entries are evicted
+        self.assertEqual(len(table), 0)
+
+    def test_other_paths_are_not_blocked(self):
+        table = PathLockTable()
+        with table.locked('/a'):
+            acquired = threading.Event()
+            def other():
+                with table.locked('/b'):
+                    acquired.set()
+            thread = threading.Thread(target=other)
+            thread.start()
+            self.assertTrue(acquired.wait(5))
+            thread.join()
+            self.assertEqual(len(table), 1)
+
+    def test_disabled(self):
+        controller = Recorder()
+        ConcurrencyControllerMixIn.__init__(controller, enable=False)
+        with controller.get_filelock_for_path('/a'):
+            #No lock is taken, the same path can be "locked" again
+            with controller.get_filelock_for_path('/a'):
+                self.assertEqual(controller('getattr', '/a'), '/a')
+        self.assertEqual(len(controller.path_locks), 0)
+
+
+class TestRWLock(unittest.TestCase):
+    def test_readers_share_the_lock(self):
+        lock = RWLock()
+        lock.acquire_shared()
+        acquired = threading.Event()
+        def reader():
+            lock.acquire_shared()
+            acquired.set()
+            lock.release_shared()
+        thread = threading.Thread(target=reader)
+        thread.start()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        lock.release_shared()
+
+    def test_writer_preference(self):
+        lock = RWLock()
+        lock.acquire_shared()
+        order = []
+        def writer():
+            lock.acquire_exclusive()
+            order.append('writer')
+            lock.release_exclusive()
+        def reader():
+            lock.acquire_shared()
+            order.append('reader')
+            lock.release_shared()
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+        while not lock.waiting_writers:
+            time.sleep(0.001)
+        #A reader arriving while a writer waits queues behind it
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        time.sleep(0.05)
+        self.assertEqual(order, [])
+        lock.release_shared()
+        writer_thread.join(5)
+        reader_thread.join(5)
+        self.assertEqual(order, ['writer', 'reader'])
+
+
+class TestHierarchicalLocking(unittest.TestCase):
+    def test_lock_requests(self):
+        self.assertEqual(ConcurrencyControllerMixIn.lock_requests('mkdir', '/a/b', 0o755), [('/a', False), ('/a/b', True)])
+        self.assertEqual(ConcurrencyControllerMixIn.lock_requests('rename', '/z/old', '/a/new'),
+                         [('/a', False), ('/z', False), ('/a/new', True), ('/z/old', True)])
+        #A directory renamed into its own parent is locked exclusively once
+        self.assertEqual(ConcurrencyControllerMixIn.lock_requests('rename', '/a/b', '/a'), [('/', False), ('/a', True), ('/a/b', True)])
+
+    def test_crossed_renames_do_not_deadlock(self):
+        controller = Recorder()
+        ConcurrencyControllerMixIn.__init__(controller)
+        def work(old, new):
+            for _ in range(300):
+                controller('rename', old, new)
+                controller('mkdir', new + '/child', 0o755)
+                controller('getattr', old)
+        threads = [threading.Thread(target=work, args=paths) for paths in [('/a/x', '/b/y'), ('/b/y', '/a/x'), ('/a', '/b/y'), ('/b/y', '/a')]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(len(controller.path_locks), 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, single_flight, key, function, count=8):
+        results = []
+        errors = []
+        def call():
+            try:
+                results.append(single_flight.do(key, function))
+            except OSError as error:
+                errors.append(error)
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_calls_share_one_execution(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        executions = []
+        def slow_getattr():
+            executions.append(1)
+            release.wait(5)
+            return {'st_size': 42}
+        threads, results, errors = self.run_concurrently(single_flight, ('getattr', '/hot'), slow_getattr)
+        while single_flight.stats()['executed'] + single_flight.stats()['coalesced'] < len(threads):
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(results, [{'st_size': 42}] * len(threads))
+        self.assertEqual(single_flight.stats(), {'executed': 1, 'coalesced': len(threads) - 1, 'in_flight': 0})
+        #Later calls execute again
+        self.assertEqual(single_flight.do(('getattr', '/hot'), lambda: 'fresh'), 'fresh')
+
+    def test_exception_is_shared(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        def failing():
+            release.wait(5)
+            raise FileNotFoundError('/missing')
+        threads, results, errors = self.run_concurrently(single_flight, ('getattr', '/missing'), failing, count=4)
+        while single_flight.stats()['executed'] + single_flight.stats()['coalesced'] < len(threads):
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 4)
+
+    def test_dispatch(self):
+        controller = Recorder()
+        ConcurrencyControllerMixIn.__init__(controller)
+        self.assertEqual(controller('getattr', '/a'), '/a')
+        self.assertEqual(controller.single_flight.stats()['executed'], 1)
+        #Not idempotent, never coalesced
+        controller('mkdir', '/a/b', 0o755)
+        self.assertEqual(controller.single_flight.stats()['executed'], 1)
+        ConcurrencyControllerMixIn.__init__(controller, enable=False)
+        self.assertIsNone(controller.single_flight)
+
+    def test_flight_retired_before_the_path_lock_is_released(self):
+        release = threading.Event()
+        in_flight_during_write = []
+        class Controller(Recorder):
+            size = 0
+            def getattr(self, path, fh=None):
+                size = self.size
+                release.wait(5)
+                return size
+            def write(self, path, data, offset, fh):
+                #A getattr arriving now must not join the flight that read the old size
+                in_flight_during_write.append(len(controller.single_flight.calls))
+                self.size += len(data)
+                return len(data)
+        controller = Controller()
+        ConcurrencyControllerMixIn.__init__(controller)
+        reader = threading.Thread(target=controller, args=('getattr', '/a'))
+        reader.start()
+        while not controller.single_flight.stats()['in_flight']:
+            time.sleep(0.001)
+        writer = threading.Thread(target=controller, args=('write', '/a', b'new', 0, None))
+        writer.start()
+        while not controller.path_locks.entries['/a'].lock.waiting_writers:
+            time.sleep(0.001)
+        #Delays the end of the flight: the write must still wait for it
+        with controller.single_flight.lock:
+            release.set()
+            writer.join(0.2)
+        reader.join()
+        writer.join()
+        self.assertEqual(in_flight_during_write, [0])
+        self.assertEqual(controller('getattr', '/a'), 3)
+
+
+class TestLockContentionStats(unittest.TestCase):
+    def test_record(self):
+        stats = LockContentionStats()
+        stats.record('write', [], 0.0, 0.5)
+        stats.record('write', ['/hot'], 2.0, 0.25)
+        stats.record('getattr', ['/hot', '/'], 1.0, 0.0)
+        result = stats.stats()
+        self.assertEqual(result['operations']['write'], {'count': 2, 'contended': 1, 'wait_total': 2.0, 'wait_max': 2.0, 'hold_total': 0.75, 'hold_max': 0.5})
+        self.assertEqual(result['operations']['getattr']['contended'], 1)
+        self.assertEqual(result['hottest_paths'], [{'path': '/hot', 'wait_total': 3.0, 'contended': 2}, {'path': '/', 'wait_total': 1.0, 'contended': 1}])
+
+    def test_bounded_path_table(self):
+        stats = LockContentionStats(max_paths=4)
+        for index in range(100):
+            stats.record('write', [f'/cold{index}'], 0.001, 0.0)
+            stats.record('write', ['/hot'], 1.0, 0.0)
+        self.assertEqual(len(stats.paths), 4)
+        result = stats.stats(top=1)
+        self.assertEqual(result['hottest_paths'][0]['path'], '/hot')
+        self.assertEqual(result['hottest_paths'][0]['contended'], 100)
+
+    def test_instrumented_dispatch(self):
+        controller = Recorder()
+        ConcurrencyControllerMixIn.__init__(controller)
+        self.assertIsNone(controller.lock_stats)
+        ConcurrencyControllerMixIn.__init__(controller, lock_stats=True)
+        self.assertEqual(controller('getattr', '/a'), '/a')
+        controller('mkdir', '/a/b', 0o755)
+        #read takes no lock
+        controller('read', '/a', 1, 0, 0)
+        result = controller.lock_stats.stats()
+        self.assertEqual(sorted(result['operations']), ['getattr', 'mkdir'])
+        self.assertEqual(result['hottest_paths'], [])
+        #A writer holding the path makes the others wait
+        controller.path_locks.acquire('/a/b')
+        threads = [threading.Thread(target=controller, args=('mkdir', '/a/b', 0o755)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        controller.path_locks.release('/a/b')
+        for thread in threads:
+            thread.join()
+        result = controller.lock_stats.stats()
+        self.assertEqual(result['operations']['mkdir']['contended'], 2)
+        self.assertEqual(result['hottest_paths'][0]['path'], '/a/b')
+        self.assertGreater(result['hottest_paths'][0]['wait_total'], 0.05)
+        self.assertEqual(len(controller.path_locks), 0)
+
+
+class TestLockingOverhead(unittest.TestCase):
+    """Per-operation cost of the path lock, with the previous SyncManager based implementation as reference."""
+    operations = 2000
+
+    def measure(self, call):
+        start = time.perf_counter()
+        for i in range(self.operations):
+            call('getattr', f'/dir/file{i % 100}')
+        return (time.perf_counter() - start) / self.operations
+
+    def test_overhead(self):
+        manager = SyncManager()
+        manager.start()
+        try:
+            dict_of_locks = manager.dict()
+            def sync_manager_call(op, path):
+                if path in dict_of_locks:
+                    lock = dict_of_locks[path]
+                else:
+                    lock = manager.Lock()
+                    dict_of_locks[path] = lock
+                with lock:
+                    return path
+            sync_manager = self.measure(sync_manager_call)
+        finally:
+            manager.shutdown()
+
+        controller = Recorder()
+        ConcurrencyControllerMixIn.__init__(controller)
+        in_process = self.measure(controller)
+        ConcurrencyControllerMixIn.__init__(controller, enable=False)
+        disabled = self.measure(controller)
+        print(f"Path lock overhead per operation: SyncManager {sync_manager * 1e6:.1f} us, in-process table {in_process * 1e6:.2f} us, disabled (nothreads) {disabled * 1e6:.2f} us")
+        self.assertLess(in_process, sync_manager)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import unittest
+
+from passthrough_support_excludeglob_fs.directory_handles import DirectoryHandle, DirectoryHandleTable
+
+
+class CountingFactory:
+    def __init__(self, names):
+        self.names = names
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return ((name, None) for name in self.names)
+
+
+def read_page(handle, offset, size):
+    """Take entries the way the readdir filler does: the entry that does not fit is dropped."""
+    page = []
+    for entry in handle.entries_from(offset):
+        if len(page) == size:
+            break
+        page.append(entry)
+    return page
+
+
+class TestDirectoryHandle(unittest.TestCase):
+    def test_sequential_pages_do_not_restart(self):
+        factory = CountingFactory([f'f{i}' for i in range(10)])
+        handle = DirectoryHandle('/d', factory)
+        names = []
+        offset = 0
+        while True:
+            page = read_page(handle, offset, 3)
+            if not page:
+                break
+            names.extend(name for name, _, _ in page)
+            offset = page[-1][2]
+        self.assertEqual(names, [f'f{i}' for i in range(10)])
+        self.assertEqual(factory.calls, 1)
+
+    def test_seek(self):
+        factory = CountingFactory(['a', 'b', 'c', 'd'])
+        handle = DirectoryHandle('/d', factory)
+        self.assertEqual(read_page(handle, 0, 4), [('a', None, 1), ('b', None, 2), ('c', None, 3), ('d', None, 4)])
+        self.assertEqual(read_page(handle, 2, 4), [('c', None, 3), ('d', None, 4)])
+        #rewinddir
+        self.assertEqual(read_page(handle, 0, 1), [('a', None, 1)])
+        self.assertEqual(factory.calls, 3)
+        #Past the end
+        self.assertEqual(read_page(handle, 10, 1), [])
+
+    def test_attributes(self):
+        handle = DirectoryHandle('/d', lambda: iter([('a', {'st_size': 1}), ('b', None)]))
+        self.assertEqual(read_page(handle, 0, 2), [('a', {'st_size': 1}, 1), ('b', None, 2)])
+
+    def test_close(self):
+        closed = []
+        def factory():
+            try:
+                yield 'a', None
+                yield 'b', None
+            finally:
+                closed.append(True)
+        handle = DirectoryHandle('/d', factory)
+        read_page(handle, 0, 1)
+        handle.close()
+        self.assertEqual(closed, [True])
+
+
+class TestDirectoryHandleTable(unittest.TestCase):
+    def test_add_get_remove(self):
+        table = DirectoryHandleTable()
+        fh = table.add('/d', lambda: iter([('a', None)]))
+        self.assertNotEqual(fh, 0)
+        self.assertEqual(table.get(fh).path, '/d')
+        self.assertNotEqual(table.add('/d', lambda: iter([('a', None)])), fh)
+        self.assertEqual(table.stats(), {'open': 2, 'opened': 2})
+        table.remove(fh)
+        self.assertIsNone(table.get(fh))
+        table.remove(fh)
+        table.close_all()
+        self.assertEqual(table.stats(), {'open': 0, 'opened': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
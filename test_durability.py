@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import time
+import unittest
+
+from passthrough_support_excludeglob_fs.durability import DurabilityManager
+from passthrough_support_excludeglob_fs.file_handles import FileHandleTable
+from passthrough_support_excludeglob_fs.main import parse_pattern_map
+
+
+class TestDurabilityManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.table = FileHandleTable()
+        self.fds = []
+
+    def tearDown(self):
+        for fd in self.fds:
+            os.close(fd)
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def open(self, manager, path, dirty=False):
+        right_path = os.path.join(self.directory, path.lstrip('/'))
+        fd = os.open(right_path, os.O_RDWR | os.O_CREAT)
+        self.fds.append(fd)
+        return self.table.add(fd, path, right_path, 'full', os.O_RDWR, manager.mode_of(path), dirty)
+
+    def test_clean_handles_are_not_fsynced(self):
+        manager = DurabilityManager('close')
+        handle = self.open(manager, '/read.bin')
+        manager.on_close(handle, handle.fd)
+        manager.on_close(handle, handle.fd)
+        self.assertEqual(manager.stats()['fsyncs'], 0)
+        self.assertEqual(manager.stats()['skipped_clean'], 2)
+
+    def test_close(self):
+        manager = DurabilityManager('close')
+        handle = self.open(manager, '/written.bin', dirty=True)
+        manager.on_close(handle, handle.fd)
+        #The release after the flush has nothing left to sync
+        manager.on_close(handle, handle.fd)
+        stats = manager.stats()
+        self.assertEqual(stats['fsyncs'], 1)
+        self.assertGreater(stats['fsync_seconds_total'], 0)
+        self.assertGreaterEqual(stats['fsync_seconds_total'], stats['fsync_seconds_max'])
+
+    def test_unknown_handle_is_fsynced(self):
+        manager = DurabilityManager('none')
+        fd = os.open(os.path.join(self.directory, 'unknown'), os.O_RDWR | os.O_CREAT)
+        self.fds.append(fd)
+        manager.on_close(None, fd)
+        self.assertEqual(manager.stats()['fsyncs'], 1)
+
+    def test_per_pattern_modes(self):
+        manager = DurabilityManager('close', {'**/*.o': 'none', '**/*.log': 'on-fsync-only'})
+        self.assertEqual(manager.mode_of('/build/main.o'), 'none')
+        self.assertEqual(manager.mode_of('/run.log'), 'on-fsync-only')
+        self.assertEqual(manager.mode_of('/main.c'), 'close')
+        object_file = self.open(manager, '/main.o', dirty=True)
+        log_file = self.open(manager, '/run.log', dirty=True)
+        manager.on_close(object_file, object_file.fd)
+        manager.on_close(log_file, log_file.fd)
+        self.assertEqual(manager.stats()['fsyncs'], 0)
+        self.assertEqual(manager.stats()['skipped_policy'], 2)
+        #Explicit fsync calls are honoured except with 'none'
+        manager.on_fsync(object_file, object_file.fd)
+        manager.on_fsync(log_file, log_file.fd, datasync=True)
+        self.assertEqual(manager.stats()['fsyncs'], 1)
+        self.assertFalse(log_file.dirty)
+
+    def test_periodic(self):
+        manager = DurabilityManager('periodic', interval=3600)
+        try:
+            handle = self.open(manager, '/periodic.bin', dirty=True)
+            manager.on_close(handle, handle.fd)
+            self.assertEqual(manager.stats()['fsyncs'], 0)
+            self.assertEqual(manager.stats()['pending'], 1)
+        finally:
+            #Pending files are committed at shutdown
+            manager.shutdown()
+        self.assertEqual(manager.stats()['fsyncs'], 1)
+        self.assertEqual(manager.stats()['pending'], 0)
+
+    def test_periodic_thread_is_started_by_start(self):
+        manager = DurabilityManager('periodic', interval=0.05)
+        try:
+            #Not started before the mount forks into the background
+            self.assertIsNone(manager.thread)
+            manager.start()
+            handle = self.open(manager, '/periodic.bin', dirty=True)
+            manager.on_close(handle, handle.fd)
+            for _ in range(100):
+                if manager.stats()['fsyncs']:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(manager.stats()['fsyncs'], 1)
+        finally:
+            manager.shutdown()
+        self.assertFalse(manager.thread.is_alive())
+
+    def test_periodic_commit_follows_renamed_files(self):
+        manager = DurabilityManager('close', {'**/*.tmp': 'periodic'}, interval=3600)
+        try:
+            #Written to a temporary file, closed and renamed over the final one
+            handle = self.open(manager, '/atomic.tmp', dirty=True)
+            manager.on_close(handle, handle.fd)
+            self.table.remove(handle.fd)
+            self.fds.remove(handle.fd)
+            os.close(handle.fd)
+            os.replace(handle.right_path, os.path.join(self.directory, 'atomic'))
+            #Closing the same file again does not duplicate its descriptor twice
+            other = self.open(manager, '/other.tmp', dirty=True)
+            manager.on_close(other, other.fd)
+            other.dirty = True
+            manager.on_close(other, other.fd)
+            self.assertEqual(manager.stats()['pending'], 2)
+        finally:
+            manager.shutdown()
+        self.assertEqual(manager.stats()['fsyncs'], 2)
+        self.assertEqual(manager.stats()['pending'], 0)
+
+class TestParsePatternMap(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_pattern_map('**/*.o=none:**/logs/**=periodic'), {'**/*.o': 'none', '**/logs/**': 'periodic'})
+        #The value is after the last '=', patterns may contain '=' and escaped ':'
+        self.assertEqual(parse_pattern_map('**/,test=file.txt=close:**/a\\:b=1.5'), {'**/,test=file.txt': 'close', '**/a:b': 1.5})
+        with self.assertRaises(ValueError):
+            parse_pattern_map('**/*.o')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from passthrough_support_excludeglob_fs import file_handles
+from passthrough_support_excludeglob_fs.file_handles import FileHandleTable, pread, pwrite
+
+
+class TestFileHandleTable(unittest.TestCase):
+    def test_add_get_remove(self):
+        table = FileHandleTable()
+        handle = table.add(42, '/a.txt', '/cache/a.txt', 'cache', os.O_RDWR)
+        self.assertIs(table.get(42), handle)
+        self.assertEqual((handle.fd, handle.path, handle.right_path, handle.tier, handle.flags), (42, '/a.txt', '/cache/a.txt', 'cache', os.O_RDWR))
+        self.assertEqual(table.stats(), {'open': 1, 'opened': 1})
+        self.assertIs(table.remove(42), handle)
+        self.assertIsNone(table.get(42))
+        self.assertIsNone(table.remove(42))
+        self.assertEqual(table.stats(), {'open': 0, 'opened': 1})
+
+    def test_reused_file_descriptor(self):
+        table = FileHandleTable()
+        table.add(3, '/old', '/root/old', 'full', os.O_RDONLY)
+        table.add(3, '/new', '/root/new', 'full', os.O_WRONLY)
+        self.assertEqual(table.get(3).path, '/new')
+        self.assertEqual(table.stats()['open'], 1)
+
+    def test_open_policy_stats(self):
+        table = FileHandleTable()
+        table.add(3, '/a.mkv', '/root/a.mkv', 'full', os.O_RDONLY, open_policy='direct_io')
+        table.add(4, '/b.mkv', '/root/b.mkv', 'full', os.O_RDONLY, open_policy='direct_io')
+        table.add(5, '/c.tmp', '/root/c.tmp', 'full', os.O_RDWR, open_policy='noflush')
+        table.add(6, '/d', '/root/d', 'full', os.O_RDONLY)
+        self.assertEqual(table.get(5).open_policy, 'noflush')
+        self.assertEqual(table.stats(), {'open': 4, 'opened': 4, 'opened_direct_io': 2, 'opened_noflush': 1})
+
+    def test_is_open(self):
+        table = FileHandleTable()
+        table.add(3, '/dir/a', '/root/dir/a', 'full', os.O_RDONLY)
+        table.add(4, '/dir/a', '/root/dir/a', 'full', os.O_RDONLY)
+        self.assertTrue(table.is_open('/root/dir/a'))
+        self.assertFalse(table.is_open('/root/dir'))
+        self.assertTrue(table.is_open('/root/dir', recursive=True))
+        self.assertFalse(table.is_open('/root/di', recursive=True))
+        table.remove(3)
+        self.assertTrue(table.is_open('/root/dir/a'))
+        #A reused descriptor replaces the handle of the old file
+        table.add(4, '/b', '/root/b', 'full', os.O_RDONLY)
+        self.assertFalse(table.is_open('/root/dir/a'))
+        self.assertTrue(table.is_open('/root/b'))
+
+    def test_compact(self):
+        handle = FileHandleTable().add(3, '/a', '/root/a', 'full', os.O_RDONLY)
+        self.assertFalse(hasattr(handle, '__dict__'))
+
+class TestPositionalIO(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        os.close(fd)
+        self.fd = os.open(self.file_path, os.O_RDWR)
+        self.handle = FileHandleTable().add(self.fd, '/file', self.file_path, 'full', os.O_RDWR)
+
+    def tearDown(self):
+        os.close(self.fd)
+        os.remove(self.file_path)
+
+    def test_concurrent_reads_and_writes_on_one_descriptor(self):
+        block = 4096
+        def write_block(index):
+            return pwrite(self.handle, self.fd, bytes([index]) * block, index * block)
+        def read_block(index):
+            return pread(self.handle, self.fd, block, index * block)
+        with ThreadPoolExecutor(8) as executor:
+            self.assertEqual(list(executor.map(write_block, range(64))), [block] * 64)
+            for index, data in enumerate(executor.map(read_block, range(64))):
+                self.assertEqual(data, bytes([index]) * block)
+        #The file offset is never moved
+        self.assertEqual(os.lseek(self.fd, 0, os.SEEK_CUR), 0)
+
+    def test_emulated_positional_io(self):
+        positional_io = file_handles.POSITIONAL_IO
+        file_handles.POSITIONAL_IO = False
+        try:
+            handle = FileHandleTable().add(self.fd, '/file', self.file_path, 'full', os.O_RDWR)
+            self.assertIsNotNone(handle.lock)
+            self.assertEqual(pwrite(handle, self.fd, b'hello', 3), 5)
+            self.assertEqual(pread(handle, self.fd, 8, 0), b'\0\0\0hello')
+            self.assertEqual(pread(None, self.fd, 2, 4), b'el')
+        finally:
+            file_handles.POSITIONAL_IO = positional_io
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,7 @@ import unittest
 
 import psutil
 from passthrough_support_excludeglob_fs import start_passthrough_fs
+from passthrough_support_excludeglob_fs.fuse_options import supports_writeback_cache
 import multiprocessing
 import time
 import random
@@ -220,6 +221,19 @@ class TestFSOperationsWithExclusion(unittest.TestCase):
         file_path2 = os.path.join(self.temp_dir, 'testfile')
         self.assertTrue(os.path.exists(file_path2))
 
+    def test_directory_in_both_tiers_follows_its_most_recent_side(self):
+        dir_path = os.path.join(self.mounted_dir, 'both')
+        os.mkdir(dir_path)
+        #The excluded child creates the directory in the cache directory too, the other one is in the root directory
+        for name in ['first.txt', 'second.bin']:
+            time.sleep(1.5)
+            with open(os.path.join(dir_path, name), 'w') as f:
+                f.write('test data')
+            #Past the attribute timeout of the kernel
+            time.sleep(1.5)
+            newest = max(os.stat(os.path.join(self.temp_dir, 'both')).st_mtime, os.stat(os.path.join(self.cache_dir, 'both')).st_mtime)
+            self.assertEqual(int(os.stat(dir_path).st_mtime), int(newest))
+
     def test_write_file_totemp(self):
         file_path1 = os.path.join(self.temp_dir, 'testfile.txt')
         with open(file_path1, 'w') as f:
@@ -732,6 +746,20 @@ class TestFSOperationsWithExclusion(unittest.TestCase):
         os.remove(file_path)
         self.assertFalse(os.path.exists(file_path))
 
+    def test_read_and_write_unlinked_open_file(self):
+        file_path = os.path.join(self.mounted_dir, 'unlinked.txt')
+        with open(file_path, 'w+') as f:
+            f.write('test data')
+            f.flush()
+            os.remove(file_path)
+            self.assertFalse(os.path.exists(file_path))
+            f.seek(0)
+            self.assertEqual(f.read(), 'test data')
+            f.write(' and more')
+            f.flush()
+            f.seek(0)
+            self.assertEqual(f.read(), 'test data and more')
+
     def test_delete_directory(self):
         dir_path = os.path.join(self.mounted_dir, 'testdir')
         os.makedirs(dir_path)
@@ -798,6 +826,54 @@ class TestFSOperationsWithExclusion(unittest.TestCase):
         self.assertIn('file1.txt', listing)
         self.assertIn('file2.txt', listing)
 
+    def test_large_directory_listing(self):
+        #Larger than one readdir buffer, listed in several pages, with entries in both tiers
+        dir_path = os.path.join(self.mounted_dir, 'largedir')
+        os.makedirs(dir_path)
+        expected = set()
+        for i in range(3000):
+            name = f'file{i}.txt' if i % 3 == 0 else f'file{i}'
+            open(os.path.join(dir_path, name), 'w').close()
+            expected.add(name)
+        listing = os.listdir(dir_path)
+        self.assertEqual(len(listing), len(expected))
+        self.assertEqual(set(listing), expected)
+        with os.scandir(dir_path) as entries:
+            self.assertEqual({entry.name for entry in entries}, expected)
+
+    def test_repeated_listing_sees_changes(self):
+        dir_path = os.path.join(self.mounted_dir, 'relisteddir')
+        os.makedirs(dir_path)
+        open(os.path.join(dir_path, 'file1'), 'w').close()
+        #Old enough to be cached
+        time.sleep(1.5)
+        self.assertEqual(os.listdir(dir_path), ['file1'])
+        self.assertEqual(os.listdir(dir_path), ['file1'])
+        #Through the filesystem
+        open(os.path.join(dir_path, 'file2.txt'), 'w').close()
+        os.remove(os.path.join(dir_path, 'file1'))
+        self.assertEqual(os.listdir(dir_path), ['file2.txt'])
+        #Behind its back
+        open(os.path.join(self.temp_dir, 'relisteddir', 'file3'), 'w').close()
+        self.assertEqual(sorted(os.listdir(dir_path)), ['file2.txt', 'file3'])
+
+    def test_stat_after_listing(self):
+        #The attributes read by the listing are not served once the file is modified
+        dir_path = os.path.join(self.mounted_dir, 'listeddir')
+        os.makedirs(dir_path)
+        for name in ['file.txt', 'file']:
+            with open(os.path.join(dir_path, name), 'w') as f:
+                f.write('test data')
+        sizes = {entry.name: entry.stat().st_size for entry in os.scandir(dir_path)}
+        self.assertEqual(sizes, {'file.txt': 9, 'file': 9})
+        for name in ['file.txt', 'file']:
+            with open(os.path.join(dir_path, name), 'a') as f:
+                f.write(' appended')
+            os.chmod(os.path.join(dir_path, name), 0o600)
+            st = os.stat(os.path.join(dir_path, name))
+            self.assertEqual(st.st_size, 18)
+            self.assertEqual(st.st_mode & 0o777, 0o600)
+
     def test_file_descriptor_leaks(self):
         if os.name == 'nt':
             self.skipTest('File descriptor count are not avaible on Windows')
@@ -2568,5 +2644,488 @@ class TestStartPassthroughFS_overwrite_rename_dest_false(unittest.TestCase):
         shutil.rmtree(self.cache_dir, ignore_errors=True)
         shutil.rmtree(self.mounted_dir, ignore_errors=True)
 
+class TestStartPassthroughFS_negative_cache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dir = determine_mountdir_based_on_os()
+        print(f'Temporary directory: {self.temp_dir} and mounted directory: {self.mounted_dir}')
+        # Create a new process to launch the function start_passthrough_fs
+        self.p = multiprocessing.Process(target=start_passthrough_fs,
+                                          kwargs={'mountpoint': self.mounted_dir,
+                                                  'root': self.temp_dir,
+                                                  'patterns': ['**/*.txt'],
+                                                  'cache_dir': self.cache_dir,
+                                                  'negative_cache_ttl': 1.0})
+        self.p.start()
+        time.sleep(5)
+
+    def test_create_after_failed_lookup(self):
+        file_path = os.path.join(self.mounted_dir, 'later.txt')
+        self.assertFalse(os.path.exists(file_path))
+        #Creating the file through the mountpoint must invalidate the negative entry immediately
+        with open(file_path, 'w') as f:
+            f.write('created')
+        self.assertTrue(os.path.exists(file_path))
+        with open(file_path, 'r') as f:
+            self.assertEqual(f.read(), 'created')
+
+    def test_mkdir_and_rename_after_failed_lookup(self):
+        dir_path = os.path.join(self.mounted_dir, 'later_dir')
+        renamed_path = os.path.join(self.mounted_dir, 'renamed.bin')
+        self.assertFalse(os.path.exists(dir_path))
+        self.assertFalse(os.path.exists(renamed_path))
+        os.mkdir(dir_path)
+        self.assertTrue(os.path.isdir(dir_path))
+        with open(os.path.join(dir_path, 'file.bin'), 'w') as f:
+            f.write('data')
+        os.rename(os.path.join(dir_path, 'file.bin'), renamed_path)
+        self.assertTrue(os.path.exists(renamed_path))
+
+    def test_file_created_behind_the_back_becomes_visible(self):
+        file_path = os.path.join(self.mounted_dir, 'external.bin')
+        self.assertFalse(os.path.exists(file_path))
+        with open(os.path.join(self.temp_dir, 'external.bin'), 'w') as f:
+            f.write('external')
+        #Wait for the negative entry to expire
+        time.sleep(1.5)
+        self.assertTrue(os.path.exists(file_path))
+
+    def tearDown(self):
+        self.p.kill()
+        #unmount fs
+        if os.name != 'nt':
+            os.system(f'fusermount -u {self.mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.mounted_dir, ignore_errors=True)
+
+class TestStartPassthroughFS_destructive_operations_on_misplaced_files(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dir = determine_mountdir_based_on_os()
+        #Files matching the pattern but stored in the root directory, as after a pattern change
+        for name in ('unlink.txt', 'truncate.txt', 'otrunc.txt', 'source.txt', 'destination.txt'):
+            with open(os.path.join(self.temp_dir, name), 'w') as f:
+                f.write('misplaced content')
+        print(f'Temporary directory: {self.temp_dir} and mounted directory: {self.mounted_dir}')
+        # Create a new process to launch the function start_passthrough_fs
+        self.p = multiprocessing.Process(target=start_passthrough_fs,
+                                          kwargs={'mountpoint': self.mounted_dir,
+                                                  'root': self.temp_dir,
+                                                  'patterns': ['**/*.txt'],
+                                                  'cache_dir': self.cache_dir})
+        self.p.start()
+        time.sleep(5)
+
+    def test_unlink(self):
+        os.unlink(os.path.join(self.mounted_dir, 'unlink.txt'))
+        self.assertFalse(os.path.exists(os.path.join(self.mounted_dir, 'unlink.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'unlink.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'unlink.txt')))
+
+    def test_truncate_and_open_with_o_trunc(self):
+        os.truncate(os.path.join(self.mounted_dir, 'truncate.txt'), 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.mounted_dir, 'truncate.txt')), 0)
+        with open(os.path.join(self.mounted_dir, 'otrunc.txt'), 'w') as f:
+            f.write('new')
+        with open(os.path.join(self.mounted_dir, 'otrunc.txt'), 'r') as f:
+            self.assertEqual(f.read(), 'new')
+
+    def test_rename_over_misplaced_destination(self):
+        os.rename(os.path.join(self.mounted_dir, 'source.txt'), os.path.join(self.mounted_dir, 'destination.txt'))
+        self.assertFalse(os.path.exists(os.path.join(self.mounted_dir, 'source.txt')))
+        with open(os.path.join(self.mounted_dir, 'destination.txt'), 'r') as f:
+            self.assertEqual(f.read(), 'misplaced content')
+        #The destination is written in the tier it belongs to and the misplaced copy is gone
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'destination.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'destination.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'source.txt')))
+
+    def tearDown(self):
+        self.p.kill()
+        #unmount fs
+        if os.name != 'nt':
+            os.system(f'fusermount -u {self.mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.mounted_dir, ignore_errors=True)
+
+@unittest.skipIf(os.name == 'nt' or supports_writeback_cache(), 'libfuse supports writeback_cache')
+class TestStartPassthroughFS_writeback_cache_unsupported(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dir = determine_mountdir_based_on_os()
+
+    def test_rejected_up_front(self):
+        with self.assertRaises(ValueError):
+            start_passthrough_fs(self.mounted_dir, self.temp_dir, cache_dir=self.cache_dir, writeback_cache=True)
+        self.assertFalse(os.path.ismount(self.mounted_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.mounted_dir, ignore_errors=True)
+
+@unittest.skipUnless(os.name != 'nt' and supports_writeback_cache(), 'writeback_cache requires libfuse 3')
+class TestStartPassthroughFS_writeback_cache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dirs = {}
+        self.processes = []
+        #A mount without writeback_cache as reference for the benchmark
+        for writeback_cache in (True, False):
+            mounted_dir = determine_mountdir_based_on_os()
+            p = multiprocessing.Process(target=start_passthrough_fs,
+                                        kwargs={'mountpoint': mounted_dir,
+                                                'root': self.temp_dir,
+                                                'patterns': ['**/*.txt'],
+                                                'cache_dir': self.cache_dir,
+                                                'cache_index': False,
+                                                'writeback_cache': writeback_cache})
+            p.start()
+            self.processes.append(p)
+            self.mounted_dirs[writeback_cache] = mounted_dir
+        time.sleep(5)
+        if not os.path.ismount(self.mounted_dirs[True]):
+            #tearDown is not called when setUp fails
+            self.tearDown()
+            self.fail('Mounting with writeback_cache failed although libfuse supports it')
+        self.mounted_dir = self.mounted_dirs[True]
+
+    def test_append(self):
+        file_path = os.path.join(self.mounted_dir, 'append.log')
+        with open(file_path, 'w') as f:
+            f.write('first\n')
+        for line in ['second\n', 'third\n']:
+            with open(file_path, 'a') as f:
+                f.write(line)
+        with open(file_path, 'r') as f:
+            self.assertEqual(f.read(), 'first\nsecond\nthird\n')
+        self.assertEqual(os.path.getsize(os.path.join(self.temp_dir, 'append.log')), 19)
+
+    def test_partial_writes_to_write_only_file(self):
+        file_path = os.path.join(self.mounted_dir, 'object.txt')
+        with open(file_path, 'wb') as f:
+            f.write(b'a' * 10000)
+        #Overwrite a part of a page through a write-only descriptor, the kernel reads the rest of the page
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, b'b' * 100, 5000)
+        finally:
+            os.close(fd)
+        with open(os.path.join(self.cache_dir, 'object.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 5000 + b'b' * 100 + b'a' * 4900)
+
+    def test_size_and_mtime_after_small_writes(self):
+        file_path = os.path.join(self.mounted_dir, 'small_writes')
+        with open(file_path, 'wb') as f:
+            for _ in range(256):
+                f.write(b'x' * 100)
+                f.flush()
+            mtime = os.stat(file_path).st_mtime
+        st = os.stat(file_path)
+        self.assertEqual(st.st_size, 25600)
+        self.assertGreaterEqual(st.st_mtime, mtime)
+        self.assertEqual(st.st_size, os.path.getsize(os.path.join(self.temp_dir, 'small_writes')))
+        #Also through the mount without writeback_cache
+        self.assertEqual(os.stat(os.path.join(self.mounted_dirs[False], 'small_writes')).st_size, 25600)
+
+    def test_small_write_throughput(self):
+        chunks = 4096
+        throughputs = {}
+        for writeback_cache, mounted_dir in self.mounted_dirs.items():
+            file_path = os.path.join(mounted_dir, f'benchmark_{writeback_cache}')
+            start = time.perf_counter()
+            with open(file_path, 'wb', buffering=0) as f:
+                for _ in range(chunks):
+                    f.write(b'x' * 4096)
+            throughputs[writeback_cache] = chunks * 4096 / (time.perf_counter() - start) / 2**20
+            self.assertEqual(os.path.getsize(file_path), chunks * 4096)
+        print(f"4 KiB writes: {throughputs[True]:.1f} MiB/s with writeback_cache, {throughputs[False]:.1f} MiB/s without")
+
+    def tearDown(self):
+        for p in self.processes:
+            p.kill()
+        #unmount fs
+        for mounted_dir in self.mounted_dirs.values():
+            os.system(f'fusermount -u {mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        for mounted_dir in self.mounted_dirs.values():
+            shutil.rmtree(mounted_dir, ignore_errors=True)
+
+@unittest.skipIf(os.name == 'nt', 'default_permissions is not supported on Windows')
+class TestStartPassthroughFS_default_permissions(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dir = determine_mountdir_based_on_os()
+        self.p = multiprocessing.Process(target=start_passthrough_fs,
+                                          kwargs={'mountpoint': self.mounted_dir,
+                                                  'root': self.temp_dir,
+                                                  'patterns': ['**/*.txt'],
+                                                  'cache_dir': self.cache_dir,
+                                                  'default_permissions': True})
+        self.p.start()
+        time.sleep(5)
+
+    def test_read_write_and_mkdir(self):
+        os.mkdir(os.path.join(self.mounted_dir, 'dir'))
+        for name in ['dir/file.txt', 'dir/file.bin']:
+            with open(os.path.join(self.mounted_dir, name), 'w') as f:
+                f.write('content')
+            with open(os.path.join(self.mounted_dir, name), 'r') as f:
+                self.assertEqual(f.read(), 'content')
+        self.assertTrue(os.access(os.path.join(self.mounted_dir, 'dir/file.txt'), os.R_OK | os.W_OK))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'dir/file.txt')))
+
+    @unittest.skipIf(os.name != 'nt' and os.geteuid() == 0, 'root bypasses the permission checks')
+    def test_kernel_enforces_mode(self):
+        file_path = os.path.join(self.mounted_dir, 'private.bin')
+        with open(file_path, 'w') as f:
+            f.write('secret')
+        os.chmod(file_path, 0o200)
+        self.assertFalse(os.access(file_path, os.R_OK))
+        self.assertTrue(os.access(file_path, os.W_OK))
+        with self.assertRaises(PermissionError):
+            open(file_path, 'r')
+        os.chmod(file_path, 0o600)
+        with open(file_path, 'r') as f:
+            self.assertEqual(f.read(), 'secret')
+
+    def tearDown(self):
+        self.p.kill()
+        #unmount fs
+        os.system(f'fusermount -u {self.mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.mounted_dir, ignore_errors=True)
+
+class TestStartPassthroughFS_open_policy(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dir = determine_mountdir_based_on_os()
+        self.p = multiprocessing.Process(target=start_passthrough_fs,
+                                          kwargs={'mountpoint': self.mounted_dir,
+                                                  'root': self.temp_dir,
+                                                  'patterns': ['**/*.txt'],
+                                                  'cache_dir': self.cache_dir,
+                                                  'open_policy_patterns': {'**/*.mkv': 'direct_io', '**/build/**': 'keep_cache', '**/*.tmp': 'noflush'}})
+        self.p.start()
+        time.sleep(5)
+
+    def test_read_write_with_each_policy(self):
+        os.mkdir(os.path.join(self.mounted_dir, 'build'))
+        for name in ['movie.mkv', 'build/main.o', 'scratch.tmp', 'notes.txt']:
+            file_path = os.path.join(self.mounted_dir, name)
+            with open(file_path, 'wb') as f:
+                f.write(b'x' * 100000)
+            with open(file_path, 'ab') as f:
+                f.write(b'y')
+            with open(file_path, 'rb') as f:
+                self.assertEqual(f.read(), b'x' * 100000 + b'y')
+            self.assertEqual(os.path.getsize(file_path), 100001)
+
+    @unittest.skipIf(os.name == 'nt', 'os.pread is not available on Windows')
+    def test_direct_io_sees_changes_behind_the_back(self):
+        file_path = os.path.join(self.mounted_dir, 'movie.mkv')
+        with open(os.path.join(self.temp_dir, 'movie.mkv'), 'wb') as f:
+            f.write(b'a' * 4096)
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            self.assertEqual(os.pread(fd, 4096, 0), b'a' * 4096)
+            #Same size, the page cache would still serve the old content
+            with open(os.path.join(self.temp_dir, 'movie.mkv'), 'r+b') as f:
+                f.write(b'b' * 4096)
+            self.assertEqual(os.pread(fd, 4096, 0), b'b' * 4096)
+        finally:
+            os.close(fd)
+
+    def tearDown(self):
+        self.p.kill()
+        #unmount fs
+        if os.name != 'nt':
+            os.system(f'fusermount -u {self.mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.mounted_dir, ignore_errors=True)
+
+@unittest.skipIf(os.name == 'nt', 'The low-level FUSE API is not supported on Windows')
+class TestStartPassthroughFS_low_level_api(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.mounted_dir = determine_mountdir_based_on_os()
+        self.p = multiprocessing.Process(target=start_passthrough_fs,
+                                          kwargs={'mountpoint': self.mounted_dir,
+                                                  'root': self.temp_dir,
+                                                  'patterns': ['**/*.txt'],
+                                                  'cache_dir': self.cache_dir,
+                                                  'fuse_api': 'low-level'})
+        self.p.start()
+        time.sleep(5)
+        if not os.path.ismount(self.mounted_dir):
+            #tearDown is not called when setUp skips
+            self.tearDown()
+            self.skipTest('libfuse low-level API not available')
+
+    def test_create_read_write_and_list(self):
+        os.makedirs(os.path.join(self.mounted_dir, 'dir/sub'))
+        for name in ['dir/file.txt', 'dir/sub/file.bin']:
+            with open(os.path.join(self.mounted_dir, name), 'w') as f:
+                f.write('content')
+            with open(os.path.join(self.mounted_dir, name), 'r') as f:
+                self.assertEqual(f.read(), 'content')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.mounted_dir, 'dir'))), ['file.txt', 'sub'])
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'dir/file.txt')))
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, 'dir/sub/file.bin')))
+
+    def test_inode_stable_across_tiers(self):
+        file_path = os.path.join(self.mounted_dir, 'file.bin')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        ino = os.stat(file_path).st_ino
+        #Moves the file to the cache directory, then back
+        os.rename(file_path, os.path.join(self.mounted_dir, 'file.txt'))
+        self.assertEqual(os.stat(os.path.join(self.mounted_dir, 'file.txt')).st_ino, ino)
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'file.txt')))
+        os.rename(os.path.join(self.mounted_dir, 'file.txt'), file_path)
+        self.assertEqual(os.stat(file_path).st_ino, ino)
+
+    def test_attributes_and_unlink(self):
+        file_path = os.path.join(self.mounted_dir, 'file.bin')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        os.chmod(file_path, 0o640)
+        os.utime(file_path, (1000, 2000))
+        os.truncate(file_path, 3)
+        st = os.stat(file_path)
+        self.assertEqual((st.st_mode & 0o777, st.st_mtime, st.st_size), (0o640, 2000, 3))
+        #Still readable through the open descriptor once unlinked
+        with open(file_path, 'r') as f:
+            os.unlink(file_path)
+            self.assertEqual(f.read(), 'con')
+        self.assertFalse(os.path.exists(file_path))
+
+    def test_open_file_replaced_by_another(self):
+        file_path = os.path.join(self.mounted_dir, 'file.bin')
+        with open(file_path, 'w') as f:
+            f.write('old content')
+        with open(file_path, 'r+') as f:
+            #Written to a temporary file renamed over it, the open file keeps its own attributes
+            with open(file_path + '.tmp', 'w') as g:
+                g.write('new')
+            os.rename(file_path + '.tmp', file_path)
+            self.assertEqual(os.fstat(f.fileno()).st_size, 11)
+            os.ftruncate(f.fileno(), 3)
+            os.fchmod(f.fileno(), 0o600)
+            self.assertEqual(os.fstat(f.fileno()).st_size, 3)
+            self.assertEqual(f.read(), 'old')
+        st = os.stat(file_path)
+        self.assertEqual(st.st_size, 3)
+        with open(file_path, 'r') as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertNotEqual(st.st_mode & 0o777, 0o600)
+
+    def tearDown(self):
+        self.p.kill()
+        #unmount fs
+        os.system(f'fusermount -u {self.mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.mounted_dir, ignore_errors=True)
+
+@unittest.skipIf(os.name == 'nt', 'Unix sockets are not supported on Windows')
+class TestStartPassthroughFS_two_mounts_with_lock_server(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.socket_dir = tempfile.mkdtemp()
+        self.mounted_dirs = [determine_mountdir_based_on_os(), determine_mountdir_based_on_os()]
+        #Files matching the pattern but stored in the root directory, both mounts want to migrate them
+        for i in range(50):
+            with open(os.path.join(self.temp_dir, f'file{i}.txt'), 'w') as f:
+                f.write(f'content {i}')
+        self.processes = []
+        for mounted_dir in self.mounted_dirs:
+            # Both mounts share the cache directory, the lock server disables the cache tier index
+            p = multiprocessing.Process(target=start_passthrough_fs,
+                                        kwargs={'mountpoint': mounted_dir,
+                                                'root': self.temp_dir,
+                                                'patterns': ['**/*.txt'],
+                                                'cache_dir': self.cache_dir,
+                                                'lock_server': os.path.join(self.socket_dir, 'locks.sock')})
+            p.start()
+            self.processes.append(p)
+        time.sleep(5)
+
+    def test_concurrent_migrations(self):
+        def read_all(mounted_dir):
+            for i in range(50):
+                with open(os.path.join(mounted_dir, f'file{i}.txt'), 'r') as f:
+                    self.assertEqual(f.read(), f'content {i}')
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            for future in [executor.submit(read_all, mounted_dir) for mounted_dir in self.mounted_dirs * 2]:
+                future.result()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 50)
+        self.assertEqual([name for name in os.listdir(self.temp_dir) if name.endswith('.txt')], [])
+
+    def test_concurrent_renames(self):
+        def rename_all(mounted_dir, suffix):
+            for i in range(50):
+                try:
+                    os.rename(os.path.join(mounted_dir, f'file{i}.txt'), os.path.join(mounted_dir, f'file{i}.{suffix}.txt'))
+                except FileNotFoundError:
+                    #Renamed by the other mount first
+                    pass
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            for future in [executor.submit(rename_all, mounted_dir, suffix) for mounted_dir, suffix in zip(self.mounted_dirs, ['a', 'b'])]:
+                future.result()
+        #Every file was renamed exactly once
+        self.assertEqual(len(os.listdir(self.cache_dir)), 50)
+
+    def test_resolution_cached_by_the_other_mount(self):
+        first, second = self.mounted_dirs
+        with open(os.path.join(first, 'file0.txt'), 'r') as f:
+            self.assertEqual(f.read(), 'content 0')
+        #Removed through the second mount, then recreated in the root directory where the first mount did not resolve it
+        os.unlink(os.path.join(second, 'file0.txt'))
+        with open(os.path.join(self.temp_dir, 'file0.txt'), 'w') as f:
+            f.write('recreated')
+        with open(os.path.join(first, 'file0.txt'), 'r') as f:
+            self.assertEqual(f.read(), 'recreated')
+
+    def tearDown(self):
+        for p in self.processes:
+            p.kill()
+        #unmount fs
+        for mounted_dir in self.mounted_dirs:
+            if os.name != 'nt':
+                os.system(f'fusermount -u {mounted_dir}')
+        time.sleep(2)
+        #remove the temporary directories even if they are not empty
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+        for mounted_dir in self.mounted_dirs:
+            shutil.rmtree(mounted_dir, ignore_errors=True)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+from passthrough_support_excludeglob_fs import fuse_options
+from passthrough_support_excludeglob_fs.fuse_options import FUSE_OPTIONS, FUSE_PRESETS, fuse_session_options, supports_writeback_cache
+
+
+class TestFuseSessionOptions(unittest.TestCase):
+    def test_explicit_options(self):
+        self.assertEqual(fuse_session_options(None, {'max_write': 131072, 'big_writes': True, 'attr_timeout': 0.5, 'max_read': None}),
+                         {'max_write': 131072, 'big_writes': True, 'attr_timeout': 0.5})
+        #False flags are the FUSE defaults
+        self.assertEqual(fuse_session_options(None, {'kernel_cache': False, 'writeback_cache': False, 'default_permissions': False}), {})
+        self.assertEqual(fuse_session_options(None, {'default_permissions': True}), {'default_permissions': True})
+        self.assertEqual(fuse_session_options(), {})
+
+    def test_preset_overridden_by_explicit_options(self):
+        options = fuse_session_options('throughput', {'max_write': 65536, 'auto_cache': False})
+        self.assertEqual(options['max_write'], 65536)
+        self.assertEqual(options['max_background'], FUSE_PRESETS['throughput']['max_background'])
+        self.assertNotIn('auto_cache', options)
+
+    def test_presets_are_valid(self):
+        for preset, options in FUSE_PRESETS.items():
+            self.assertEqual(fuse_session_options(preset), options)
+            self.assertTrue(set(options) <= set(FUSE_OPTIONS))
+
+    def test_invalid(self):
+        for preset, options in [('unknown', {}), (None, {'max_write': 0}), (None, {'max_write': 1.5}), (None, {'big_writes': 1}),
+                                (None, {'attr_timeout': -1}), (None, {'attr_timeout': True}), (None, {'unknown': 1}), (None, {'max_idle_threads': 4}),
+                                (None, {'max_background': 4, 'congestion_threshold': 8}), ('throughput', {'max_background': 4})]:
+            with self.assertRaises(ValueError, msg=(preset, options)):
+                fuse_session_options(preset, options)
+
+    def test_writeback_cache_requires_libfuse_3(self):
+        for version, supported in [(26, False), (29, False), (300, True), (316, True)]:
+            with mock.patch.object(fuse_options, 'libfuse_version', return_value=version):
+                self.assertEqual(supports_writeback_cache(), supported, version)
+
+if __name__ == '__main__':
+    unittest.main()
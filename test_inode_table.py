@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+from passthrough_support_excludeglob_fs.inode_table import ROOT_INODE, InodeTable
+
+
+class TestInodeTable(unittest.TestCase):
+    def setUp(self):
+        self.table = InodeTable()
+
+    def test_root(self):
+        self.assertEqual(self.table.path_of(ROOT_INODE), '/')
+        self.assertEqual(self.table.ino_of('/'), ROOT_INODE)
+        #The root is never forgotten
+        self.table.forget(ROOT_INODE, 10)
+        self.assertEqual(self.table.path_of(ROOT_INODE), '/')
+
+    def test_lookup_and_forget(self):
+        ino = self.table.lookup('/a.txt')
+        self.assertNotEqual(ino, ROOT_INODE)
+        self.assertEqual(self.table.lookup('/a.txt'), ino)
+        self.assertNotEqual(self.table.lookup('/b.txt'), ino)
+        self.table.forget(ino, 1)
+        self.assertEqual(self.table.path_of(ino), '/a.txt')
+        self.table.forget(ino, 1)
+        self.assertIsNone(self.table.get(ino))
+        self.assertIsNone(self.table.ino_of('/a.txt'))
+        #Numbers are not reused
+        self.assertNotEqual(self.table.lookup('/a.txt'), ino)
+        self.assertEqual(self.table.stats(), {'inodes': 3, 'lookups': 4, 'forgotten': 1})
+
+    def test_unlinked_inode_outlives_its_path(self):
+        ino = self.table.lookup('/a.txt')
+        self.table.opened(ino, 7)
+        self.table.unlink('/a.txt')
+        self.assertIsNone(self.table.ino_of('/a.txt'))
+        #Detached, only reachable through its open files
+        self.assertIsNone(self.table.path_of(ino))
+        self.assertEqual(self.table.get(ino).handles, {7})
+        self.table.released(ino, 7)
+        self.assertEqual(self.table.get(ino).handles, set())
+        #A new file with the same name gets a new inode, forgetting the old one leaves it alone
+        new_ino = self.table.lookup('/a.txt')
+        self.assertNotEqual(new_ino, ino)
+        self.table.forget(ino, 1)
+        self.assertEqual(self.table.ino_of('/a.txt'), new_ino)
+
+    def test_rename_directory(self):
+        directory = self.table.lookup('/dir')
+        child = self.table.lookup('/dir/sub/file.txt')
+        sibling = self.table.lookup('/dir2')
+        replaced = self.table.lookup('/new')
+        self.table.rename('/dir', '/new')
+        self.assertEqual(self.table.path_of(directory), '/new')
+        self.assertEqual(self.table.path_of(child), '/new/sub/file.txt')
+        self.assertEqual(self.table.ino_of('/new/sub/file.txt'), child)
+        self.assertIsNone(self.table.ino_of('/dir'))
+        #Only the paths below the renamed directory move
+        self.assertEqual(self.table.path_of(sibling), '/dir2')
+        #The replaced destination is detached until the kernel forgets it
+        self.assertEqual(self.table.ino_of('/new'), directory)
+        self.assertIsNone(self.table.path_of(replaced))
+        self.table.forget(replaced, 1)
+        self.assertEqual(self.table.ino_of('/new'), directory)
+        #Renaming a path onto itself detaches nothing
+        self.table.rename('/new', '/new')
+        self.assertEqual(self.table.path_of(directory), '/new')
+
+    def test_rename_only_visits_the_renamed_subtree(self):
+        inos = [self.table.lookup(f'/other{i}/file') for i in range(100)]
+        child = self.table.lookup('/dir/sub/file.txt')
+        with mock.patch.object(self.table.index, 'pop_subtree', wraps=self.table.index.pop_subtree) as pop_subtree:
+            self.table.rename('/dir', '/moved')
+        self.assertEqual(pop_subtree.call_args.args, ('/dir',))
+        self.assertEqual(self.table.path_of(child), '/moved/sub/file.txt')
+        self.table.rename('/moved/sub', '/sub')
+        self.assertEqual(self.table.path_of(child), '/sub/file.txt')
+        #Nothing is left indexed once every inode is forgotten
+        for ino in [*inos, child]:
+            self.table.forget(ino, 1)
+        self.assertEqual(self.table.index.children, {})
+    def test_resolved_path_is_forgotten_on_changes(self):
+        directory = self.table.lookup('/dir')
+        child = self.table.lookup('/dir/file.txt')
+        self.assertIsNone(self.table.resolved('/dir/file.txt'))
+        self.table.set_resolved('/dir', '/root/dir')
+        self.table.set_resolved('/dir/file.txt', '/cache/dir/file.txt')
+        #Unknown paths are not resolved through the table
+        self.table.set_resolved('/unknown', '/root/unknown')
+        self.assertIsNone(self.table.resolved('/unknown'))
+        self.assertEqual(self.table.resolved('/dir/file.txt'), '/cache/dir/file.txt')
+        self.table.invalidate('/dir')
+        self.assertIsNone(self.table.resolved('/dir'))
+        self.assertEqual(self.table.resolved('/dir/file.txt'), '/cache/dir/file.txt')
+        self.table.invalidate('/dir', recursive=True)
+        self.assertIsNone(self.table.resolved('/dir/file.txt'))
+        #A renamed or detached inode must be resolved again
+        self.table.set_resolved('/dir/file.txt', '/cache/dir/file.txt')
+        self.table.rename('/dir', '/new')
+        self.assertIsNone(self.table.resolved('/new/file.txt'))
+        self.table.set_resolved('/new/file.txt', '/cache/new/file.txt')
+        self.table.unlink('/new/file.txt')
+        self.assertIsNone(self.table.get(child).right_path)
+        self.assertEqual(self.table.path_of(directory), '/new')
+
+if __name__ == '__main__':
+    unittest.main()
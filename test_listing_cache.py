@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import time
+import unittest
+
+from passthrough_support_excludeglob_fs.listing_cache import DirectoryListingCache, directory_validator
+
+OLD = time.time_ns() - 10_000_000_000
+
+
+class TestDirectoryListingCache(unittest.TestCase):
+    def test_validated_by_both_directories(self):
+        cache = DirectoryListingCache()
+        validators = ((OLD, 1), (OLD, 2))
+        cache.set('/d', validators, ['a', 'b'])
+        self.assertEqual(cache.get('/d', validators), ('a', 'b'))
+        #The cache tier directory changed
+        self.assertIsNone(cache.get('/d', ((OLD, 1), (OLD + 1, 2))))
+        #Dropped on mismatch
+        self.assertIsNone(cache.get('/d', validators))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_recently_modified_directory_is_not_cached(self):
+        cache = DirectoryListingCache()
+        cache.set('/d', ((time.time_ns(), 1), None), ['a'])
+        self.assertFalse(cache.contains('/d'))
+
+    def test_update_in_place(self):
+        cache = DirectoryListingCache()
+        cache.set('/d', ((OLD, 1), None), ['a', 'b'])
+        cache.update('/d', 'c', True, ((OLD + 1, 1), None))
+        cache.update('/d', 'a', False, ((OLD + 2, 1), None))
+        self.assertEqual(cache.get('/d', ((OLD + 2, 1), None)), ('b', 'c'))
+        self.assertEqual(cache.stats()['entries'], 2)
+        #Unknown listing
+        cache.update('/other', 'a', True, ((OLD, 1), None))
+        self.assertFalse(cache.contains('/other'))
+
+    def test_total_entries_budget(self):
+        cache = DirectoryListingCache(max_entries=5)
+        cache.set('/a', ((OLD, 1), None), ['1', '2'])
+        cache.set('/b', ((OLD, 2), None), ['1', '2'])
+        cache.get('/a', ((OLD, 1), None))
+        cache.set('/c', ((OLD, 3), None), ['1', '2'])
+        #Least recently used evicted
+        self.assertFalse(cache.contains('/b'))
+        self.assertTrue(cache.contains('/a'))
+        self.assertEqual(cache.stats()['entries'], 4)
+        #Larger than the whole budget
+        cache.set('/huge', ((OLD, 4), None), [str(i) for i in range(6)])
+        self.assertFalse(cache.contains('/huge'))
+
+    def test_disabled(self):
+        cache = DirectoryListingCache(max_entries=0)
+        cache.set('/d', ((OLD, 1), None), [])
+        self.assertFalse(cache.contains('/d'))
+
+    def test_invalidate_recursive(self):
+        cache = DirectoryListingCache()
+        for path in ['/d', '/d/sub', '/dd']:
+            cache.set(path, ((OLD, 1), None), ['a'])
+        cache.invalidate('/d', recursive=True)
+        self.assertFalse(cache.contains('/d'))
+        self.assertFalse(cache.contains('/d/sub'))
+        self.assertTrue(cache.contains('/dd'))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_directory_validator(self):
+        directory = tempfile.mkdtemp()
+        validator = directory_validator(directory)
+        self.assertEqual(validator[1], os.stat(directory).st_ino)
+        self.assertIsNone(directory_validator(os.path.join(directory, 'missing')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from passthrough_support_excludeglob_fs import lock_server
+from passthrough_support_excludeglob_fs.lock_server import MAX_IDLE_CONNECTIONS, LockClient
+
+
+@unittest.skipIf(os.name == 'nt', 'Unix sockets are not supported on Windows')
+class TestLockServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'locks.sock')
+        self.clients = []
+
+    def tearDown(self):
+        for client in reversed(self.clients):
+            client.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def mount(self, **kwargs):
+        client = LockClient(self.socket_path, '/shared/root', **kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_first_mount_hosts_the_server(self):
+        first = self.mount()
+        second = self.mount()
+        self.assertTrue(first.stats()['host'])
+        self.assertFalse(second.stats()['host'])
+
+    def test_two_mounts_are_serialized(self):
+        first = self.mount()
+        second = self.mount()
+        inside = []
+        overlaps = []
+        def work(client):
+            for _ in range(50):
+                with client.locked('/dir/file', '/dir'):
+                    if inside:
+                        overlaps.append(1)
+                    inside.append(client)
+                    time.sleep(0.0005)
+                    inside.remove(client)
+        threads = [threading.Thread(target=work, args=(client,)) for client in (first, second, first, second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(overlaps, [])
+        self.assertEqual(first.stats()['server']['held'], 0)
+
+    def test_reentrant_for_the_owner(self):
+        client = self.mount()
+        with client.locked('/a'):
+            with client.locked('/a'):
+                pass
+            self.assertEqual(client.stats()['server']['held'], 1)
+        self.assertEqual(client.stats()['server']['held'], 0)
+
+    def test_lease_of_a_crashed_mount_expires(self):
+        survivor = self.mount(lease=0.3, timeout=5)
+        crashed = self.mount(lease=0.3, timeout=5)
+        crashed.acquire('/file')
+        #Simulate the crash: the heartbeats stop and the lock is never released
+        crashed.stop_event.set()
+        crashed.heartbeat.join()
+        start = time.monotonic()
+        with survivor.locked('/file'):
+            self.assertGreater(time.monotonic() - start, 0.1)
+        self.assertEqual(survivor.stats()['server']['expired'], 1)
+
+    def test_heartbeats_keep_the_lease(self):
+        holder = self.mount(lease=0.3, timeout=0.5)
+        waiter = self.mount(lease=0.3, timeout=0.5)
+        with holder.locked('/file'):
+            with self.assertRaises(OSError):
+                waiter.acquire('/file')
+
+    def test_another_mount_takes_over_when_the_host_leaves(self):
+        host = self.mount(lease=0.5)
+        other = self.mount(lease=0.5)
+        with other.locked('/a'):
+            pass
+        self.clients.remove(host)
+        host.close()
+        with other.locked('/a'):
+            pass
+        self.assertTrue(other.stats()['host'])
+
+    def test_leases_are_reclaimed_after_a_takeover(self):
+        host = self.mount(lease=0.5)
+        holder = self.mount(lease=0.5)
+        holder.acquire('/a')
+        self.clients.remove(host)
+        host.close()
+        #The holder notices it with its next request or heartbeat, takes over and reclaims its lease
+        self.assertTrue(holder.stats()['host'])
+        self.assertEqual(holder.stats()['server']['reclaimed'], 1)
+        newcomer = self.mount(lease=0.5, timeout=1.5)
+        with self.assertRaises(OSError):
+            newcomer.acquire('/a')
+        holder.release('/a')
+        with newcomer.locked('/a'):
+            pass
+
+    def test_connections_are_shared_by_the_threads(self):
+        client = self.mount()
+        barrier = threading.Barrier(4 * MAX_IDLE_CONNECTIONS)
+        def work(index):
+            barrier.wait(10)
+            with client.locked(f'/file{index}'):
+                pass
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(4 * MAX_IDLE_CONNECTIONS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        #The connections of the threads that exited are not kept
+        self.assertLessEqual(client.stats()['connections'], MAX_IDLE_CONNECTIONS)
+
+    def test_locks_are_hierarchical(self):
+        first = self.mount(timeout=0.5)
+        second = self.mount(timeout=0.5)
+        with first.locked('/dir'):
+            with self.assertRaises(OSError):
+                second.acquire('/dir/sub/file')
+            #Nested locks covered by the one of the directory are not taken again, they cannot be out of order
+            with first.locked('/dir/sub/file', '/dir'):
+                self.assertEqual(first.stats()['server']['held'], 1)
+        with second.locked('/dir/sub/file'):
+            with self.assertRaises(OSError):
+                first.acquire('/dir')
+            with self.assertRaises(OSError):
+                first.acquire('/')
+            with first.locked('/dir/other'):
+                pass
+
+    def test_a_host_that_stops_answering_times_out(self):
+        import fcntl
+        #A hung host: it keeps the election lock and its socket accepts connections, but never answers
+        host_lock_fd = os.open(self.socket_path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(host_lock_fd, fcntl.LOCK_EX)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(16)
+        try:
+            with mock.patch.object(lock_server, 'RESPONSE_MARGIN', 0.2):
+                client = self.mount(lease=60, timeout=0.3)
+                start = time.monotonic()
+                with self.assertRaises(OSError):
+                    client.acquire('/a')
+                self.assertLess(time.monotonic() - start, 10)
+        finally:
+            listener.close()
+            os.close(host_lock_fd)
+
+    def test_namespaces_do_not_conflict(self):
+        first = self.mount(timeout=0.5)
+        second = LockClient(self.socket_path, '/other/root', timeout=0.5)
+        self.clients.append(second)
+        with first.locked('/file'):
+            with second.locked('/file'):
+                pass
+
+if __name__ == '__main__':
+    unittest.main()
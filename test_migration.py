@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import contextlib
+import errno
+import stat
+import threading
+import unittest
+from unittest import mock
+
+from passthrough_support_excludeglob_fs.file_handles import FileHandleTable
+from passthrough_support_excludeglob_fs.migration import MigrationQueue, clone_or_copy, move_between_tiers, replace_across_tiers, same_device
+
+
+class RecordingFS:
+    """Provides what the migration queue needs from the filesystem."""
+
+    def __init__(self):
+        self.path_lock = threading.Lock()
+        self.invalidated = []
+        self.tiers_share_device = True
+        self.file_handles = FileHandleTable()
+
+    def get_filelock_for_path(self, path):
+        return self.path_lock
+
+    def cross_mount_lock(self, *paths):
+        return contextlib.nullcontext()
+
+    def invalidate_caches(self, path, recursive=False):
+        self.invalidated.append((path, recursive))
+
+
+class TestMigrationQueue(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.fs = RecordingFS()
+        self.queue = MigrationQueue(self.fs, max_workers=2)
+
+    def tearDown(self):
+        self.queue.shutdown()
+        shutil.rmtree(self.root, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_move_between_tiers_creates_parents(self):
+        source = os.path.join(self.root, 'file.txt')
+        with open(source, 'w') as f:
+            f.write('content')
+        destination = os.path.join(self.cache_dir, 'a', 'b', 'file.txt')
+        move_between_tiers(source, destination)
+        self.assertFalse(os.path.exists(source))
+        with open(destination) as f:
+            self.assertEqual(f.read(), 'content')
+
+    def test_same_device(self):
+        self.assertTrue(same_device(self.root, self.cache_dir))
+        self.assertFalse(same_device(self.root, os.path.join(self.cache_dir, 'missing')))
+
+    def test_move_between_tiers_falls_back_to_copy_across_devices(self):
+        os.makedirs(os.path.join(self.root, 'dir'))
+        with open(os.path.join(self.root, 'dir', 'file.txt'), 'w') as f:
+            f.write('content')
+        os.symlink('file.txt', os.path.join(self.root, 'dir', 'link'))
+        cross_device = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with mock.patch('os.rename', side_effect=cross_device):
+            move_between_tiers(os.path.join(self.root, 'dir'), os.path.join(self.cache_dir, 'dir'), same_device=True)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'dir')))
+        with open(os.path.join(self.cache_dir, 'dir', 'file.txt')) as f:
+            self.assertEqual(f.read(), 'content')
+        self.assertEqual(os.readlink(os.path.join(self.cache_dir, 'dir', 'link')), 'file.txt')
+
+    def test_clone_or_copy_keeps_content_and_mode(self):
+        source = os.path.join(self.root, 'file.bin')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(100000))
+        os.chmod(source, 0o640)
+        destination = os.path.join(self.cache_dir, 'file.bin')
+        clone_or_copy(source, destination)
+        with open(source, 'rb') as f, open(destination, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(stat.S_IMODE(os.stat(destination).st_mode), 0o640)
+
+    def test_replace_across_tiers(self):
+        source = os.path.join(self.root, 'file.txt')
+        destination = os.path.join(self.cache_dir, 'file.txt')
+        for content in ('first', 'second'):
+            with open(source, 'w') as f:
+                f.write(content)
+            real_replace = os.replace
+            calls = []
+            def replace(src, dst):
+                calls.append(src)
+                # Only the final replace of the temporary copy is on the same device
+                if src == source:
+                    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+                return real_replace(src, dst)
+            with mock.patch('os.replace', side_effect=replace):
+                replace_across_tiers(source, destination)
+            self.assertEqual(len(calls), 2)
+            self.assertFalse(os.path.exists(source))
+            with open(destination) as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.cache_dir), ['file.txt'])
+
+    def test_migrate_file_and_directory(self):
+        with open(os.path.join(self.root, 'file.txt'), 'w') as f:
+            f.write('12345')
+        os.makedirs(os.path.join(self.root, 'dir', 'sub'))
+        self.queue.submit('/file.txt', os.path.join(self.root, 'file.txt'), os.path.join(self.cache_dir, 'file.txt'))
+        self.queue.submit('/dir', os.path.join(self.root, 'dir'), os.path.join(self.cache_dir, 'dir'))
+        self.assertTrue(self.queue.drain(timeout=10))
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, 'file.txt')))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'dir', 'sub')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'dir')))
+        #Only the directory has entries cached below it
+        self.assertCountEqual(self.fs.invalidated, [('/file.txt', False), ('/dir', True)])
+        stats = self.queue.stats()
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['bytes_moved'], 5)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_single_flight(self):
+        source = os.path.join(self.root, 'file.txt')
+        with open(source, 'w') as f:
+            f.write('content')
+        # Hold the path lock so that the first migration stays pending
+        with self.fs.path_lock:
+            for _ in range(10):
+                self.queue.submit('/file.txt', source, os.path.join(self.cache_dir, 'file.txt'))
+            self.assertEqual(self.queue.stats()['queued'], 1)
+        self.assertTrue(self.queue.drain(timeout=10))
+        self.assertEqual(self.queue.stats()['completed'], 1)
+
+    def test_skip_vanished_source(self):
+        self.queue.submit('/missing.txt', os.path.join(self.root, 'missing.txt'), os.path.join(self.cache_dir, 'missing.txt'))
+        self.assertTrue(self.queue.drain(timeout=10))
+        stats = self.queue.stats()
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['completed'], 0)
+        self.assertEqual(self.fs.invalidated, [])
+
+    def test_replace_across_tiers_does_not_copy_an_open_source(self):
+        source = os.path.join(self.root, 'file.txt')
+        destination = os.path.join(self.cache_dir, 'file.txt')
+        with open(source, 'w') as f:
+            f.write('content')
+        with mock.patch('os.replace', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            with self.assertRaises(OSError) as raised:
+                replace_across_tiers(source, destination, source_open=True)
+        self.assertEqual(raised.exception.errno, errno.EXDEV)
+        self.assertTrue(os.path.exists(source))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_open_file_is_not_copied_away(self):
+        #A real second device when /dev/shm is a separate tmpfs, otherwise the copy is forced
+        if os.path.isdir('/dev/shm') and not same_device('/dev/shm', self.cache_dir):
+            shutil.rmtree(self.root)
+            self.root = tempfile.mkdtemp(dir='/dev/shm')
+        self.fs.tiers_share_device = False
+        source = os.path.join(self.root, 'main.o')
+        destination = os.path.join(self.cache_dir, 'main.o')
+        with open(source, 'w') as f:
+            f.write('old')
+        fd = os.open(source, os.O_WRONLY | os.O_APPEND)
+        self.fs.file_handles.add(fd, '/main.o', source, 'full', os.O_WRONLY | os.O_APPEND)
+        self.queue.submit('/main.o', source, destination)
+        self.assertTrue(self.queue.drain(timeout=10))
+        self.assertEqual(self.queue.stats()['postponed'], 1)
+        self.assertEqual(self.queue.stats()['completed'], 0)
+        self.assertFalse(os.path.exists(destination))
+        #Written after the migration was attempted, released afterwards
+        os.write(fd, b'NEW')
+        self.fs.file_handles.remove(fd)
+        os.close(fd)
+        self.queue.resume(source)
+        self.assertTrue(self.queue.drain(timeout=10))
+        with open(destination) as f:
+            self.assertEqual(f.read(), 'oldNEW')
+        self.assertFalse(os.path.exists(source))
+        self.assertEqual(self.queue.stats()['postponed'], 0)
+        self.assertEqual(self.queue.stats()['completed'], 1)
+
+    def test_directory_with_open_file_is_postponed(self):
+        self.fs.tiers_share_device = False
+        os.makedirs(os.path.join(self.root, 'dir', 'sub'))
+        inner = os.path.join(self.root, 'dir', 'sub', 'file')
+        with open(inner, 'w') as f:
+            f.write('content')
+        fd = os.open(inner, os.O_RDONLY)
+        self.fs.file_handles.add(fd, '/dir/sub/file', inner, 'full', os.O_RDONLY)
+        self.queue.submit('/dir', os.path.join(self.root, 'dir'), os.path.join(self.cache_dir, 'dir'))
+        self.assertTrue(self.queue.drain(timeout=10))
+        self.assertEqual(self.queue.stats()['postponed'], 1)
+        self.fs.file_handles.remove(fd)
+        os.close(fd)
+        self.queue.resume(inner)
+        self.assertTrue(self.queue.drain(timeout=10))
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, 'dir', 'sub', 'file')))
+
+if __name__ == '__main__':
+    unittest.main()
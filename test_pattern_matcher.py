@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import itertools
+import random
+import unittest
+
+from globmatch import glob_match
+from passthrough_support_excludeglob_fs.pattern_matcher import PatternMatcher, PatternPolicy
+
+# Patterns used in the test suites, the README and typical mounts
+PATTERNS = [
+    '**/*.txt', '**/*.txt/*', '**/*.config', '**/exc/*', '**/,test=file.txt', '**/ exc dir/*',
+    '**/*.log/*', '**/*.tmp/*', '**/node_modules/**', '**/*.o', '**/__pycache__/**', '**/build/**',
+    '**/.venv/**', '**/logs', '/build/**', '/src/*.c', '*/a', '**/[abc]*.py', '**/[!a]?.py',
+    '**/data/**/*.bin', '**/??.md', '**', '**/*', '/**/x/**/y', '**/.git*', 'src/**', '**/a[', '**/b]c',
+]
+
+SEGMENTS = [
+    'a', 'b', 'c', 'x', 'y', 'ab', 'src', 'build', 'exc', ' exc dir', 'logs', 'data', 'node_modules',
+    '__pycache__', '.venv', '.git', '.gitignore', 'file.txt', 'file.txt.bak', 'notes.config', 'main.o',
+    'main.c', 'app.py', 'a1.py', 'bb.py', 'README.md', 'ab.md', 'abc.md', 'run.log', 'tmp.tmp', 'x.bin',
+    ',test=file.txt', 'a[', 'b]c', 'UPPER.TXT', 'dir.txt', '',
+]
+
+
+def generate_paths(count, seed=0):
+    rng = random.Random(seed)
+    paths = set()
+    # Every path up to depth 2 over a subset of the vocabulary
+    small_vocabulary = SEGMENTS[:12] + ['file.txt', 'main.o', 'a1.py']
+    for depth in (1, 2):
+        for parts in itertools.product(small_vocabulary, repeat=depth):
+            paths.add('/' + '/'.join(parts))
+    while len(paths) < count:
+        depth = rng.randint(1, 7)
+        path = '/' + '/'.join(rng.choice(SEGMENTS) for _ in range(depth))
+        if rng.random() < 0.05:
+            path += '/'
+        paths.add(path)
+    return sorted(paths)
+
+
+class TestPatternMatcherEquivalence(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.paths = generate_paths(20000)
+
+    def assert_equivalent(self, patterns):
+        matcher = PatternMatcher(patterns)
+        for path in self.paths:
+            expected = glob_match(path, patterns)
+            self.assertEqual(matcher.match(path), expected, f'{path!r} against {patterns!r}')
+            #is_excluded relies on the subtree verdict of the parent directory when it is decided
+            if not path.endswith('/'):
+                self.assertEqual(matcher.is_excluded(path), expected, f'{path!r} against {patterns!r} with verdict {matcher.subtree_verdict(path.rpartition("/")[0] or "/")}')
+
+    def test_each_pattern_alone(self):
+        for pattern in PATTERNS:
+            self.assert_equivalent([pattern])
+
+    def test_all_patterns(self):
+        self.assert_equivalent(PATTERNS)
+
+    def test_random_pattern_subsets(self):
+        rng = random.Random(1)
+        for _ in range(10):
+            self.assert_equivalent(rng.sample(PATTERNS, rng.randint(2, 8)))
+
+    def test_no_patterns(self):
+        for patterns in (None, []):
+            matcher = PatternMatcher(patterns)
+            self.assertFalse(matcher.match('/file.txt'))
+
+    def test_subtree_verdicts(self):
+        matcher = PatternMatcher(['**/build/**', '**/.venv/**', '**/*.o'])
+        self.assertEqual(matcher.subtree_verdict('/'), 'mixed')
+        self.assertEqual(matcher.subtree_verdict('/project/build'), 'always')
+        self.assertEqual(matcher.subtree_verdict('/project/build/deep/er'), 'always')
+        self.assertEqual(matcher.subtree_verdict('/project/src'), 'mixed')
+        matcher = PatternMatcher(['/src/*.c', '/build/**'])
+        self.assertEqual(matcher.subtree_verdict('/'), 'mixed')
+        self.assertEqual(matcher.subtree_verdict('/docs'), 'never')
+        self.assertEqual(matcher.subtree_verdict('/docs/deep'), 'never')
+        self.assertEqual(PatternMatcher([]).subtree_verdict('/docs'), 'never')
+        #Negated brackets are matched with a regex that cannot be evaluated on a prefix
+        self.assertEqual(PatternMatcher(['/src/[!a]']).subtree_verdict('/docs'), 'mixed')
+
+    def test_decided_subtree_skips_matching(self):
+        matcher = PatternMatcher(['**/build/**'])
+        for i in range(10):
+            self.assertTrue(matcher.is_excluded(f'/project/build/file{i}'))
+        self.assertEqual(matcher.stats()['memo_misses'], 0)
+        self.assertEqual(matcher.stats()['verdict_skips'], 10)
+
+    def test_memo(self):
+        matcher = PatternMatcher(['**/*.txt'], memo_size=2)
+        for _ in range(3):
+            self.assertTrue(matcher.match('/a/file.txt'))
+        stats = matcher.stats()
+        self.assertEqual(stats['memo_hits'], 2)
+        self.assertEqual(stats['memo_misses'], 1)
+        matcher.match('/b')
+        matcher.match('/c')
+        self.assertEqual(matcher.stats()['memo_entries'], 2)
+
+class TestPatternPolicy(unittest.TestCase):
+    def test_first_matching_pattern_wins(self):
+        policy = PatternPolicy({'**/build/**': 'build', '**/*.o': 'object'}, 'default')
+        self.assertEqual(policy.lookup('/project/build/main.o'), 'build')
+        self.assertEqual(policy.lookup('/project/main.o'), 'object')
+        self.assertEqual(policy.lookup('/project/main.c'), 'default')
+        self.assertEqual(policy.values(), {'build', 'object', 'default'})
+
+    def test_no_patterns(self):
+        for mapping in (None, {}):
+            self.assertEqual(PatternPolicy(mapping, 1.0).lookup('/a'), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
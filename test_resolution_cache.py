@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import threading
+import time
+import unittest
+
+from passthrough_support_excludeglob_fs.resolution_cache import AttributeCache, ResolutionCache, NegativeLookupCache, SubtreeIndex
+
+
+class TestResolutionCache(unittest.TestCase):
+    def test_hit_and_miss_counters(self):
+        cache = ResolutionCache(16)
+        self.assertIsNone(cache.get('/a'))
+        cache.set('/a', 'full', '/root/a')
+        self.assertEqual(cache.get('/a'), ('full', '/root/a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_bounded_lru(self):
+        cache = ResolutionCache(2)
+        cache.set('/a', 'full', '/root/a')
+        cache.set('/b', 'cache', '/cache/b')
+        #Touch /a so that /b becomes the least recently used entry
+        cache.get('/a')
+        cache.set('/c', 'full', '/root/c')
+        self.assertIsNotNone(cache.get('/a'))
+        self.assertIsNone(cache.get('/b'))
+        self.assertIsNotNone(cache.get('/c'))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_disabled(self):
+        cache = ResolutionCache(0)
+        cache.set('/a', 'full', '/root/a')
+        self.assertIsNone(cache.get('/a'))
+
+    def test_invalidate_recursive(self):
+        cache = ResolutionCache(16)
+        cache.set('/dir', 'full', '/root/dir')
+        cache.set('/dir/file', 'full', '/root/dir/file')
+        cache.set('/dir2', 'full', '/root/dir2')
+        cache.invalidate('/dir')
+        self.assertIsNone(cache.get('/dir'))
+        self.assertIsNotNone(cache.get('/dir/file'))
+        cache.invalidate('/dir', recursive=True)
+        self.assertIsNone(cache.get('/dir/file'))
+        #A sibling sharing the same prefix must survive
+        self.assertIsNotNone(cache.get('/dir2'))
+
+    def test_invalidate_deep_subtree_after_eviction(self):
+        cache = ResolutionCache(3)
+        cache.set('/a/b/c/d', 'full', '/root/a/b/c/d')
+        cache.set('/a/x', 'full', '/root/a/x')
+        cache.set('/a/b/e', 'full', '/root/a/b/e')
+        #Evicts /a/b/c/d, the index must forget /a/b/c
+        cache.set('/z', 'full', '/root/z')
+        self.assertNotIn('/a/b/c', cache.index.children)
+        cache.invalidate('/a/b', recursive=True)
+        self.assertIsNone(cache.get('/a/b/e'))
+        self.assertIsNotNone(cache.get('/a/x'))
+        cache.invalidate('/a/x')
+        self.assertEqual(cache.index.children, {'/': {'/z'}})
+
+    def test_concurrent_access(self):
+        cache = ResolutionCache(64)
+        def worker(n):
+            for i in range(1000):
+                cache.set(f'/{n}/{i}', 'full', f'/root/{n}/{i}')
+                cache.get(f'/{n}/{i // 2}')
+                if i % 10 == 0:
+                    cache.invalidate(f'/{n}', recursive=True)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(cache.stats()['entries'], 64)
+    def test_index_matches_entries(self):
+        cache = ResolutionCache(64)
+        def worker(n):
+            for i in range(500):
+                cache.set(f'/{n}/{i % 7}/{i}', 'full', '')
+                if i % 13 == 0:
+                    cache.invalidate(f'/{n}/{i % 7}', recursive=True)
+                if i % 5 == 0:
+                    cache.invalidate(f'/{n}/{i % 7}/{i - 1}')
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        #Every indexed path is a key or leads to one, and every key is indexed
+        rebuilt = SubtreeIndex()
+        for key in cache.entries:
+            rebuilt.add(key)
+        self.assertEqual(cache.index.children, rebuilt.children)
+
+
+class TestNegativeLookupCache(unittest.TestCase):
+    def test_add_and_contains(self):
+        cache = NegativeLookupCache(ttl=60, max_entries=16)
+        self.assertFalse(cache.contains('/missing'))
+        cache.add('/missing')
+        self.assertTrue(cache.contains('/missing'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_ttl_expiry(self):
+        cache = NegativeLookupCache(ttl=0.2, max_entries=16)
+        cache.add('/missing')
+        self.assertTrue(cache.contains('/missing'))
+        time.sleep(0.3)
+        self.assertFalse(cache.contains('/missing'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_size_bound(self):
+        cache = NegativeLookupCache(ttl=60, max_entries=3)
+        for i in range(10):
+            cache.add(f'/missing{i}')
+        self.assertEqual(cache.stats()['entries'], 3)
+        self.assertTrue(cache.contains('/missing9'))
+        self.assertFalse(cache.contains('/missing0'))
+
+    def test_disabled(self):
+        cache = NegativeLookupCache(ttl=0)
+        cache.add('/missing')
+        self.assertFalse(cache.contains('/missing'))
+
+    def test_invalidate_recursive(self):
+        cache = NegativeLookupCache(ttl=60)
+        cache.add('/dir/missing')
+        cache.add('/dir')
+        cache.invalidate('/dir', recursive=True)
+        self.assertFalse(cache.contains('/dir'))
+        self.assertFalse(cache.contains('/dir/missing'))
+
+
+class TestAttributeCache(unittest.TestCase):
+    def test_set_and_get(self):
+        cache = AttributeCache(ttl=60, max_entries=16)
+        self.assertIsNone(cache.get('/a'))
+        cache.set('/a', {'st_size': 1})
+        self.assertEqual(cache.get('/a'), {'st_size': 1})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_ttl_expiry(self):
+        cache = AttributeCache(ttl=0.2, max_entries=16)
+        cache.set('/a', {'st_size': 1})
+        time.sleep(0.3)
+        self.assertIsNone(cache.get('/a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_size_bound(self):
+        cache = AttributeCache(ttl=60, max_entries=3)
+        for i in range(10):
+            cache.set(f'/a{i}', {'st_size': i})
+        self.assertEqual(cache.stats()['entries'], 3)
+        self.assertIsNone(cache.get('/a0'))
+        self.assertEqual(cache.get('/a9'), {'st_size': 9})
+
+    def test_disabled(self):
+        for cache in [AttributeCache(ttl=0), AttributeCache(max_entries=0)]:
+            self.assertFalse(cache.enable)
+            cache.set('/a', {'st_size': 1})
+            self.assertIsNone(cache.get('/a'))
+
+    def test_invalidate_recursive(self):
+        cache = AttributeCache(ttl=60)
+        cache.set('/dir', {'st_size': 0})
+        cache.set('/dir/a', {'st_size': 1})
+        cache.set('/dirb', {'st_size': 2})
+        cache.invalidate('/dir', recursive=True)
+        self.assertIsNone(cache.get('/dir'))
+        self.assertIsNone(cache.get('/dir/a'))
+        self.assertIsNotNone(cache.get('/dirb'))
+
+    def test_ttl_per_pattern(self):
+        cache = AttributeCache(ttl=0.2, patterns={'**/*.whl': 60, '**/src/**': 0})
+        cache.set('/dist/a.whl', {'st_size': 1})
+        cache.set('/dist/a.txt', {'st_size': 2})
+        cache.set('/src/main.py', {'st_size': 3})
+        self.assertIsNone(cache.get('/src/main.py'))
+        time.sleep(0.3)
+        self.assertEqual(cache.get('/dist/a.whl'), {'st_size': 1})
+        self.assertIsNone(cache.get('/dist/a.txt'))
+        #Disabled by default but not for some patterns
+        self.assertTrue(AttributeCache(ttl=0, patterns={'**/*.whl': 60}).enable)
+
+    def test_stale_set_is_dropped(self):
+        cache = AttributeCache(ttl=60)
+        #Attributes read before an invalidation
+        generation = cache.generation
+        cache.invalidate('/a')
+        cache.set('/a', {'st_size': 1}, generation)
+        self.assertIsNone(cache.get('/a'))
+        cache.set('/a', {'st_size': 2}, cache.generation)
+        self.assertEqual(cache.get('/a'), {'st_size': 2})
+
+if __name__ == '__main__':
+    unittest.main()